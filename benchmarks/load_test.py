@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+"""
+An end-to-end load test: the bot runs as in production, but its XMPP stream is connected to an
+in-process MUC stand-in and its REST calls go to a local HTTP stand-in of the HipChat API.
+Simulated users send commands to the room, each user waits for its previous command to be handled
+(and thinks for a while) before sending the next one. The throughput, the latency percentiles and
+the errors are reported per command.
+
+The commands are picked at random from a weighted mix, or taken in order from a script file with
+one command per line (e.g. "!IM_OFF <date>"), where <date> is replaced by a date in the next weeks.
+
+The latency of a command is the time from writing its stanza to the bot's XML stream until its
+handler is done, including the Deferred it returns (e.g. writing the days-off file). The commands
+of the same name are assumed to finish in the order they were dispatched, which holds for the
+built-in commands since their writes to the same file are serialized.
+
+The HipChat API is only served over HTTPS, which needs pyOpenSSL, so the REST stand-in is served
+over plain HTTP and the bot's API URLs are redirected to it.
+
+Usage: python benchmarks/load_test.py [--users N] [--requests N] [--script FILE] [--think MS] ...
+"""
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from urllib import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from twisted.internet import reactor  # noqa
+from twisted.python import log  # noqa
+from twisted.web import resource, server  # noqa
+from twisted.web.client import getPage  # noqa
+from twisted.words.protocols.jabber import xmlstream  # noqa
+from twisted.words.protocols.jabber.jid import JID  # noqa
+from twisted.words.xish import domish  # noqa
+
+from bot.bot import Bot  # noqa
+from bot.loop_monitor import get_percentile  # noqa
+from bot.util.log_pipeline import start_logging  # noqa
+
+NS_MUC_USER = u'http://jabber.org/protocol/muc#user'
+
+ROOM_SERVER = u'conf.hipchat.local'
+API_SERVER = u'api.hipchat.local'
+BOT_NICK = u'Load Bot'
+
+# (command, weight) of the random mix
+DEFAULT_MIX = [(u'!SHOW_POD', 30),
+               (u'!SHOW_NEXT_POD', 15),
+               (u'!SHOW_DAYS', 20),
+               (u'!IM_OFF <date>', 10),
+               (u'!IM_BACK <date>', 10),
+               (u'!SHOW_TOPIC_TEMPLATE', 5),
+               (u'!HELP', 5),
+               (u'!NEXT_POD', 5),
+               ]
+
+CONFIG_TEMPLATE = u"""[hipchat]
+jid = loadbot@hipchat.local
+auth_token = load-test-token
+room_jid = 1_load_test
+room_server = %(room_server)s
+api_server = %(api_server)s
+nickname = %(nickname)s
+db = %(dir)s/hipchat_db
+state_file = %(dir)s/state.json
+send_interval = 0
+send_merge_window = 0
+send_queue_size = 100000
+config_watch_interval = 0
+teams = team
+
+[log]
+level = %(log_level)s
+
+[monitor]
+loop_interval = 0.1
+slow_threshold = 0.1
+
+[team]
+members = %(members)s
+daysoff_file = %(dir)s/daysoff.txt
+cache_file = %(dir)s/cache.txt
+room_name = Load Test
+cmd_rate_per_user = 0
+cmd_burst_per_user = 0
+cmd_rate_per_command = 0
+cmd_burst_per_command = 0
+"""
+
+
+class InMemoryTransport(object):
+    """
+    The transport of the bot's XML stream, the written data goes straight to the MUC stand-in.
+    """
+
+    def __init__(self, muc_server):
+        self.muc_server = muc_server
+        self.disconnecting = False
+
+    def write(self, data):
+        self.muc_server.data_received(data)
+
+    def writeSequence(self, data):
+        self.write(b''.join(data))
+
+    def loseConnection(self):
+        self.disconnecting = True
+
+
+class MucStandIn(object):
+    """
+    An in-process XMPP server with multi-user chat rooms. The bot's stanzas are serialized and
+    parsed again, as they would be with a real server. Every simulated user is an occupant of
+    the rooms the bot joins.
+    """
+
+    def __init__(self, domain, user_nicks):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.domain = domain
+        self.user_nicks = user_nicks
+        self.xmlstream = None
+        self._parser = None
+        # room JID (unicode) -> the bot's nickname
+        self.joined_rooms = {}
+        self._stanza_id = 0
+
+        self.room_message_count = 0
+        self.room_message_listeners = []
+
+    def connect(self, client):
+        """
+        Connects an XMPPClient (a StreamManager) through an in-memory XML stream.
+        :param client: The client, instead of calling its startService().
+        """
+        self._parser = domish.elementStream()
+        self._parser.DocumentStartEvent = self._on_stream_start
+        self._parser.ElementEvent = self._on_element
+        self._parser.DocumentEndEvent = lambda: None
+
+        # the client initializes the stream as usual, there are just no features to negotiate
+        xs = xmlstream.XmlStream(xmlstream.ConnectAuthenticator(self.domain))
+        client.factory.installBootstraps(xs)
+        self.xmlstream = xs
+        xs.makeConnection(InMemoryTransport(self))
+
+    def data_received(self, data):
+        self._parser.parse(data)
+
+    def _write(self, data):
+        # delivered in a later reactor iteration, like network data, as the stream parser is not reentrant
+        reactor.callLater(0, self.xmlstream.dataReceived, data)
+
+    def _on_stream_start(self, root):
+        self._write(u"<stream:stream xmlns='jabber:client' xmlns:stream='http://etherx.jabber.org/streams' "
+                    u"from='%s' id='load-test' version='1.0'><stream:features/>" % self.domain)
+
+    def _on_element(self, element):
+        if element.name == u'presence' and not element.getAttribute(u'type'):
+            self._on_join(JID(element[u'to']))
+        elif element.name == u'message' and element.getAttribute(u'type') == u'groupchat':
+            self.room_message_count += 1
+            body = unicode(element.body) if element.body is not None else u''
+            for listener in self.room_message_listeners:
+                listener(element[u'to'], body)
+        elif element.name == u'iq' and element.getAttribute(u'type') in (u'get', u'set'):
+            reply = domish.Element((None, u'iq'))
+            reply[u'type'] = u'error'
+            reply[u'id'] = element.getAttribute(u'id', u'')
+            reply[u'from'] = self.domain
+            reply.addElement(u'error')[u'type'] = u'cancel'
+            self._write(reply.toXml())
+
+    def _on_join(self, occupant_jid):
+        room = occupant_jid.userhost()
+        self.joined_rooms[room] = occupant_jid.resource
+        # the other occupants first, the bot's own presence last
+        for nick in self.user_nicks:
+            self._write(self._make_presence(room, nick, False))
+        self._write(self._make_presence(room, occupant_jid.resource, True))
+
+    def _make_presence(self, room, nick, is_self):
+        presence = domish.Element((None, u'presence'))
+        presence[u'from'] = u'%s/%s' % (room, nick)
+        x = presence.addElement((NS_MUC_USER, u'x'))
+        item = x.addElement(u'item')
+        item[u'affiliation'] = u'member'
+        item[u'role'] = u'participant'
+        if is_self:
+            x.addElement(u'status')[u'code'] = u'110'
+        return presence.toXml()
+
+    def send_group_chat(self, room, nick, body):
+        """
+        Sends a group chat message from a user to the bot.
+        :param room: The room JID.
+        :param nick: The user's nickname.
+        :param body: The message body.
+        """
+        self._stanza_id += 1
+        message = domish.Element((None, u'message'))
+        message[u'type'] = u'groupchat'
+        message[u'id'] = u'load-%d' % self._stanza_id
+        message[u'from'] = u'%s/%s' % (room, nick)
+        message[u'to'] = u'%s/%s' % (room, self.joined_rooms.get(room, BOT_NICK))
+        message.addElement(u'body', content=body)
+        self._write(message.toXml().encode('utf-8'))
+
+
+class RestStandIn(resource.Resource):
+    """
+    A local stand-in of the HipChat REST API, it serves the user directory and accepts
+    the notifications, topics and messages the bot sends.
+    """
+    isLeaf = True
+
+    ROUTES = [(u'user list', u'GET', re.compile(r'^/v2/user$')),
+              (u'user', u'GET', re.compile(r'^/v2/user/(?P<id>[^/]+)$')),
+              (u'room history', u'GET', re.compile(r'^/v2/room/[^/]+/history(/latest)?$')),
+              (u'room notification', u'POST', re.compile(r'^/v2/room/[^/]+/notification$')),
+              (u'room topic', u'PUT', re.compile(r'^/v2/room/[^/]+/topic$')),
+              (u'room reply', u'POST', re.compile(r'^/v2/room/[^/]+/reply$')),
+              (u'private message', u'POST', re.compile(r'^/v2/user/[^/]+/message$')),
+              ]
+
+    def __init__(self, api_server, user_nicks, delay=0.0):
+        resource.Resource.__init__(self)
+        self.api_server = api_server
+        self.user_nicks = user_nicks
+        self.delay = delay
+        self.base_url = None
+        self._port = None
+        # route name -> number of requests
+        self.request_counter = collections.Counter()
+        self.error_count = 0
+
+    def start(self):
+        self._port = reactor.listenTCP(0, server.Site(self), interface=u'127.0.0.1')
+        self.base_url = u'http://127.0.0.1:%d' % self._port.getHost().port
+
+    def stop(self):
+        if self._port is not None:
+            return self._port.stopListening()
+
+    def get_page(self, url, *args, **kwargs):
+        """
+        Sends a request of the bot to the stand-in, called like twisted.web.client.getPage.
+        """
+        prefix = (u'https://%s' % self.api_server).encode('utf-8')
+        if url.startswith(prefix):
+            url = self.base_url.encode('utf-8') + url[len(prefix):]
+        return getPage(url, *args, **kwargs)
+
+    def render(self, request):
+        path = request.path.decode('utf-8')
+        for name, method, regex in self.ROUTES:
+            match = regex.match(path)
+            if match is not None and request.method == method:
+                self.request_counter[name] += 1
+                body = self._get_body(name, match)
+                break
+        else:
+            self.error_count += 1
+            request.setResponseCode(404)
+            return b''
+
+        if self.delay <= 0:
+            return body
+        reactor.callLater(self.delay, self._finish, request, body)
+        return server.NOT_DONE_YET
+
+    @staticmethod
+    def _finish(request, body):
+        request.write(body)
+        request.finish()
+
+    def _get_body(self, name, match):
+        if name == u'user list':
+            items = [{u'id': i, u'name': nick, u'mention_name': nick,
+                      u'links': {u'self': u'https://%s/v2/user/%d' % (self.api_server, i)}}
+                     for i, nick in enumerate(self.user_nicks)]
+            return json.dumps({u'items': items, u'links': {}})
+        if name == u'user':
+            nick = self.user_nicks[int(match.group(u'id'))]
+            return json.dumps({u'id': int(match.group(u'id')), u'name': nick, u'mention_name': nick,
+                               u'email': u'%s@hipchat.local' % quote(nick.encode('utf-8'))})
+        if name == u'room history':
+            return json.dumps({u'items': [], u'links': {}})
+        return b''
+
+
+class CommandStats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.error_count = 0
+        self.timeout_count = 0
+
+
+class LoadTest(object):
+    """
+    Runs the bot against the stand-ins and drives the simulated users.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.user_nicks = [u'user%03d' % i for i in xrange(options.users)]
+        self.script = load_script(options.script) if options.script else None
+
+        self.work_dir = tempfile.mkdtemp(prefix=u'hcbot-load-')
+        self.muc = MucStandIn(u'hipchat.local', self.user_nicks)
+        self.rest = RestStandIn(API_SERVER, self.user_nicks, options.api_delay / 1000.0)
+        self.bot = None
+        self.mucbot = None
+        self.room = None
+
+        # nick -> [command line, command name, start time, timeout call]
+        self._in_flight = {}
+        # command name -> nicks of the dispatched commands, in order
+        self._dispatched = collections.defaultdict(collections.deque)
+        # command name -> the error count of the command last seen
+        self._error_counts = {}
+        self._sent_count = 0
+        self._done_count = 0
+        self._script_positions = {}
+        self.stats = collections.defaultdict(CommandStats)
+        self.start_time = None
+        self.end_time = None
+
+    def setup(self):
+        config_file = os.path.join(self.work_dir, u'config.ini')
+        with open(config_file, 'w') as f:
+            f.write((CONFIG_TEMPLATE % {u'room_server': ROOM_SERVER,
+                                        u'api_server': API_SERVER,
+                                        u'nickname': BOT_NICK,
+                                        u'dir': self.work_dir,
+                                        u'log_level': self.options.log_level,
+                                        u'members': u', '.join(self.user_nicks),
+                                        }).encode('utf-8'))
+        with open(os.path.join(self.work_dir, u'daysoff.txt'), 'w'):
+            pass
+        # the config is always read from the file
+        os.environ.pop('HCBOT_INIT_FROM_URL', None)
+
+        self.bot = Bot(config_file, u'password')
+        self.bot.initialize()
+        # the stand-in has no rate limits
+        self.bot.hipchat_api._api_interval = 0.0
+        self.bot.hipchat_api.get_page = self.rest.get_page
+        self.bot.hipchat_db._fetch_interval = 0.0
+        self.bot.hipchat_db.get_page = self.rest.get_page
+
+        team = self.bot.teams[0]
+        self.mucbot = team.mucbot
+        self.room = u'%s@%s' % (team.room_jid, ROOM_SERVER)
+        self.mucbot.commands.add_permission_hook(self._on_dispatch)
+        self.mucbot.commands.add_timing_hook(self._on_command_done)
+        if self.script is not None:
+            unknown = set(line.split()[0] for line in self.script) - set(c.name for c in self.mucbot.commands.commands)
+            if unknown:
+                raise RuntimeError(u"unknown commands in the script: %s" % u", ".join(sorted(unknown)))
+
+        # connect to the MUC stand-in instead of a real server
+        client = self.bot.hipchat_xmpp
+        client.startService = lambda: self.muc.connect(client)
+
+    def run(self):
+        try:
+            self.setup()
+            self.rest.start()
+            reactor.callWhenRunning(self._wait_for_ready)
+            # runs until the load test stops the reactor
+            self.bot.start()
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.report()
+
+    def _wait_for_ready(self):
+        team = self.bot.teams[0]
+        d = self.bot.startup.when_ready(u'user_db', u'room[%s]' % team.section)
+        d.addCallback(lambda _: team.when_ready())
+        d.addCallback(self._start_load)
+        reactor.callLater(self.options.startup_timeout, self._on_startup_timeout)
+
+    def _on_startup_timeout(self):
+        if self.start_time is None:
+            print u"the bot wasn't ready within %s seconds: %s" % (self.options.startup_timeout,
+                                                                  self.bot.startup.format_report())
+            reactor.stop()
+
+    def _start_load(self, _):
+        print u"start-up: %s" % self.bot.startup.format_report()
+        print u"sending %d commands from %d users..." % (self.options.requests, len(self.user_nicks))
+        self.start_time = time.time()
+        for nick in self.user_nicks:
+            self._send_next(nick)
+
+    def _next_command(self, nick):
+        if self.script is not None:
+            # each user goes through the script from a different line
+            position = self._script_positions.get(nick, self.user_nicks.index(nick))
+            self._script_positions[nick] = position + 1
+            line = self.script[position % len(self.script)]
+        else:
+            line = weighted_choice(self.random, DEFAULT_MIX)
+        date = datetime.date.today() + datetime.timedelta(days=self.random.randint(1, 28))
+        return line.replace(u'<date>', date.strftime(u'%Y-%m-%d'))
+
+    def _send_next(self, nick):
+        if self._sent_count >= self.options.requests:
+            if self._done_count >= self._sent_count:
+                self._finish()
+            return
+        self._sent_count += 1
+        line = self._next_command(nick)
+        timeout_call = reactor.callLater(self.options.timeout, self._on_timeout, nick)
+        self._in_flight[nick] = [line, line.split()[0], time.time(), timeout_call]
+        self.muc.send_group_chat(self.room, nick, line)
+
+    def _on_dispatch(self, cmd, user_nick):
+        request = self._in_flight.get(user_nick)
+        if request is not None and request[1] == cmd.name:
+            self._dispatched[cmd.name].append(user_nick)
+        return True
+
+    def _on_command_done(self, cmd, elapsed):
+        error_count = self._error_counts.get(cmd.name, 0)
+        self._error_counts[cmd.name] = cmd.error_count
+        dispatched = self._dispatched[cmd.name]
+        if not dispatched:
+            return
+        nick = dispatched.popleft()
+        request = self._in_flight.pop(nick, None)
+        if request is None:
+            # it has timed out
+            return
+        request[3].cancel()
+        stats = self.stats[cmd.name]
+        if cmd.error_count > error_count:
+            stats.error_count += 1
+        stats.latencies.append(time.time() - request[2])
+        self._on_request_done(nick)
+
+    def _on_timeout(self, nick):
+        request = self._in_flight.pop(nick)
+        self.stats[request[1]].timeout_count += 1
+        self._on_request_done(nick)
+
+    def _on_request_done(self, nick):
+        self._done_count += 1
+        think_time = self.options.think / 1000.0
+        if think_time > 0:
+            reactor.callLater(self.random.expovariate(1.0 / think_time), self._send_next, nick)
+        else:
+            self._send_next(nick)
+
+    def _finish(self):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        # let the outbox flush the last replies
+        reactor.callLater(0.1, reactor.stop)
+
+    def report(self):
+        if self.start_time is None or self.end_time is None:
+            return
+        duration = self.end_time - self.start_time
+        print u""
+        print u"%-24s %7s %7s %9s %9s %9s %9s %9s" % (u"command", u"count", u"errors", u"cmd/s",
+                                                     u"p50 ms", u"p90 ms", u"p99 ms", u"max ms")
+        all_latencies = []
+        total_errors = 0
+        for name in sorted(self.stats):
+            stats = self.stats[name]
+            all_latencies.extend(stats.latencies)
+            errors = stats.error_count + stats.timeout_count
+            total_errors += errors
+            print_row(name, stats.latencies, errors, duration)
+        print_row(u"total", all_latencies, total_errors, duration)
+        print u""
+        print u"duration %.2f s, %d timeouts, %d room messages sent by the bot" % (
+            duration, sum(s.timeout_count for s in self.stats.values()), self.muc.room_message_count)
+        print u"REST requests: %s, unknown requests: %d" % (
+            u", ".join(u"%s %d" % item for item in sorted(self.rest.request_counter.items())), self.rest.error_count)
+        loop_lag = self.bot.loop_monitor.get_stats()
+        if loop_lag[u'ticks']:
+            print u"reactor lag: p50 %.1f ms, p99 %.1f ms, max %.1f ms, %d slow callbacks" % (
+                loop_lag[u'p50'] * 1000, loop_lag[u'p99'] * 1000, loop_lag[u'max_lag'] * 1000,
+                loop_lag[u'slow_count'])
+
+
+def print_row(name, latencies, errors, duration):
+    latencies = sorted(latencies)
+    if not latencies:
+        print u"%-24s %7d %7d" % (name, 0, errors)
+        return
+    print u"%-24s %7d %7d %9.1f %9.2f %9.2f %9.2f %9.2f" % (
+        name, len(latencies), errors, len(latencies) / duration,
+        get_percentile(latencies, 50) * 1000, get_percentile(latencies, 90) * 1000,
+        get_percentile(latencies, 99) * 1000, latencies[-1] * 1000)
+
+
+def weighted_choice(rnd, choices):
+    value = rnd.uniform(0, sum(weight for _, weight in choices))
+    for item, weight in choices:
+        value -= weight
+        if value <= 0:
+            return item
+    return choices[-1][0]
+
+
+def load_script(file_name):
+    """
+    Loads a script of commands, one per line. Empty lines and lines starting with # are skipped.
+    :param file_name: The file name.
+    :return: A list of command lines.
+    """
+    with open(file_name, 'rb') as f:
+        lines = [line.decode('utf-8').strip() for line in f]
+    lines = [line for line in lines if line and not line.startswith(u'#')]
+    if not lines:
+        raise RuntimeError(u"no commands in the script %s" % file_name)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=u"End-to-end load test of the bot.")
+    parser.add_argument(u'--users', type=int, default=50, help=u"the number of simulated users")
+    parser.add_argument(u'--requests', type=int, default=5000, help=u"the total number of commands")
+    parser.add_argument(u'--script', help=u"a file with the commands to send, one per line")
+    parser.add_argument(u'--think', type=float, default=0.0,
+                        help=u"the mean think time of a user between two commands (ms)")
+    parser.add_argument(u'--api-delay', type=float, default=0.0, help=u"the response time of the REST stand-in (ms)")
+    parser.add_argument(u'--timeout', type=float, default=10.0, help=u"the timeout of a command (s)")
+    parser.add_argument(u'--startup-timeout', type=float, default=30.0, help=u"the start-up timeout (s)")
+    parser.add_argument(u'--seed', type=int, default=1, help=u"the seed of the random command mix")
+    parser.add_argument(u'--log-level', default=u'WARNING', help=u"the log level of the bot")
+    options = parser.parse_args()
+
+    start_logging(level=logging.DEBUG)
+    log.PythonLoggingObserver().start()
+    LoadTest(options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Measures how logging affects the reactor: a LoopLagMonitor ticks every 10 ms while the reactor logs
+a steady stream of records, with synchronous logging as bot.py used to do and with the asynchronous
+logging pipeline. The lag percentiles show how late the reactor got to its calls, e.g. to handle
+the next message, because it was blocked by the log writes. The run without logging is the baseline.
+
+Usage: python benchmarks/logging_latency.py [records per second] [seconds per run]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from twisted.internet import defer, reactor, task  # noqa
+
+from bot.loop_monitor import LoopLagMonitor  # noqa
+from bot.util.log_pipeline import LOG_FORMAT, start_logging  # noqa
+
+# a typical group chat stanza
+STANZA = (u"<message to='1_room@conf.hipchat.com/Bot' from='1_room@conf.hipchat.com/Alice' "
+          u"type='groupchat' id='abc'><body>%s</body></message>" % (u"x" * 400))
+URL = u"https://api.hipchat.com/v2/room/room/notification?auth_token=0123456789abcdef"
+
+TICK_INTERVAL = 0.01
+
+
+class SlowStream(object):
+    """
+    A stream that stalls now and then, like a pipe or a terminal that can't keep up.
+    """
+
+    def __init__(self, stream, stall_every=50, stall_time=0.002):
+        self.stream = stream
+        self.stall_every = stall_every
+        self.stall_time = stall_time
+        self.write_count = 0
+
+    def write(self, data):
+        self.write_count += 1
+        if self.write_count % self.stall_every == 0:
+            time.sleep(self.stall_time)
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def reset_logging():
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    logging.getLogger(u'XmppTraffic').setLevel(logging.NOTSET)
+    return root_logger
+
+
+def log_records(count):
+    traffic_logger = logging.getLogger(u'XmppTraffic')
+    api_logger = logging.getLogger(u'HipChatApi')
+    for i in xrange(count):
+        if i % 2:
+            traffic_logger.debug(u"RECV: %r", STANZA)
+        else:
+            api_logger.debug(u"sending request to url %s", URL)
+
+
+@defer.inlineCallbacks
+def measure(name, rate, duration):
+    """
+    Logs rate records per second for the given duration while the reactor lag is measured.
+    """
+    # the ticks later than 1 ms are counted as slow, without logging them
+    monitor = LoopLagMonitor(interval=TICK_INTERVAL, slow_threshold=0.001,
+                             window_size=int(duration / TICK_INTERVAL), use_watchdog=False)
+    logging.getLogger(u'LoopLagMonitor').setLevel(logging.ERROR)
+    records_per_call = max(int(rate * TICK_INTERVAL), 1)
+    logging_call = task.LoopingCall(log_records, records_per_call) if rate > 0 else None
+
+    monitor.start()
+    if logging_call is not None:
+        logging_call.start(TICK_INTERVAL)
+    yield task.deferLater(reactor, duration, lambda: None)
+    if logging_call is not None:
+        logging_call.stop()
+    monitor.stop()
+
+    stats = monitor.get_stats()
+    print u"%-10s lag: p50 %6.1f ms, p90 %6.1f ms, p99 %6.1f ms, max %7.1f ms, slow ticks (> 1 ms) %4s/%s" % (
+        name, stats[u'p50'] * 1000, stats[u'p90'] * 1000, stats[u'p99'] * 1000, stats[u'max_lag'] * 1000,
+        stats[u'slow_count'], stats[u'ticks'])
+
+
+@defer.inlineCallbacks
+def benchmark(rate, duration, stream):
+    root_logger = reset_logging()
+    yield measure(u"no-logging", 0, duration)
+
+    # synchronous, as with logging.basicConfig()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.DEBUG)
+    yield measure(u"sync", rate, duration)
+
+    # asynchronous pipeline, the queue can hold all records so none are dropped
+    reset_logging()
+    listener = start_logging(level=logging.DEBUG, queue_size=int(rate * duration) + 1, stream=stream)
+    yield measure(u"queued", rate, duration)
+    listener.stop()
+
+    # asynchronous pipeline without traffic logging
+    reset_logging()
+    logging.getLogger(u'XmppTraffic').setLevel(logging.INFO)
+    listener = start_logging(level=logging.DEBUG, queue_size=int(rate * duration) + 1, stream=stream)
+    yield measure(u"no-traffic", rate, duration)
+    listener.stop()
+
+
+@defer.inlineCallbacks
+def run(rate, duration):
+    try:
+        with tempfile.NamedTemporaryFile() as f:
+            print u"-- local file, %s records per second" % rate
+            yield benchmark(rate, duration, f)
+            print u"-- stalling stream (2 ms every 50 writes), %s records per second" % rate
+            yield benchmark(rate, duration, SlowStream(f))
+    finally:
+        reset_logging()
+        reactor.stop()
+
+
+def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    reactor.callWhenRunning(run, rate, duration)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
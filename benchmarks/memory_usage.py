@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Measures the memory used by the days-off lists and the user records, in the representation older versions
+used (lists of date objects and weekday strings, the whole user objects of the API) and in the compact one
+(date ordinals in arrays, weekday bitmasks, shared names and UserRecords with __slots__).
+
+The user records live in the user database on disk, so for the users the memory the bot keeps after a sync
+is measured, and the size of one record, which only lives while a user is looked up.
+
+Each case is built in its own process. The memory is measured with tracemalloc when it's available
+(Python 3 or pytracemalloc), otherwise with the growth of the resident set size. The size of the objects
+found by following the references (sys.getsizeof) is reported too.
+
+Usage: python benchmarks/memory_usage.py [number of users] [number of team members]
+"""
+import datetime
+import gc
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from bot.hipchat_db import UserRecord  # noqa
+from bot.util import names  # noqa
+from bot.util.daysoff_parser import WEEKDAYS, DaysOffParser  # noqa
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+DATES_PER_MEMBER = 15
+
+
+def make_user_object(i):
+    # a user object as returned by the HipChat API
+    name = u'User %06d' % i
+    return {u'created': u'2015-03-02T10:11:12+00:00',
+            u'email': u'user%06d@example.com' % i,
+            u'group': {u'id': 1, u'links': {u'self': u'https://api.hipchat.com/v2/group/1'}, u'name': u'Example'},
+            u'id': 1000000 + i,
+            u'is_deleted': False,
+            u'is_group_admin': False,
+            u'is_guest': False,
+            u'last_active': u'2016-10-01T08:09:10+0000',
+            u'links': {u'self': u'https://api.hipchat.com/v2/user/%d' % (1000000 + i)},
+            u'mention_name': u'User%06d' % i,
+            u'name': name,
+            u'photo_url': u'https://secure.hipchat.com/files/photos/%d/photo.jpg' % i,
+            u'presence': {u'client': {u'type': u'http://hipchat.com/client/linux', u'version': u'4.0'},
+                          u'is_online': True, u'show': u'chat'},
+            u'roles': [u'user'],
+            u'timezone': u'Europe/Amsterdam',
+            u'title': u'Software Engineer',
+            u'version': u'ABCD1234',
+            u'xmpp_jid': u'1_%d@chat.hipchat.com' % (1000000 + i),
+            }
+
+
+def make_days_off(rnd, i):
+    today = datetime.date.today()
+    days = [(today + datetime.timedelta(days=rnd.randint(1, 365))).strftime(u'%Y-%m-%d')
+            for _ in xrange(DATES_PER_MEMBER)]
+    if i % 3 == 0:
+        days.append(WEEKDAYS[i % len(WEEKDAYS)])
+    return days
+
+
+def sync_user_dicts(user_count, member_count):
+    # older versions stored the whole user objects and parsed them again on every lookup
+    for i in xrange(user_count):
+        json.loads(json.dumps(make_user_object(i)))
+    # nothing else is kept in memory
+    return names._name_table
+
+
+def sync_user_records(user_count, member_count):
+    for i in xrange(user_count):
+        UserRecord.from_json(UserRecord.from_api(make_user_object(i)).to_json())
+    return names._name_table
+
+
+def build_days_off_lists(user_count, member_count):
+    rnd = random.Random(1)
+    data_dict = {}
+    for i in xrange(member_count):
+        days = []
+        for d in make_days_off(rnd, i):
+            if d in WEEKDAYS:
+                days.append(d)
+            else:
+                days.append(datetime.datetime.strptime(d, u'%Y-%m-%d').date())
+        data_dict[u'User %06d' % i] = days
+    return data_dict
+
+
+def build_days_off_compact(user_count, member_count):
+    rnd = random.Random(1)
+    parser = DaysOffParser()
+    for i in xrange(member_count):
+        parser.add(u'User %06d' % i, make_days_off(rnd, i))
+    return parser
+
+
+CASES = [(u'users, API objects', sync_user_dicts),
+         (u'users, UserRecords', sync_user_records),
+         (u'days off, lists', build_days_off_lists),
+         (u'days off, compact', build_days_off_compact),
+         ]
+
+
+def get_deep_size(obj, seen=None):
+    """
+    Gets the size of an object and the objects it refers to, each object is counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_deep_size(k, seen) + get_deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_deep_size(item, seen) for item in obj)
+    elif hasattr(obj, u'__dict__') or hasattr(obj, u'__slots__'):
+        if hasattr(obj, u'__dict__'):
+            size += get_deep_size(obj.__dict__, seen)
+        for cls in type(obj).__mro__:
+            for slot in cls.__dict__.get(u'__slots__', ()):
+                if hasattr(obj, slot):
+                    size += get_deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def get_rss():
+    # the current resident set size in bytes, the peak if the current size is not available
+    try:
+        with open(u'/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(build_func, user_count, member_count, result_queue):
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        obj = build_func(user_count, member_count)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        start_rss = get_rss()
+        obj = build_func(user_count, member_count)
+        gc.collect()
+        used = get_rss() - start_rss
+    if isinstance(obj, DaysOffParser):
+        obj = obj._data_dict
+    result_queue.put((used, get_deep_size(obj)))
+
+
+def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    member_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    print u"%d users, %d team members with %d dates each, measured with %s" % (
+        user_count, member_count, DATES_PER_MEMBER, u"tracemalloc" if tracemalloc is not None else u"RSS growth")
+    print u"%-22s %12s %12s %14s" % (u"case", u"memory MB", u"objects MB", u"bytes/entry")
+    for name, build_func in CASES:
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(build_func, user_count, member_count, result_queue))
+        process.start()
+        used, deep_size = result_queue.get()
+        process.join()
+        count = user_count if name.startswith(u'users') else member_count
+        print u"%-22s %12.1f %12.1f %14.0f" % (name, used / 1e6, deep_size / 1e6, deep_size / float(count))
+
+    user = make_user_object(0)
+    print u""
+    print u"stored bytes per user: API object %d, UserRecord %d" % (
+        len(json.dumps(user)), len(UserRecord.from_api(user).to_json()))
+    print u"bytes per looked-up user: API object %d, UserRecord %d" % (
+        get_deep_size(json.loads(json.dumps(user))), get_deep_size(UserRecord.from_api(user)))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,14 @@ import getpass
 import logging
 import os
 
+from twisted.python import log
+
 from bot.bot import Bot
+from bot.util.log_pipeline import start_logging
 
-logging.basicConfig(level=logging.DEBUG,
-                    format=u'%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# log records are written on a background thread, the levels are set from the config
+start_logging(level=logging.DEBUG)
+log.PythonLoggingObserver().start()
 
 PASSWORD_ENV_NAME = u'HCBOT_HIPCHAT_PASSWORD'
 
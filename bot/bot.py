@@ -1,15 +1,25 @@
 import logging
 
 import os
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
 
+from .config_events import ConfigEventBus, ConfigFileWatcher
 from .extra.kv_client import KvClient
 from .hipchat_api import HipChatApi
 from .hipchat_db import HipchatUserDb
 from .hipchat_xmpp import make_client
-from .schedule import Schedule
-from .util.config import init_config, write_config_file_utf8
-from .util.daysoff_parser import DaysOffParser
+from .job_scheduler import JobScheduler
+from .leader import LeaderElection
+from .loop_monitor import LoopLagMonitor
+from .profiler import Profiler
+from .startup import StartupTracker
+from .status_server import StatusCache, StatusServer
+from .state_store import StateStore
+from .storage import FileStorage
+from .team import Team
+from .util.config import config_to_string, copy_config, get_team_sections, init_config, set_team_default_config
+from .util.log_pipeline import apply_log_config
+from .util.settings import build_settings
 
 
 class Bot(object):
@@ -19,65 +29,297 @@ class Bot(object):
         self.config_file = config_file
         self.password = password
         self.config = None
-
-        self.days_off_file = None
-        self.days_off_parser = None
+        self.settings = None
+        self.storage = FileStorage()
+        self.job_scheduler = JobScheduler()
+        self.config_events = ConfigEventBus()
+        self.state_store = None
+        # the state of this instance (the user database sync), the same as state_store without HA
+        self.local_state_store = None
+        self.leader_election = None
+        self.startup = StartupTracker()
+        self.profiler = Profiler(self.storage)
+        self.job_scheduler.profiler = self.profiler
 
         self.hipchat_db = None
         self.hipchat_api = None
-        self.sheriff_schedule = None
+        self.teams = []
         self.hipchat_xmpp = None
+        self.connection_monitor = None
+        self.loop_monitor = None
+        self.status_cache = StatusCache()
+        self.status_server = None
 
         self.kv_client = None
 
     def initialize(self):
         self.config = init_config(self.config_file)
+        # fail early on an invalid config
+        self.settings = build_settings(self.config)
+        apply_log_config(self.config)
+        self.config_events.subscribe(u'log', self._on_log_config_changed)
+        self._apply_profile_settings()
+        self.config_events.subscribe(u'profile', self._on_profile_config_changed)
+
+        monitor_settings = self.settings.monitor
+        self.loop_monitor = LoopLagMonitor(monitor_settings.loop_interval, monitor_settings.slow_threshold)
+        self.config_events.subscribe(u'monitor', self._on_monitor_config_changed)
 
-        self.days_off_file = self.config.get(u'team', u'daysoff_file')
-        self.days_off_parser = DaysOffParser(self.days_off_file)
-        self.days_off_parser.load()
+        self.state_store = StateStore(self.storage, self.config.get(u'hipchat', u'state_file'))
+        self.state_store.load()
+        self._init_ha()
 
+        hipchat_settings = self.settings.hipchat
         self.hipchat_db = HipchatUserDb(self,
-                                        self.config.get(u'hipchat', u'api_server'),
-                                        self.config.get(u'hipchat', u'auth_token'),
-                                        self.config.get(u'hipchat', u'db'))
+                                        hipchat_settings.api_server,
+                                        hipchat_settings.auth_token,
+                                        hipchat_settings.db,
+                                        hipchat_settings.db_resync_hours * 3600.0)
 
         self.hipchat_api = HipChatApi(self,
-                                      self.config.get(u'hipchat', u'api_server'),
-                                      self.config.get(u'hipchat', u'auth_token'))
+                                      hipchat_settings.api_server,
+                                      hipchat_settings.auth_token)
 
-        self.sheriff_schedule = Schedule(self)
+        # all teams share the same user database, API client and XMPP client
+        self.teams = [Team(self, team_settings.section) for team_settings in self.settings.teams]
+        for team in self.teams:
+            team.initialize()
 
         self.hipchat_xmpp = make_client(self, self.config, self.password)
 
+        status_settings = self.settings.status
+        if status_settings.port > 0:
+            self.status_server = StatusServer(self, status_settings.forecast_days)
+
+    def _init_ha(self):
+        settings = self.settings.ha
+        if not settings.enabled:
+            self.local_state_store = self.state_store
+            return
+        self.leader_election = LeaderElection(self.storage, settings.lock_file, settings.instance_id or None,
+                                              settings.lease, settings.heartbeat_interval)
+        self.leader_election.add_listener(self._on_leadership_changed)
+        # every instance has its own user database, so the standbys keep it synced
+        self.local_state_store = StateStore(self.storage, self.settings.hipchat.db + u'.state.json')
+        self.local_state_store.load()
+
+    @property
+    def is_leader(self):
+        """
+        Only the leader rotates, answers the commands and writes the shared files. Always True without HA.
+        """
+        return self.leader_election is None or self.leader_election.is_leader
+
     def start(self):
-        # start the kv client to update if specified
+        self.storage.start()
+        if self.leader_election is not None:
+            # the role is known before the teams start
+            self.leader_election.start()
+            self.state_store.read_only = not self.is_leader
+            self._logger.info(u"starting as %s", u"the leader" if self.is_leader else u"a standby")
+            reactor.addSystemEventTrigger(u'before', u'shutdown', self._stop_leader_election)
+        # write the profile of a running session before the storage thread pool stops
+        reactor.addSystemEventTrigger(u'before', u'shutdown', self.profiler.stop)
+        self.job_scheduler.start()
+        if self.settings.monitor.loop_interval > 0:
+            self.loop_monitor.start()
+            reactor.addSystemEventTrigger(u'before', u'shutdown', self.loop_monitor.stop)
+        self._start_all()
+        reactor.run()
+
+    def _start_all(self):
+        """
+        Starts the phases in parallel: fetching the config from the KV store, loading the days-off lists,
+        syncing the user database and joining the rooms. A team's schedule and commands only wait for
+        the config and its days-off list.
+        """
         init_from_url = os.getenv(u'HCBOT_INIT_FROM_URL', u'').decode('utf-8').strip()
+
+        # all phases are known before any of them finishes, so the timing report covers all of them
+        self.startup.begin(u'config')
+        self.startup.begin(u'user_db')
+        for team in self.teams:
+            self.startup.begin(u'days_off[%s]' % team.section)
+            self.startup.begin(u'room[%s]' % team.section)
+
         if init_from_url:
-            def check_kv_result(result):
-                if not result:
-                    self._logger.critical(u"failed to update config from URL, stopping...")
-                    reactor.stop()
-                else:
-                    self._start_all()
-
-            self._logger.info(u"Fetching configuration from URL...")
-            client = KvClient(self, init_from_url, [], callback=check_kv_result)
-            client.update_all_keys()
+            self._fetch_config(init_from_url)
         else:
-            self._start_all()
+            self.startup.finish(u'config')
 
-        reactor.run()
+        # reload the config file when it's edited
+        watch_interval = self.settings.hipchat.config_watch_interval
+        if watch_interval > 0:
+            watcher = ConfigFileWatcher(self, self.config_file)
+            self.job_scheduler.add_interval_job(u'config_watch', watch_interval, watcher.check)
 
-    def _start_all(self):
         self._logger.info(u"start hipchat user database...")
-        self.hipchat_db.populate_user_db()
+        self.startup.run(u'user_db', self.hipchat_db.start, self.job_scheduler)
 
-        self._logger.info(u"starting sheriff schedule...")
-        self.sheriff_schedule.start()
+        self._logger.info(u"starting team schedules...")
+        for team in self.teams:
+            team.start().addErrback(self._on_startup_failure)
         self._logger.info(u"starting hipchat xmpp client...")
         self.hipchat_xmpp.startService()
 
+        if self.status_server is not None:
+            self.status_server.start(self.settings.status.port, self.settings.status.interface)
+
+    def _fetch_config(self, url):
+        # the config is polled periodically (in seconds, 0 means only at start-up)
+        kv_update_interval = float(os.getenv(u'HCBOT_KV_UPDATE_INTERVAL', u'60').strip() or 0)
+
+        def check_kv_result(result):
+            # only the first update decides if we can start
+            client.set_callback(None)
+            if not result:
+                self.startup.fail(u'config', u"failed to update config from URL")
+                self._logger.critical(u"failed to update config from URL, stopping...")
+                reactor.stop()
+            else:
+                if kv_update_interval > 0:
+                    self.job_scheduler.add_interval_job(u'kv_update', kv_update_interval,
+                                                        client.update_all_keys)
+                self.startup.finish(u'config')
+
+        self._logger.info(u"Fetching configuration from URL...")
+        client = KvClient(self, url, [], callback=check_kv_result)
+        client.add_listener(self._on_config_changed)
+        self.kv_client = client
+        client.update_all_keys()
+
+    def _on_startup_failure(self, failure):
+        self._logger.critical(u"start-up failed, stopping: %s", failure.getErrorMessage())
+        reactor.stop()
+
+    def _on_config_changed(self, changes):
+        # the changes have been applied by the KV client
+        self._logger.info(u"config changed: %s", u", ".join(u"[%s] %s" % (section, option)
+                                                         for section, option, _ in changes))
+
+    def _stop_leader_election(self):
+        # the next leader continues from the saved state, so it's written before the lock is released
+        d = self._flush_team_state()
+        d.addBoth(lambda _: self.leader_election.stop())
+        return d
+
+    def _flush_team_state(self):
+        deferreds = [team.mucbot.replayer.flush() for team in self.teams
+                     if team.mucbot is not None and team.mucbot.replayer is not None]
+        return defer.DeferredList(deferreds)
+
+    def _on_leadership_changed(self, is_leader):
+        if not is_leader:
+            self._flush_team_state()
+        self.state_store.read_only = not is_leader
+        self.status_cache.invalidate(u'health')
+        if is_leader:
+            self._take_over()
+        else:
+            self._logger.warning(u"lost the leadership, standing by")
+
+    def _take_over(self):
+        # the previous leader has written the state and the days-off files, they are reloaded
+        # synchronously, so no command is handled with the old state
+        self._logger.info(u"taking over as the leader...")
+        try:
+            self.state_store.load()
+            for team in self.teams:
+                team.days_off_parser.load(save=False)
+        except (IOError, ValueError, RuntimeError) as e:
+            self._logger.error(u"failed to reload the state, continue with the current one: %s", e)
+        for team in self.teams:
+            team.reload_state()
+            team.take_over()
+
+    def _on_log_config_changed(self, options):
+        apply_log_config(self.config)
+
+    def _on_monitor_config_changed(self, options):
+        settings = self.settings.monitor
+        self.loop_monitor.slow_threshold = settings.slow_threshold
+        if settings.loop_interval > 0:
+            self.loop_monitor.interval = settings.loop_interval
+            self.loop_monitor.start()
+        else:
+            self.loop_monitor.stop()
+
+    def _on_profile_config_changed(self, options):
+        self._apply_profile_settings()
+
+    def _apply_profile_settings(self):
+        settings = self.settings.profile
+        self.profiler.output_dir = settings.output_dir
+        self.profiler.top_n = settings.top_n
+        if settings.enabled and not self.profiler.is_active:
+            self.profiler.start()
+        elif not settings.enabled and self.profiler.is_active:
+            self.profiler.stop()
+
+    def apply_config_changes(self, changes):
+        """
+        Applies the given changes to the config and notifies the subscribers. The changes are
+        validated first, nothing is applied if the resulting config is invalid.
+        :param changes: A list of (section, option, value) tuples, the option is removed if the value is None.
+        :return: True if the changes have been applied, False otherwise.
+        """
+        new_config = copy_config(self.config)
+        self._set_config_values(new_config, changes)
+        for section in get_team_sections(new_config):
+            set_team_default_config(new_config, section)
+        try:
+            new_settings = build_settings(new_config)
+        except RuntimeError as e:
+            self._logger.error(u"rejected config changes: %s", e)
+            return False
+        removed_sections = [team.section for team in self.teams if new_settings.get_team(team.section) is None]
+        if removed_sections:
+            self._logger.error(u"rejected config changes: teams %s can only be removed with a restart",
+                               u", ".join(removed_sections))
+            return False
+
+        self._set_config_values(self.config, changes)
+        self.settings = new_settings
+        self.config_events.publish(changes)
+        return True
+
+    @staticmethod
+    def _set_config_values(config, changes):
+        for section, option, value in changes:
+            if value is None:
+                if config.has_section(section):
+                    config.remove_option(section, option)
+            else:
+                if not config.has_section(section):
+                    config.add_section(section)
+                config.set(section, option, value)
+
+    def get_stats(self):
+        """
+        Gets the statistics of the bot's components.
+        :return: A dictionary.
+        """
+        stats = {u'startup': self.startup.get_stats(),
+                 u'jobs': self.job_scheduler.get_stats(),
+                 u'teams': {},
+                 }
+        if self.loop_monitor is not None:
+            stats[u'loop_lag'] = self.loop_monitor.get_stats()
+        if self.connection_monitor is not None:
+            stats[u'connection'] = self.connection_monitor.get_stats()
+        if self.leader_election is not None:
+            stats[u'leader'] = self.leader_election.get_stats()
+        for team in self.teams:
+            if team.mucbot is not None:
+                stats[u'teams'][team.section] = {u'commands': team.mucbot.commands.get_stats(),
+                                                 u'outbox': team.mucbot.outbox.get_stats(),
+                                                 }
+        return stats
+
     def save_config(self):
+        """
+        Saves the config file in the storage thread pool.
+        :return: A Deferred that fires when the file is written.
+        """
         self._logger.info(u"saving config file...")
-        write_config_file_utf8(self.config, self.config_file)
+        return self.storage.write(self.config_file, config_to_string(self.config))
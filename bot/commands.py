@@ -0,0 +1,238 @@
+"""
+Chat command registration and dispatching.
+"""
+import importlib
+import inspect
+import logging
+import re
+import time
+
+from twisted.internet import defer
+
+from .util.daysoff_parser import sanitize_dates
+
+RE_ARG_SEPARATOR = re.compile(r'\s+', re.UNICODE)
+
+
+def no_args(arg_string):
+    """
+    Argument parser for commands without arguments.
+    """
+    return None
+
+
+def split_args(arg_string):
+    """
+    Argument parser that splits the arguments by whitespaces.
+    :return: A list of arguments.
+    """
+    arg_string = arg_string.strip()
+    return RE_ARG_SEPARATOR.split(arg_string) if arg_string else []
+
+
+def rest_of_line(arg_string):
+    """
+    Argument parser that takes everything after the command as one argument.
+    :return: The stripped argument string.
+    """
+    return arg_string.strip()
+
+
+def dates_and_others(arg_string):
+    """
+    Argument parser for commands that take dates.
+    :return: A list of valid dates and a list of the other arguments.
+    """
+    return sanitize_dates(split_args(arg_string))
+
+
+def command(name, parser=split_args, members_only=True, help_text=None):
+    """
+    Decorator that marks a method as the handler of a command.
+    The handler is called with (room, user_nick, args), where args is the result of the parser.
+    :param name: The command name, e.g. u'!HELP'.
+    :param parser: The argument parser.
+    :param members_only: If True, only team members can use this command.
+    :param help_text: An optional help text.
+    """
+    def decorator(func):
+        func.command_spec = {u'name': name,
+                             u'parser': parser,
+                             u'members_only': members_only,
+                             u'help_text': help_text,
+                             }
+        return func
+    return decorator
+
+
+class Command(object):
+
+    def __init__(self, name, handler, parser=split_args, members_only=True, help_text=None):
+        self.name = name
+        self.handler = handler
+        self.parser = parser
+        self.members_only = members_only
+        self.help_text = help_text
+
+        # statistics
+        self.call_count = 0
+        self.error_count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class CommandRegistry(object):
+    """
+    A registry of chat commands. It parses the command arguments, checks the permissions,
+    dispatches the commands to their handlers and keeps timing statistics.
+    """
+
+    def __init__(self, team_members):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.team_members = team_members
+
+        self._command_dict = {}
+        self._permission_hooks = []
+        self._timing_hooks = []
+        # (optional) the Profiler the handlers are run with
+        self.profiler = None
+
+    @property
+    def commands(self):
+        return [self._command_dict[name] for name in sorted(self._command_dict)]
+
+    def get(self, name):
+        return self._command_dict.get(name)
+
+    def register(self, name, handler, parser=split_args, members_only=True, help_text=None):
+        """
+        Registers a command.
+        :param name: The command name, e.g. u'!HELP'.
+        :param handler: The handler, called with (room, user_nick, args).
+        :param parser: The argument parser.
+        :param members_only: If True, only team members can use this command.
+        :param help_text: An optional help text.
+        """
+        if name in self._command_dict:
+            raise RuntimeError(u"command %s is already registered" % name)
+        self._command_dict[name] = Command(name, handler, parser, members_only, help_text)
+
+    def command(self, name, parser=split_args, members_only=True, help_text=None):
+        """
+        Decorator version of register().
+        """
+        def decorator(func):
+            self.register(name, func, parser, members_only, help_text)
+            return func
+        return decorator
+
+    def register_object_commands(self, obj):
+        """
+        Registers all methods of the given object that are decorated with @command.
+        :param obj: The given object.
+        """
+        seen_attr_names = set()
+        for cls in inspect.getmro(obj.__class__):
+            for attr_name, value in vars(cls).items():
+                if attr_name in seen_attr_names:
+                    continue
+                seen_attr_names.add(attr_name)
+                spec = getattr(value, u'command_spec', None)
+                if spec is not None:
+                    self.register(spec[u'name'], getattr(obj, attr_name),
+                                  spec[u'parser'], spec[u'members_only'], spec[u'help_text'])
+
+    def add_permission_hook(self, callback):
+        """
+        Adds a permission hook that is called with (command, user_nick) before a command is handled.
+        The command is rejected if any hook returns False.
+        :param callback: The hook.
+        """
+        self._permission_hooks.append(callback)
+
+    def add_timing_hook(self, callback):
+        """
+        Adds a timing hook that is called with (command, elapsed_seconds) after a command is handled.
+        :param callback: The hook.
+        """
+        self._timing_hooks.append(callback)
+
+    def dispatch(self, room, user_nick, msg):
+        """
+        Dispatches the given message to the corresponding command handler.
+        :param room: The room.
+        :param user_nick: The sender's nickname.
+        :param msg: The message body.
+        :return: True if the message is a command, otherwise False.
+        """
+        parts = msg.split(None, 1)
+        if not parts:
+            return False
+        cmd = self._command_dict.get(parts[0])
+        if cmd is None:
+            return False
+
+        if cmd.members_only and user_nick not in self.team_members:
+            self._logger.info(u"ignore command from non-team-member '%s'", user_nick)
+            return True
+        for hook in self._permission_hooks:
+            if not hook(cmd, user_nick):
+                return True
+
+        self._logger.info(u"try to handle command '%s' from '%s'", cmd.name, user_nick)
+        args = cmd.parser(parts[1] if len(parts) > 1 else u'')
+
+        handler = cmd.handler
+        if self.profiler is not None:
+            handler = self.profiler.wrap(u'command %s' % cmd.name, handler)
+        start_time = time.time()
+        d = defer.maybeDeferred(handler, room, user_nick, args)
+        d.addCallbacks(self._on_command_success, self._on_command_failure,
+                       callbackArgs=(cmd, start_time), errbackArgs=(cmd, start_time))
+        return True
+
+    def _on_command_success(self, result, cmd, start_time):
+        self._update_stats(cmd, start_time)
+        return result
+
+    def _on_command_failure(self, failure, cmd, start_time):
+        cmd.error_count += 1
+        self._logger.error(u"failed to handle command '%s': %s", cmd.name, failure.getTraceback())
+        self._update_stats(cmd, start_time)
+
+    def _update_stats(self, cmd, start_time):
+        elapsed = time.time() - start_time
+        cmd.call_count += 1
+        cmd.total_time += elapsed
+        cmd.max_time = max(cmd.max_time, elapsed)
+        for hook in self._timing_hooks:
+            hook(cmd, elapsed)
+
+    def get_stats(self):
+        """
+        Gets the statistics of all commands.
+        :return: A dictionary of command name -> statistics.
+        """
+        stats = {}
+        for cmd in self.commands:
+            stats[cmd.name] = {u'calls': cmd.call_count,
+                               u'errors': cmd.error_count,
+                               u'total_time': cmd.total_time,
+                               u'max_time': cmd.max_time,
+                               }
+        return stats
+
+
+def load_command_plugins(registry, module_names, mucbot):
+    """
+    Loads command plugins. A plugin is a module with a function register_commands(registry, mucbot)
+    that registers its commands to the given registry.
+    :param registry: The command registry.
+    :param module_names: A list of plugin module names.
+    :param mucbot: The HipchatBot the commands are for.
+    """
+    logger = logging.getLogger(u'CommandPlugins')
+    for module_name in module_names:
+        logger.info(u"loading command plugin %s", module_name)
+        module = importlib.import_module(module_name)
+        module.register_commands(registry, mucbot)
@@ -0,0 +1,120 @@
+import logging
+import os
+
+from .util.config import init_config
+
+
+def diff_configs(old_config, new_config):
+    """
+    Compares two configs.
+    :param old_config: The old config parser.
+    :param new_config: The new config parser.
+    :return: A sorted list of (section, option, new value) tuples of the changed options,
+             the value is None if the option has been removed.
+    """
+    def get_items(config, section):
+        # values set at runtime may not be strings
+        if not config.has_section(section):
+            return {}
+        return dict((option, unicode(value)) for option, value in config.items(section, raw=True))
+
+    changes = []
+    for section in set(old_config.sections()) | set(new_config.sections()):
+        old_items = get_items(old_config, section)
+        new_items = get_items(new_config, section)
+        for option in set(old_items) | set(new_items):
+            new_value = new_items.get(option)
+            if old_items.get(option) != new_value:
+                changes.append((section, option, new_value))
+    return sorted(changes)
+
+
+class ConfigEventBus(object):
+    """
+    Notifies the subscribers when config options change.
+    A subscriber is called with the set of changed options it subscribed to. The changes of
+    options that nobody subscribes to only take effect after a restart, a warning is logged for them.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        # section -> a list of (callback, a set of options or None for all options)
+        self._subscriber_dict = {}
+
+    def subscribe(self, section, callback, options=None):
+        """
+        Subscribes to the changes of a config section.
+        :param section: The section name.
+        :param callback: Called with a set of the changed option names.
+        :param options: (optional) The options to subscribe to, all options in the section by default.
+        """
+        options = frozenset(options) if options is not None else None
+        self._subscriber_dict.setdefault(section, []).append((callback, options))
+
+    def unsubscribe(self, section, callback):
+        subscribers = self._subscriber_dict.get(section, [])
+        self._subscriber_dict[section] = [s for s in subscribers if s[0] != callback]
+
+    def publish(self, changes):
+        """
+        Notifies the subscribers of the given changes.
+        :param changes: A list of (section, option, value) tuples.
+        """
+        changed_option_dict = {}
+        for section, option, _ in changes:
+            changed_option_dict.setdefault(section, set()).add(option)
+
+        for section, options in sorted(changed_option_dict.items()):
+            unhandled_options = set(options)
+            for callback, subscribed_options in list(self._subscriber_dict.get(section, [])):
+                changed_options = options if subscribed_options is None else options & subscribed_options
+                if not changed_options:
+                    continue
+                unhandled_options -= changed_options
+                try:
+                    callback(changed_options)
+                except Exception:
+                    self._logger.exception(u"failed to apply the changes of [%s] %s",
+                                           section, u", ".join(sorted(changed_options)))
+            if unhandled_options:
+                self._logger.warning(u"changes of [%s] %s take effect after a restart",
+                                     section, u", ".join(sorted(unhandled_options)))
+
+
+class ConfigFileWatcher(object):
+    """
+    Reloads the config file when it's modified and applies the changes to the config in place.
+    """
+
+    def __init__(self, bot, config_file):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.bot = bot
+        self.config_file = config_file
+        self._last_mtime = self._get_mtime()
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self.config_file).st_mtime
+        except OSError:
+            return
+
+    def check(self):
+        """
+        Checks if the config file has been modified, and reloads it if so.
+        :return: The list of changes.
+        """
+        mtime = self._get_mtime()
+        if mtime is None or mtime == self._last_mtime:
+            return []
+        self._last_mtime = mtime
+
+        try:
+            new_config = init_config(self.config_file)
+        except Exception as e:
+            self._logger.error(u"failed to reload %s: %s", self.config_file, e)
+            return []
+        changes = diff_configs(self.bot.config, new_config)
+        if changes:
+            self._logger.info(u"%s has been modified, %s option(s) changed", self.config_file, len(changes))
+            self.bot.apply_config_changes(changes)
+        return changes
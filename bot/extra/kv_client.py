@@ -1,7 +1,8 @@
 import logging
 
-from twisted.internet import reactor
-from twisted.web.client import getPage
+from twisted.internet import reactor as default_reactor
+from twisted.web.client import HTTPClientFactory
+from twisted.web.error import Error
 
 from ..util.config import get_config_name_from_env_name
 
@@ -9,14 +10,17 @@ from ..util.config import get_config_name_from_env_name
 class KvClient(object):
     """
     A client for retrieving a key-value file from a URL.
+    The file is fetched with a conditional request (If-None-Match and If-Modified-Since), so polling
+    an unchanged file only costs a 304 response. Only the changed keys are applied to the config.
     """
 
-    def __init__(self, bot, url, key_list, time_out=10, callback=None):
+    def __init__(self, bot, url, key_list, time_out=10, callback=None, reactor=default_reactor):
         # pre-check
         if len(set(key_list)) != len(key_list):
             raise RuntimeError(u"You have duplicate keys in the key list: %s", key_list)
 
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._reactor = reactor
         self.bot = bot
         self.url = url
         self.key_list = key_list
@@ -29,6 +33,31 @@ class KvClient(object):
 
         self._update_in_progress = False
 
+        # validators of the last retrieved document
+        self._etag = None
+        self._last_modified = None
+        # the key-values in the last retrieved document
+        self._last_key_dict = {}
+
+        self._listeners = []
+
+        self.fetch_count = 0
+        self.not_modified_count = 0
+
+    def add_listener(self, callback):
+        """
+        Adds a listener that is called with a list of changed (section, option, value) tuples
+        after the changes are applied to the config.
+        :param callback: The listener.
+        """
+        self._listeners.append(callback)
+
+    def set_callback(self, callback):
+        """
+        Sets the callback that is called with True or False after each update.
+        """
+        self._callback = callback
+
     def update_all_keys(self):
         """
         Triggers a task that fetches all key-values and updates the config file.
@@ -57,40 +86,75 @@ class KvClient(object):
         headers = {'Content-Type': 'application/json',
                    'Accept': 'plain/text',
                    'Accept-Charset:': 'utf-8'}
-
-        d = getPage(self.url.encode('utf-8'), method='GET', headers=headers, timeout=self.time_out)
-        d.addCallbacks(self._on_get_all_keys_success, self._on_get_all_keys_failure)
+        if self._etag is not None:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified is not None:
+            headers['If-Modified-Since'] = self._last_modified
+
+        self.fetch_count += 1
+        # the factory keeps the response headers for the validators
+        factory = HTTPClientFactory(self.url.encode('utf-8'), method='GET', headers=headers, timeout=self.time_out)
+        factory.deferred.addCallbacks(self._on_get_all_keys_success, self._on_get_all_keys_failure,
+                                      callbackArgs=(factory,))
+        if factory.scheme == b'https':
+            # pyOpenSSL is only needed for https URLs
+            from twisted.internet import ssl
+            self._reactor.connectSSL(factory.host, factory.port, factory, ssl.ClientContextFactory(),
+                                     timeout=self.time_out)
+        else:
+            self._reactor.connectTCP(factory.host, factory.port, factory, timeout=self.time_out)
 
         self._update_in_progress = True
 
-    def _on_get_all_keys_success(self, data):
+    def _on_get_all_keys_success(self, data, factory):
         # assume that the data we receive is multiple lines of "key = value"
         self._logger.info(u"successfully retrieved all keys.")
-
-        self._new_key_dict = {}
-        has_errors = False
-        for line in data.decode('utf-8').splitlines():
-            line = line.strip()
-            parts = line.split(u'=', 1)
-            if len(parts) != 2:
-                self._logger.error(u"invalid key-value pair in retrieved data: %s", line)
-                has_errors = True
-                break
-            key, value = (p.strip() for p in parts)
-            self._new_key_dict[key] = value
-
-        # only update the config file if there is no errors
-        if not has_errors:
-            self._update_config()
-
-        # clean up
-        self._clean_up_update_task_data()
-
-        # callback
-        if self._callback is not None:
-            reactor.callLater(0.0, self._callback, True)
+        response_headers = getattr(factory, 'response_headers', None) or {}
+        etag = response_headers.get('etag')
+        last_modified = response_headers.get('last-modified')
+
+        has_errors = True
+        try:
+            self._new_key_dict = {}
+            has_errors = False
+            for line in data.decode('utf-8').splitlines():
+                line = line.strip()
+                parts = line.split(u'=', 1)
+                if len(parts) != 2:
+                    self._logger.error(u"invalid key-value pair in retrieved data: %s", line)
+                    has_errors = True
+                    break
+                key, value = (p.strip() for p in parts)
+                self._new_key_dict[key] = value
+
+            # only update the config file if there is no errors
+            if not has_errors:
+                has_errors = not self._update_config()
+            if not has_errors:
+                # only remember the validators of a document that has been applied
+                self._etag = etag[0] if etag else None
+                self._last_modified = last_modified[0] if last_modified else None
+        except Exception:
+            # e.g. a body that isn't utf-8, the next update is tried again
+            has_errors = True
+            self._logger.exception(u"failed to apply the retrieved keys, abort key update.")
+        finally:
+            # clean up, so the next update can start
+            self._clean_up_update_task_data()
+
+            # callback
+            if self._callback is not None:
+                self._reactor.callLater(0.0, self._callback, not has_errors)
 
     def _on_get_all_keys_failure(self, data):
+        if data.check(Error) and data.value.status == '304':
+            self._logger.debug(u"keys are not modified.")
+            self.not_modified_count += 1
+            self._clean_up_update_task_data()
+            if self._callback is not None:
+                self._reactor.callLater(0.0, self._callback, True)
+            return
+
         # if we failed to retrieve the keys, we abort the key update
         self._logger.error(u"failed to retrieve all keys, abort key update.")
         self._logger.debug(u"failure data: %s", data)
@@ -98,10 +162,9 @@ class KvClient(object):
 
         # callback
         if self._callback is not None:
-            reactor.callLater(0.0, self._callback, False)
+            self._reactor.callLater(0.0, self._callback, False)
 
     def _update_config(self):
-        self._logger.info(u"updating config...")
         new_key_dict = self._new_key_dict
         self._new_key_dict = None
 
@@ -109,18 +172,35 @@ class KvClient(object):
         for key, value in new_key_dict.items():
             if get_config_name_from_env_name(key) is None:
                 self._logger.error(u"invalid key %s = %s, abort update.", key, value)
-                return
-
-        # set values
-        for key, value in new_key_dict.items():
+                return False
+
+        # only apply the keys that have changed since the last document
+        changed_key_dict = dict((key, value) for key, value in new_key_dict.iteritems()
+                                if self._last_key_dict.get(key) != value)
+        if not changed_key_dict:
+            self._logger.info(u"no keys have changed.")
+            return True
+
+        self._logger.info(u"updating config, %s key(s) changed...", len(changed_key_dict))
+        changes = []
+        for key, value in sorted(changed_key_dict.items()):
             # convert key name to section and option
             section, option = get_config_name_from_env_name(key)
             # try to figure out the value type (only string and int are supported)
             if value.isdigit():
                 value = int(value)
-            self.bot.config.set(section, option, value)
+            changes.append((section, option, value))
             self._logger.debug(u"new config values: [%s][%s] = %s", section, option, value)
 
+        if not self.bot.apply_config_changes(changes):
+            self._logger.error(u"failed to update config, the changes are invalid.")
+            return False
+        self._last_key_dict = new_key_dict
+
         # save config file
         self.bot.save_config()
         self._logger.info(u"successfully updated config.")
+
+        for callback in self._listeners:
+            callback(changes)
+        return True
@@ -2,7 +2,7 @@ import cgi
 import json
 import logging
 import time
-from urllib import quote
+from urllib import quote, urlencode
 
 from twisted.internet import reactor
 from twisted.web.client import getPage
@@ -24,11 +24,13 @@ class HipChatApi(object):
         self.bot = bot
         self.server = server
         self.token = token
-        self._callback = None
 
         self._api_interval = 4.0
         self._last_time = 0.0
 
+        # the HTTP client, called like twisted.web.client.getPage
+        self.get_page = getPage
+
     def _get_later(self):
         current_time = time.time()
         later = self._last_time + self._api_interval - current_time
@@ -38,10 +40,12 @@ class HipChatApi(object):
         self._last_time = current_time + later
         return later
 
-    def _send_request(self, method, url, payload=None, success_callback=None, failure_callback=None):
+    def _send_request(self, method, url, payload=None, success_callback=None, failure_callback=None, params=None):
         final_url = u"https://%(server)s/%(url)s?auth_token=%(token)s" % {u"server": self.server,
                                                                           u"url": quote(url),
                                                                           u"token": self.token}
+        if params:
+            final_url += u"&" + urlencode([(k, unicode(v).encode('utf-8')) for k, v in sorted(params.items())])
         self._logger.debug(u"sending request to url %s", final_url)
         headers = {'Content-Type': 'application/json',
                    'Accept': 'plain/text',
@@ -52,12 +56,19 @@ class HipChatApi(object):
         payload = payload.encode('utf-8') if payload is not None else None
 
         def get_page(u, m, h, p, t, c1, c2):
-            d = getPage(u, method=m, headers=h, postdata=p, timeout=t)
+            d = self.get_page(u, method=m, headers=h, postdata=p, timeout=t)
             if c1 is not None:
                 d.addCallback(c1)
             if c2 is not None:
                 d.addErrback(c2)
 
+        # the callbacks are profiled when a profiling session is active
+        label = u'http %s %s' % (method, url)
+        if success_callback is not None:
+            success_callback = self.bot.profiler.wrap(label, success_callback)
+        if failure_callback is not None:
+            failure_callback = self.bot.profiler.wrap(label, failure_callback)
+
         later = self._get_later()
         reactor.callLater(later, get_page, final_url, method, headers, payload, 10.0,
                           success_callback, failure_callback)
@@ -78,27 +89,33 @@ class HipChatApi(object):
         self._send_request(u'PUT', url, payload=json.dumps(data))
 
     def view_room_history(self, room_name, max_results=100, recent=True, include_deleted=False,
-                          not_before=None, timezone="UTZ", callback=None):
+                          not_before=None, timezone="UTC", callback=None, failure_callback=None):
+        """
+        Fetches the room history.
+        :param callback: Called with the parsed JSON result.
+        :param failure_callback: (optional) Called with the failure.
+        """
         url = self.ROOM_HISTORY_URL % {u"room_id_or_name": room_name}
         if recent:
             url += u"/latest"
-        data = {u'max-results': max_results,
-                u'timezone': timezone,
-                u'include_deleted': include_deleted,
-                }
+        params = {u'max-results': max_results,
+                  u'timezone': timezone,
+                  u'include_deleted': u'true' if include_deleted else u'false',
+                  }
         if not_before is not None:
-            data[u'not-before'] = not_before
-        self._callback = callback
-        self._send_request(u'GET', url, payload=json.dumps(data),
-                           success_callback=self._on_view_room_history_success,
-                           failure_callback=self._on_view_room_history_failed)
-
-    def _on_view_room_history_success(self, data):
-        self._logger.info(u"successfully retrieved history")
-        self._callback(data)
-
-    def _on_view_room_history_failed(self, response):
-        self._logger.error(u"failed to retrieve history: %s", response)
+            params[u'not-before'] = not_before
+
+        def on_success(data):
+            self._logger.info(u"successfully retrieved history")
+            if callback is not None:
+                callback(json.loads(data, encoding='utf-8'))
+
+        def on_failure(response):
+            self._logger.error(u"failed to retrieve history: %s", response)
+            if failure_callback is not None:
+                failure_callback(response)
+
+        self._send_request(u'GET', url, success_callback=on_success, failure_callback=on_failure, params=params)
 
     def reply_to_message(self, room_name, parent_message_id, message):
         url = self.ROOM_REPLY_URL % {u'room_id_or_name': room_name}
@@ -1,27 +1,89 @@
 import json
 import logging
-import time
 
 import leveldb
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
 from twisted.web.client import getPage
 
+from .profiler import profiled
+from .util.date import to_human_readable_time
+
+# older versions stored the sync progress in the user database under this key
+SYNC_CURSOR_KEY = u'__hcbot_sync_cursor__'
+
+
+class UserRecord(object):
+    """
+    The user details the bot uses, the other fields of the API's user objects are not kept.
+    """
+    __slots__ = ('id', 'name', 'mention_name', 'email')
+
+    def __init__(self, id, name, mention_name, email=None):
+        self.id = id
+        self.name = name
+        self.mention_name = mention_name
+        self.email = email
+
+    @classmethod
+    def from_api(cls, user):
+        """
+        Makes a record of a user object of the API.
+        :param user: The user dictionary.
+        """
+        return cls(user.get(u'id'), user[u'name'], user[u'mention_name'], user.get(u'email'))
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Parses a stored record, older versions stored the whole user object of the API.
+        :param data: The JSON string.
+        """
+        value = json.loads(data, encoding='utf-8')
+        if isinstance(value, dict):
+            return cls.from_api(value)
+        return cls(*value)
+
+    def to_json(self):
+        """
+        Serializes the record as a compact JSON list.
+        :return: The JSON string (utf-8).
+        """
+        data = json.dumps([self.id, self.name, self.mention_name, self.email], ensure_ascii=False)
+        return data.encode('utf-8') if isinstance(data, unicode) else data
+
 
 class HipchatUserDb(object):
 
-    def __init__(self, bot, server, token, db_path):
+    def __init__(self, bot, server, token, db_path, update_interval=None, clock=reactor):
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._clock = clock
 
         self.bot = bot
         self.server = server
         self.token = token
 
         self._db = leveldb.LevelDB(db_path)
-        self._update_interval = 60.0 * 60.0 * 24.0 * 5.0  # every 5 days
+        if update_interval is None:
+            update_interval = 60.0 * 60.0 * 24.0 * 5.0  # every 5 days
+        self._update_interval = update_interval
 
         self._fetch_interval = 5.0
         self._last_time = 0.0
 
+        # the HTTP client, called like twisted.web.client.getPage
+        self.get_page = getPage
+
+        # sync progress of the current run
+        self._sync_in_progress = False
+        # the Deferreds waiting for the current sync to finish
+        self._sync_waiters = []
+        self._sync_cursor = None
+        self._current_page_link = None
+        self._next_page_link = None
+        self._pending_user_count = 0
+
+        self._user_listeners = []
+
     def set(self, name, mention_name):
         self._db.Put(name.encode('utf-8'), mention_name.encode('utf-8'))
 
@@ -36,13 +98,32 @@ class HipchatUserDb(object):
             result = False
         return result
 
+    def get_user_data(self, name):
+        """
+        Gets the user details.
+        :param name: The user's name.
+        :return: The UserRecord, or None if the user is not found.
+        """
+        try:
+            data = self._db.Get(name.encode('utf-8'))
+        except KeyError:
+            return
+        return UserRecord.from_json(data)
+
+    def add_user_listener(self, callback):
+        """
+        Adds a listener that is called with (name, mention_name) whenever a user is updated.
+        :param callback: The listener.
+        """
+        self._user_listeners.append(callback)
+
     def _append_auth_token(self, url):
         final_url = url + (u'?auth_token=%s' if url.find(u'?') == -1 else u'&auth_token=%s')
         final_url = final_url % self.token
         return final_url
 
     def _get_later(self):
-        current_time = time.time()
+        current_time = self._clock.seconds()
         later = self._last_time + self._fetch_interval - current_time
         if later < 0.0:
             later = 0.0
@@ -50,46 +131,185 @@ class HipchatUserDb(object):
         self._last_time = current_time + later
         return later
 
+    def load_sync_cursor(self):
+        """
+        Loads the persisted sync progress from the local state store.
+        :return: The sync cursor dictionary, or None if there is none.
+        """
+        state = self.bot.local_state_store.get_user_db_state()
+        if u'sync_cursor' not in state:
+            # migrate the cursor that older versions kept in the database
+            try:
+                data = self._db.Get(SYNC_CURSOR_KEY.encode('utf-8'))
+            except KeyError:
+                return
+            state[u'sync_cursor'] = json.loads(data, encoding='utf-8')
+            self._db.Delete(SYNC_CURSOR_KEY.encode('utf-8'))
+        return state[u'sync_cursor']
+
+    def _save_sync_cursor(self):
+        self.bot.local_state_store.get_user_db_state()[u'sync_cursor'] = self._sync_cursor
+        self.bot.local_state_store.save()
+
+    def start(self, job_scheduler, check_interval=3600.0):
+        """
+        Populates the user database and checks periodically if it needs to be synced again.
+        :param job_scheduler: The JobScheduler.
+        :param check_interval: The interval in seconds between two checks.
+        :return: A Deferred that fires when the first sync is finished.
+        """
+        d = self.populate_user_db()
+        job_scheduler.add_interval_job(u'user_db_sync', min(check_interval, self._update_interval),
+                                       self.populate_user_db)
+        return d
+
     def populate_user_db(self):
-        self._logger.info(u"starting fetching users...")
-        final_url = u"https://%(server)s/v2/user" % {u"server": self.server}
-        final_url = self._append_auth_token(final_url)
+        """
+        Fetches all users into the database. An unfinished sync is resumed from the last completed page,
+        and a full sync is only done again if the last one is older than the update interval.
+        :return: A Deferred that fires when the sync is finished (or has failed).
+        """
+        if self._sync_in_progress:
+            self._logger.info(u"user database sync is in progress.")
+            return self._wait_for_sync()
+        cursor = self.load_sync_cursor()
+        current_time = self._clock.seconds()
+        if cursor is not None and current_time - cursor[u'started'] < self._update_interval:
+            if cursor[u'completed']:
+                self._logger.info(u"user database was synced %s ago, skip fetching users.",
+                                  to_human_readable_time(current_time - cursor[u'started']))
+                return defer.succeed(None)
+            # the first page may not have been completed
+            page_link = cursor[u'next'] or self._get_user_list_url()
+            self._logger.info(u"resuming fetching users from %s (%s users done)...",
+                              page_link, cursor[u'users_done'])
+            self._sync_cursor = cursor
+        else:
+            self._logger.info(u"starting fetching users...")
+            self._sync_cursor = {u'started': current_time,
+                                 u'page': None,
+                                 u'next': None,
+                                 u'users_done': 0,
+                                 u'completed': False,
+                                 }
+            page_link = self._get_user_list_url()
+            self._save_sync_cursor()
+
+        self._sync_in_progress = True
+        d = self._wait_for_sync()
+        try:
+            self._fetch_user_list(page_link)
+        except Exception:
+            # don't leave the sync in progress, the next check starts it again
+            self._logger.exception(u"failed to start fetching users from %s", page_link)
+            self._finish_sync()
+        return d
+
+    def _get_user_list_url(self):
+        return u"https://%(server)s/v2/user" % {u"server": self.server}
+
+    def get_stats(self):
+        # the cursor of the last sync is kept in the local state store
+        cursor = self._sync_cursor or self.bot.local_state_store.get_user_db_state().get(u'sync_cursor')
+        return {u'sync_in_progress': self._sync_in_progress,
+                u'sync_started': cursor[u'started'] if cursor else None,
+                u'sync_completed': cursor[u'completed'] if cursor else None,
+                u'users_done': cursor[u'users_done'] if cursor else 0,
+                }
 
+    def _wait_for_sync(self):
+        d = defer.Deferred()
+        self._sync_waiters.append(d)
+        return d
+
+    def _finish_sync(self):
+        self._sync_in_progress = False
+        waiters = self._sync_waiters
+        self._sync_waiters = []
+        for d in waiters:
+            d.callback(None)
+
+    def _fetch_user_list(self, page_link):
+        self._current_page_link = page_link
+        self._next_page_link = None
+        self._pending_user_count = 0
+
+        final_url = self._append_auth_token(page_link)
         later = self._get_later()
-        reactor.callLater(later, self._get_page, final_url,
-                          self._got_user_list_success, self._got_user_list_failure)
+        self._clock.callLater(later, self._get_user_list, final_url)
+
+    def _get_user_list(self, url):
+        d = self.get_page(url.encode('utf-8'))
+        # an error in the success callback is handled as a failed request, so the sync doesn't hang
+        d.addCallback(self._got_user_list_success).addErrback(self._got_user_list_failure)
+        d.addErrback(self._on_sync_error)
 
-    def _get_page(self, url, callback1, callback2):
-        getPage(url.encode('utf-8')).addCallbacks(callback1, callback2)
+    def _get_user(self, url):
+        d = self.get_page(url.encode('utf-8'))
+        d.addCallback(self._got_user_success).addErrback(self._got_user_failure)
+        d.addCallback(lambda _: self._on_user_done())
+        d.addErrback(self._on_sync_error)
 
+    def _on_sync_error(self, failure):
+        self._logger.error(u"user database sync failed: %s", failure.getErrorMessage())
+        self._finish_sync()
+
+    @profiled(u'http user list')
     def _got_user_list_success(self, data):
         result_dict = json.loads(data, encoding='utf-8')
+        self._next_page_link = result_dict.get(u'links', {}).get(u'next')
+
         # get user details
+        user_link_list = []
         for user in result_dict.get(u'items', []):
             if u'name' in user and u'mention_name' in user:
                 link = user.get(u'links', {}).get(u'self')
                 if link is not None:
-                    # get full info
-                    final_url = self._append_auth_token(link)
-                    later = self._get_later()
-                    reactor.callLater(later, self._get_page, final_url,
-                                      self._got_user_success, self._got_user_failure)
-
-        # get next page
-        next_link = result_dict.get(u'links', {}).get(u'next')
-        if next_link is not None:
-            final_url = self._append_auth_token(next_link)
+                    user_link_list.append(link)
+
+        self._pending_user_count = len(user_link_list)
+        for link in user_link_list:
+            # get full info
+            final_url = self._append_auth_token(link)
             later = self._get_later()
-            reactor.callLater(later, self._get_page, final_url,
-                              self._got_user_list_success, self._got_user_list_failure)
+            self._clock.callLater(later, self._get_user, final_url)
+
+        if not user_link_list:
+            self._on_page_completed()
 
     def _got_user_list_failure(self, result):
+        # the sync will be resumed from this page next time
         self._logger.error(u"failed to get user list: %s", repr(result))
+        self._finish_sync()
 
+    @profiled(u'http user')
     def _got_user_success(self, data):
-        user = json.loads(data, encoding='utf-8')
-        self.set(user[u'name'], data.encode('utf-8'))
+        record = UserRecord.from_api(json.loads(data, encoding='utf-8'))
+        # only the fields the bot uses are stored
+        self._db.Put(record.name.encode('utf-8'), record.to_json())
         self._logger.info(u"user details updated.")
+        for callback in self._user_listeners:
+            callback(record.name, record.mention_name)
+
+        self._sync_cursor[u'users_done'] += 1
 
     def _got_user_failure(self, result):
         self._logger.error(u"failed to get user details: %s", repr(result))
+
+    def _on_user_done(self):
+        self._pending_user_count -= 1
+        if self._pending_user_count == 0:
+            self._on_page_completed()
+
+    def _on_page_completed(self):
+        # persist the progress before moving on to the next page
+        self._sync_cursor[u'page'] = self._current_page_link
+        self._sync_cursor[u'next'] = self._next_page_link
+        self._sync_cursor[u'completed'] = self._next_page_link is None
+        self._save_sync_cursor()
+
+        if self._next_page_link is not None:
+            self._fetch_user_list(self._next_page_link)
+        else:
+            self._finish_sync()
+            self._logger.info(u"finished fetching users, %s users done.", self._sync_cursor[u'users_done'])
@@ -4,15 +4,22 @@
 #
 import datetime
 import logging
+import random
 
-from twisted.internet import task
+from twisted.internet import defer, reactor, task
 from twisted.python import log
 from twisted.words.protocols.jabber import jid
 from wokkel import muc
 from wokkel.client import XMPPClient
 from wokkel.subprotocols import XMPPHandler
 
-from .util.daysoff_parser import sanitize_dates
+from .algorithm.context import is_question_msg
+from .commands import CommandRegistry, command, dates_and_others, load_command_plugins, no_args, rest_of_line
+from .outbox import MessageOutbox
+from .profiler import profiled
+from .replay import CommandReplayer
+from .util.backoff import ExponentialBackoff
+from .util.rate_limiter import CommandRateLimiter
 
 
 class KeepAlive(XMPPHandler):
@@ -32,12 +39,127 @@ class KeepAlive(XMPPHandler):
         self.send(u" ")
 
 
+class TrafficLogger(XMPPHandler):
+    """
+    Logs a sample of the raw XMPP traffic at DEBUG level. Nothing is formatted if the logger
+    doesn't log DEBUG messages or the data is not sampled.
+    """
+
+    def __init__(self, sample_rate=0.0):
+        """
+        :param sample_rate: The fraction of the data chunks to log, between 0.0 and 1.0.
+        """
+        super(TrafficLogger, self).__init__()
+        self._logger = logging.getLogger(u'XmppTraffic')
+        self.sample_rate = sample_rate
+        self.seen_count = 0
+        self.logged_count = 0
+
+    def makeConnection(self, xs):
+        if self.sample_rate > 0:
+            xs.rawDataInFn = self._log_data_in
+            xs.rawDataOutFn = self._log_data_out
+        super(TrafficLogger, self).makeConnection(xs)
+
+    def _is_sampled(self):
+        self.seen_count += 1
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return False
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        self.logged_count += 1
+        return True
+
+    def _log_data_in(self, data):
+        if self._is_sampled():
+            self._logger.debug(u"RECV: %r", data)
+
+    def _log_data_out(self, data):
+        if self._is_sampled():
+            self._logger.debug(u"SEND: %r", data)
+
+
+class ConnectionMonitor(XMPPHandler):
+    """
+    Configures the reconnection backoff of the XMPP client and keeps connection statistics.
+    The connection is considered recovered when all rooms are joined again.
+    """
+
+    def __init__(self, initial_delay=1.0, max_delay=300.0, factor=2.0, jitter=0.1, clock=reactor):
+        super(ConnectionMonitor, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._clock = clock
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+
+        self.mucbots = []
+
+        self.connect_count = 0
+        self.disconnect_count = 0
+        self.reconnect_count = 0
+        self.last_recovery_time = None
+        self.total_recovery_time = 0.0
+        self._disconnected_time = None
+
+    def setHandlerParent(self, parent):
+        super(ConnectionMonitor, self).setHandlerParent(parent)
+        # the XMPP client factory is a ReconnectingClientFactory
+        factory = parent.factory
+        factory.initialDelay = self.initial_delay
+        factory.maxDelay = self.max_delay
+        factory.factor = self.factor
+        factory.jitter = self.jitter
+
+    @property
+    def is_connected(self):
+        return self.xmlstream is not None and all(m.connected for m in self.mucbots)
+
+    def connectionInitialized(self):
+        self.connect_count += 1
+        self._logger.info(u"XMPP stream initialized (%s time(s))", self.connect_count)
+
+    def connectionLost(self, reason):
+        self.disconnect_count += 1
+        if self._disconnected_time is None:
+            self._disconnected_time = self._clock.seconds()
+        self._logger.warning(u"XMPP connection lost: %s", reason.getErrorMessage())
+
+    def room_joined(self, mucbot):
+        """
+        Called by the room handlers when they have joined their rooms.
+        """
+        if self._disconnected_time is None or not self.is_connected:
+            return
+        self.last_recovery_time = self._clock.seconds() - self._disconnected_time
+        self.total_recovery_time += self.last_recovery_time
+        self.reconnect_count += 1
+        self._disconnected_time = None
+        self._logger.info(u"connection recovered after %.1f seconds (%s reconnect(s))",
+                          self.last_recovery_time, self.reconnect_count)
+
+    def get_stats(self):
+        return {u'connected': self.is_connected,
+                u'connect_count': self.connect_count,
+                u'disconnect_count': self.disconnect_count,
+                u'reconnect_count': self.reconnect_count,
+                u'last_recovery_time': self.last_recovery_time,
+                u'total_recovery_time': self.total_recovery_time,
+                u'disconnected_for': (self._clock.seconds() - self._disconnected_time
+                                      if self._disconnected_time is not None else 0.0),
+                }
+
+
 class HipchatBot(muc.MUCClient):
 
-    def __init__(self, bot, server, room, room_name, nickname, stfu_minutes, team_members):
+    def __init__(self, bot, team, server, room, room_name, nickname, stfu_minutes, team_members,
+                 send_interval=1.0, merge_window=0.5, max_queue_size=100, rate_limiter=None, clock=reactor):
         super(HipchatBot, self).__init__()
-        self._logger = logging.getLogger(self.__class__.__name__)
+        self._logger = logging.getLogger(u'%s[%s]' % (self.__class__.__name__, team.section))
+        self._clock = clock
         self.bot = bot
+        self.team = team
         self.connected = False
         self.server = server
         self.room = room
@@ -49,17 +171,95 @@ class HipchatBot(muc.MUCClient):
                                                  server=self.server,
                                                  nickname=self.nickname))
         self.last_spoke = None
-        self.team_members = team_members
+        self.team_members = set(team_members)
+
+        self.commands = CommandRegistry(self.team_members)
+        self.commands.register_object_commands(self)
+
+        self.rate_limiter = rate_limiter
+        if self.rate_limiter is not None:
+            self.commands.add_permission_hook(self._check_rate_limit)
+
+        # messages are held in the outbox until the room is joined
+        self.outbox = MessageOutbox(self.groupChat, send_interval, merge_window, max_queue_size, clock)
+        self.outbox.pause()
+
+        self.connection_monitor = None
+        self._join_backoff = ExponentialBackoff()
+        self._rejoin_call = None
+        self.replayer = None
 
         self.last_question_time = 0.0
         self.question_rely_interval = 10.0  # one notification for questions within 10 secs
+        self.max_digest_questions = 20  # the questions beyond it are only counted in the digest
+        self._pending_questions = []
+        self._skipped_question_count = 0
+        self._question_flush_call = None
+
+        # the messages received before the team is ready and the missed commands have been replayed,
+        # with their receive times, handled in order after the missed commands
+        self._held_messages = []
+        self._holding_messages = True
+        self.team.when_ready().addCallback(self._on_team_ready)
 
     def connectionInitialized(self):
         """The bot has connected to the xmpp server, now try to join the room.
         """
         super(HipchatBot, self).connectionInitialized()
-        self.join(self.room_jid, self.nickname)
+        self._join_room()
+
+    def connectionLost(self, reason):
+        super(HipchatBot, self).connectionLost(reason)
+        self.connected = False
+        self.outbox.pause()
+        if self._rejoin_call is not None and self._rejoin_call.active():
+            self._rejoin_call.cancel()
+        self._rejoin_call = None
+
+    def _join_room(self):
+        self._rejoin_call = None
+        self._logger.info(u"joining room %s...", self.room_jid.full())
+        d = self.join(self.room_jid, self.nickname)
+        d.addCallbacks(self._on_room_joined, self._on_join_failure)
+
+    def _on_room_joined(self, room):
+        self._logger.info(u"joined room %s", self.room_jid.full())
         self.connected = True
+        self._join_backoff.reset()
+        # flush the messages queued while disconnected
+        self.outbox.resume()
+        if self.connection_monitor is not None:
+            self.connection_monitor.room_joined(self)
+        self.bot.startup.finish(u'room[%s]' % self.team.section)
+        # handle the commands sent while we were away
+        if self.replayer is not None and self.team.is_ready:
+            self.replayer.replay()
+
+    def _on_team_ready(self, _):
+        # the held messages are in the history too, so the replay ends where they begin
+        if self.replayer is not None and self.connected:
+            d = self.replayer.replay(until=self._held_messages[0][3] if self._held_messages else None)
+        else:
+            d = defer.succeed(None)
+        # the missed commands are older than the held ones
+        d.addCallback(self._handle_held_messages)
+
+    def _handle_held_messages(self, _):
+        self._logger.info(u"team is ready, handling %s held message(s)", len(self._held_messages))
+        held_messages = self._held_messages
+        self._held_messages = []
+        self._holding_messages = False
+        for room, user, message, message_time in held_messages:
+            self._handle_group_chat(room, user, message, message_time)
+
+    def _on_join_failure(self, failure):
+        if self.xmlstream is None:
+            # the connection is lost, we will join again after reconnecting
+            return
+        delay = self._join_backoff.next_delay()
+        self._logger.error(u"failed to join room %s, retry in %.1f seconds: %s",
+                           self.room_jid.full(), delay, failure.getErrorMessage())
+        self._rejoin_call = self._clock.callLater(delay, self._join_room)
 
     def _stfu(self, user_nick=None):
         """Returns True if we don't want to prefix the message with @all which
@@ -80,8 +280,53 @@ class HipchatBot(muc.MUCClient):
             msg = u'@all ' + msg
 
         if not self.connected:
-            log.msg(u'Not connected yet, ignoring msg: %s' % msg)
-        self.groupChat(self.room_jid, msg.decode('utf-8'))
+            log.msg(u'Not connected yet, queueing msg: %s' % msg)
+        self.send_reply(msg.decode('utf-8'))
+
+    def _on_team_config_changed(self, options):
+        settings = self.team.settings
+        if u'members' in options:
+            # the set is shared with the command registry
+            self.team_members.clear()
+            self.team_members.update(settings.member_set)
+        if options & set(RATE_LIMIT_OPTIONS):
+            self.rate_limiter = make_rate_limiter(settings)
+        if u'question_interval' in options:
+            self.question_rely_interval = settings.question_interval
+        self._logger.info(u"applied the changes of %s", u", ".join(sorted(options)))
+
+    def _on_hipchat_config_changed(self, options):
+        settings = self.bot.settings.hipchat
+        if u'stfu_minutes' in options:
+            self.stfu_minutes = settings.stfu_minutes
+        if u'send_interval' in options:
+            self.outbox.send_interval = settings.send_interval
+        if u'send_merge_window' in options:
+            self.outbox.merge_window = settings.send_merge_window
+        if u'send_queue_size' in options:
+            self.outbox.max_size = settings.send_queue_size
+        if u'replay_max_messages' in options and self.replayer is not None:
+            self.replayer.max_messages = settings.replay_max_messages
+        self._logger.info(u"applied the changes of %s", u", ".join(sorted(options)))
+
+    def _check_rate_limit(self, cmd, user_nick):
+        allowed, limit = self.rate_limiter.check(user_nick, cmd.name)
+        if not allowed:
+            self._logger.info(u"rate limit hit, ignore command '%s' from '%s'", cmd.name, user_nick)
+            # only reply once until the command is allowed again
+            if limit == u'user':
+                self.send_reply(u"/code > %s, you are sending commands too fast, please slow down." % user_nick)
+            elif limit == u'command':
+                self.send_reply(u"/code > %s is used too often, please try again later." % cmd.name)
+        return allowed
+
+    def send_reply(self, msg):
+        """
+        Queues a message to the room. Messages are sent at a limited rate, and consecutive
+        messages are merged into one.
+        :param msg: The message (unicode).
+        """
+        self.outbox.put(self.room_jid, msg)
 
     def userJoinedRoom(self, room, user):
         pass
@@ -89,41 +334,77 @@ class HipchatBot(muc.MUCClient):
     def userLeftRoom(self, room, user):
         pass
 
+    @profiled(u'groupchat')
     def receivedGroupChat(self, room, user, message):
-        CMDS = [u'!HELP',
-                u'!IM_BACK',
-                u'!IM_OFF',
-                u'!SHOW_DAYS',
-                u'!SHOW_POD',
-                u'!SHOW_NEXT_POD',
-                u'!NEXT_POD',
-                u'!SHOW_TOPIC_TEMPLATE',
-                u'!SET_TOPIC_TEMPLATE']
         # value error means it was a one word body
-        msg = message.body
-        if not msg:
+        if not message.body or user is None:
+            return
+        if self._holding_messages:
+            # the commands need the config and the days-off list, and the missed commands go first
+            self._held_messages.append((room, user, message, self._clock.seconds()))
+            return
+        self._handle_group_chat(room, user, message, self._clock.seconds())
+
+    def _handle_group_chat(self, room, user, message, message_time):
+        msg = message.body.decode('utf-8').strip()
+        if self.replayer is not None:
+            self.replayer.record_live(message.stanzaID, user.nick, msg, message_time)
+        if not self.bot.is_leader:
+            # only the leader answers, the commands sent during a failover are replayed by the new leader
             return
-        msg = msg.decode('utf-8').strip()
 
-        if user is None:
+        if self.commands.dispatch(room, user.nick, msg):
+            return
+        if user.nick in self.team_members:
             return
 
-        cmd = msg.split(u' ')[0]
-        if cmd in CMDS:
-            # ignore the commands from non-members
-            if user.nick not in self.team_members:
-                self._logger.info(u"ignore command from non-team-member '%s'", user.nick)
-            else:
-                cmd_name = cmd[1:].lower()
-                self._logger.info(u"try to handle command '%s' from member '%s'", cmd_name, user.nick)
-                method = getattr(self, u'cmd_' + cmd[1:].lower(), None)
-                if method:
-                    method(room, user.nick, message)
+        if is_question_msg(msg):
+            self._queue_question(user.nick, msg)
+
+    def _queue_question(self, user_nick, msg):
+        """
+        Queues a question for the person-on-duty. The first question is forwarded right away,
+        the ones that follow within the question interval are forwarded together as one digest.
+        :param user_nick: The nickname of the person who asked.
+        :param msg: The question.
+        """
+        if len(self._pending_questions) < self.max_digest_questions:
+            self._pending_questions.append((user_nick, msg))
         else:
-            if user.nick in self.team_members:
-                return
+            self._skipped_question_count += 1
+        if self._question_flush_call is not None:
+            return
+        later = max(self.last_question_time + self.question_rely_interval - self._clock.seconds(), 0.0)
+        self._question_flush_call = self._clock.callLater(later, self._forward_questions)
+
+    def _forward_questions(self):
+        self._question_flush_call = None
+        self.last_question_time = self._clock.seconds()
+        questions = self._pending_questions
+        skipped_count = self._skipped_question_count
+        self._pending_questions = []
+        self._skipped_question_count = 0
+
+        current_person = self.team.schedule.get_current_person()[0]
+        data = self.bot.hipchat_db.get_user_data(current_person)
+        if data is None:
+            self._logger.warning(u"no user details of %s, cannot forward %s question(s)",
+                                 current_person, len(questions) + skipped_count)
+            return
 
-    def cmd_help(self, room, user_nick, message):
+        if len(questions) == 1:
+            msg = u"%s asked in room %s:" % (questions[0][0], self.room_name)
+        else:
+            msg = u"%s questions were asked in room %s:" % (len(questions) + skipped_count, self.room_name)
+        for user_nick, question in questions:
+            msg += u"\n[%s] %s" % (user_nick, question)
+        if skipped_count:
+            msg += u"\n... and %s more, see the room." % skipped_count
+        self._logger.info(u"forwarding %s question(s) to %s", len(questions) + skipped_count, current_person)
+        self.bot.hipchat_api.send_private_message(data.id, msg)
+
+    @command(u'!HELP')
+    def cmd_help(self, room, user_nick, args):
         msg = u"""
 Available commands (all commands start with '!'):
   !HELP: show this message.
@@ -138,135 +419,187 @@ Available commands (all commands start with '!'):
   !SHOW_POD           : show the current person-on-duty.
   !SHOW_NEXT_POD      : show the next person-on-duty.
   !NEXT_POD           : switch to the next person-on-duty.
+  !SET_POD <someone>  : set the person-on-duty.
   !SHOW_TOPIC_TEMPLATE: show the topic template.
                         "<name>" is for the person-on-duty.
-  !SET_TOPIC_TEMPLATE : set the topic template.
+  !SET_TOPIC_TEMPLATE : set the topic template (not available with HA enabled).
                         use "<name>" for the person-on-duty.
                         Example: Our support channel; Person-on-duty: <name>; questions about ...
+  !PROFILE start|stop : (admins only) start or stop a profiling session.
 """
-        self.groupChat(self.room_jid, "/code " + msg.encode('utf-8'))
+        for cmd in self.commands.commands:
+            if cmd.help_text:
+                msg += u"  %s: %s\n" % (cmd.name, cmd.help_text)
+        self.send_reply(u"/code " + msg)
 
     def _check_at_user(self, args, default_user):
-        # check if there is a '@'
-        someone = None
-        found_name = None
+        """
+        Finds the team member given as '@someone' in the arguments.
+        :param args: The command arguments.
+        :param default_user: The user to return if there is no '@someone'.
+        :return: The user and an error message (None if the user is found).
+        """
         for arg in args:
             arg = arg.strip()
             if arg.startswith(u'@'):
-                found_name = arg[1:]
-                arg = found_name.lower()
-                for member in self.bot.sheriff_schedule.team_members:
-                    if member.lower().startswith(arg):
-                        someone = member
-                        found_name = None
-                        break
-                break
-        user = default_user if someone is None else someone
-        return user, found_name
-
-    def cmd_im_back(self, room, user_nick, message):
-        args = message.body.decode('utf-8').split(u' ')
-        valid_args, invalid_args = sanitize_dates([a.strip() for a in args[1:]] if len(args) > 1 else [])
+                return self._find_member(arg[1:])
+        return default_user, None
+
+    def _find_member(self, name):
+        """
+        Resolves a (prefix of a) member name or mention name to a team member.
+        :param name: The given name.
+        :return: The member's name and an error message (None if there is exactly one match).
+        """
+        candidates = self.team.schedule.member_index.resolve(name)
+        if not candidates:
+            return None, u"could not find team member with name '%s'" % name
+        if len(candidates) > 1:
+            return None, u"'%s' matches multiple team members: %s" % (name, u", ".join(candidates))
+        return candidates[0], None
+
+    @command(u'!IM_BACK', parser=dates_and_others)
+    def cmd_im_back(self, room, user_nick, args):
+        valid_args, invalid_args = args
         # check if there is a '@'
-        user, found_name = self._check_at_user(invalid_args, user_nick)
-        if found_name is not None:
-            msg = u"could not find team member with name '%s'" % found_name
-            self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+        user, error_msg = self._check_at_user(invalid_args, user_nick)
+        if error_msg is not None:
+            self.send_reply(u"/code > " + error_msg)
             return
 
-        self.bot.days_off_parser.remove(user, valid_args)
-        self.bot.days_off_parser.save()
-
-        date_list = self.bot.days_off_parser.get_my_days_off(user)
-        if date_list:
-            days = convert_date_list_to_strings(date_list)
-            msg = u"%s has the following days off: [%s]" % (user, u", ".join(days))
-        else:
-            msg = u"%s doesn't have any days off registered" % user
+        self.team.days_off_parser.remove(user, valid_args)
 
-        self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+        # reply once the days-off file is written
+        d = self.team.save_days_off()
+        d.addCallbacks(lambda _: self._reply_days_off(user), self._reply_save_failure)
+        return d
 
-    def cmd_im_off(self, room, user_nick, message):
-        args = message.body.decode('utf-8').split(u' ')
-        valid_args, invalid_args = sanitize_dates([a.strip() for a in args[1:]] if len(args) > 1 else [])
+    @command(u'!IM_OFF', parser=dates_and_others)
+    def cmd_im_off(self, room, user_nick, args):
+        valid_args, invalid_args = args
         # check if there is a '@'
-        user, found_name = self._check_at_user(invalid_args, user_nick)
-        if found_name is not None:
-            msg = u"could not find team member with name '%s'" % found_name
-            self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+        user, error_msg = self._check_at_user(invalid_args, user_nick)
+        if error_msg is not None:
+            self.send_reply(u"/code > " + error_msg)
             return
 
-        self.bot.days_off_parser.add(user, valid_args)
-        self.bot.days_off_parser.save()
+        self.team.days_off_parser.add(user, valid_args)
 
-        date_list = self.bot.days_off_parser.get_my_days_off(user)
-        if date_list:
-            days = convert_date_list_to_strings(date_list)
-            msg = u"%s has the following days off: [%s]" % (user, u", ".join(days))
-        else:
-            msg = u"%s doesn't have any days off registered" % user
+        # reply once the days-off file is written
+        d = self.team.save_days_off()
+        d.addCallbacks(lambda _: self._reply_days_off(user), self._reply_save_failure)
+        return d
 
-        self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
-
-    def cmd_show_days(self, room, user_nick, message):
+    @command(u'!SHOW_DAYS')
+    def cmd_show_days(self, room, user_nick, args):
         # check if there is a '@'
-        args = message.body.decode('utf-8').split(u' ')
-        user, found_name = self._check_at_user(args, user_nick)
-        if found_name is not None:
-            msg = u"could not find team member with name '%s'" % found_name
-            self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+        user, error_msg = self._check_at_user(args, user_nick)
+        if error_msg is not None:
+            self.send_reply(u"/code > " + error_msg)
             return
 
-        date_list = self.bot.days_off_parser.get_my_days_off(user)
+        self._reply_days_off(user)
+
+    def _reply_days_off(self, user):
+        date_list = self.team.days_off_parser.get_my_days_off(user)
         if date_list:
             days = convert_date_list_to_strings(date_list)
             msg = u"%s has the following days off: [%s]" % (user, u", ".join(days))
         else:
             msg = u"%s doesn't have any days off registered" % user
 
-        self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+        self.send_reply(u"/code > " + msg)
 
-    def cmd_show_pod(self, room, user_nick, message):
-        msg = u"The current person-on-duty is: %s" % self.bot.sheriff_schedule.get_current_person()[1]
-        self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+    def _reply_save_failure(self, failure):
+        msg = u"ERROR: failed to save the changes: %s" % failure.getErrorMessage()
+        self.send_reply(u"/code > " + msg)
 
-    def cmd_show_next_pod(self, room, user_nick, message):
-        msg = u"Next person-on-duty is: %s" % self.bot.sheriff_schedule.get_next_available_person()[1]
-        self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+    @command(u'!SHOW_POD', parser=no_args)
+    def cmd_show_pod(self, room, user_nick, args):
+        msg = u"The current person-on-duty is: %s" % self.team.schedule.get_current_person()[0]
+        self.send_reply(u"/code > " + msg)
 
-    def cmd_next_pod(self, room, user_nick, message):
-        msg = u"Switching to the next person-on-duty: %s" % self.bot.sheriff_schedule.get_next_available_person()[1]
-        self.groupChat(self.room_jid, "/code > " + msg.encode('utf-8'))
+    @command(u'!SHOW_NEXT_POD', parser=no_args)
+    def cmd_show_next_pod(self, room, user_nick, args):
+        msg = u"Next person-on-duty is: %s" % self.team.schedule.get_next_available_person()[1]
+        self.send_reply(u"/code > " + msg)
 
-        self.bot.sheriff_schedule.switch_to_next_person()
+    @command(u'!NEXT_POD', parser=no_args)
+    def cmd_next_pod(self, room, user_nick, args):
+        msg = u"Switching to the next person-on-duty: %s" % self.team.schedule.get_next_available_person()[1]
 
-    def cmd_set_pod(self, room, user_nick, message):
-        args = message.body.decode('utf-8').split(u' ')
-        if len(args) != 2:
-            self.groupChat(self.room_jid, "/code > ERROR: Invalid command: " + message.body.encode('utf-8'))
+        d = self.team.schedule.switch_to_next_person()
+        d.addCallbacks(lambda _: self.send_reply(u"/code > " + msg), self._reply_save_failure)
+        return d
+
+    @command(u'!SET_POD')
+    def cmd_set_pod(self, room, user_nick, args):
+        if len(args) != 1:
+            msg = u"/code > ERROR: Invalid command: !SET_POD %s" % u" ".join(args)
+            self.send_reply(msg)
             return
 
-        name = args[1].strip()
-        current_sheriff = self.bot.sheriff_schedule.set_current_person(name)
-        if current_sheriff is None:
-            self.groupChat(self.room_jid, "/code > ERROR: name '%s' not found" + name.encode('utf-8'))
+        name, error_msg = self._find_member(args[0].lstrip(u'@'))
+        if error_msg is not None:
+            self.send_reply(u"/code > ERROR: " + error_msg)
+            return
+        self.team.schedule.set_current_person(name)
 
-    def cmd_show_topic_template(self, room, user_nick, message):
-        topic_string = self.bot.config.get(u'team', u'topic_update_time').encode('utf-8')
-        self.groupChat(self.room_jid, "/code > Current topic string: %s" % topic_string)
+    @command(u'!SHOW_TOPIC_TEMPLATE', parser=no_args)
+    def cmd_show_topic_template(self, room, user_nick, args):
+        topic_string = self.team.settings.topic_template.template
+        self.send_reply(u"/code > Current topic string: %s" % topic_string)
 
-    def cmd_set_topic_template(self, room, user_nick, message):
-        args = message.body.decode('utf-8').split(u' ', 1)
-        if len(args) != 2:
-            self.groupChat(self.room_jid, "/code > ERROR: missing topic string")
+    @command(u'!SET_TOPIC_TEMPLATE', parser=rest_of_line)
+    def cmd_set_topic_template(self, room, user_nick, topic_string):
+        if not topic_string:
+            self.send_reply(u"/code > ERROR: missing topic string")
+            return
+        if self.bot.leader_election is not None:
+            # the config file is not shared, the template would be lost when another instance takes over
+            self.send_reply(u"/code > ERROR: the topic string can't be changed in the room with HA enabled, "
+                            u"change topic_template in the config of every instance")
             return
 
-        topic_string = args[1].strip()
-        self.bot.config.set(u'team', u'topic_update_time', topic_string)
+        if not self.bot.apply_config_changes([(self.team.section, u'topic_template', topic_string)]):
+            self.send_reply(u"/code > ERROR: invalid topic string")
+            return
+        self.bot.save_config()
         msg = u"/code > Topic string changed to: %s" % topic_string
         if u"<name>" not in topic_string:
             msg += u"\nWARN: your topic string doesn't include <name>"
-        self.groupChat(self.room_jid, msg.encode('utf-8'))
+        self.send_reply(msg)
+
+    @command(u'!PROFILE', members_only=False)
+    def cmd_profile(self, room, user_nick, args):
+        if user_nick not in self.bot.settings.hipchat.admins:
+            self.send_reply(u"/code > ERROR: only admins can use !PROFILE")
+            return
+
+        profiler = self.bot.profiler
+        action = args[0].lower() if args else u''
+        if action == u'start':
+            if profiler.start() is None:
+                self.send_reply(u"/code > profiling session %s is already running" % profiler.session_name)
+            else:
+                self.send_reply(u"/code > profiling session %s started" % profiler.session_name)
+        elif action == u'stop':
+            d = profiler.stop()
+            if d is None:
+                self.send_reply(u"/code > no profiling session is running")
+                return
+            d.addCallbacks(self._reply_profile_written, self._reply_profile_failure)
+        else:
+            status = u"running (%s)" % profiler.session_name if profiler.is_active else u"not running"
+            self.send_reply(u"/code > profiling is %s, usage: !PROFILE start|stop" % status)
+
+    def _reply_profile_written(self, result):
+        profile_file, summary_file = result
+        self.send_reply(u"/code > profile written to %s, summary in %s" % (profile_file, summary_file))
+
+    def _reply_profile_failure(self, failure):
+        self._logger.error(u"failed to write the profile: %s", failure.getErrorMessage())
+        self.send_reply(u"/code > ERROR: failed to write the profile")
 
 
 def convert_date_list_to_strings(date_list):
@@ -282,19 +615,65 @@ def convert_date_list_to_strings(date_list):
 def make_client(bot, config, password):
     keepalive = KeepAlive()
     keepalive.interval = 30
-    xmppclient = XMPPClient(jid.internJID(config.get('hipchat', 'jid')), password)
-    xmppclient.logTraffic = True
+    settings = bot.settings.hipchat
+    xmppclient = XMPPClient(jid.internJID(settings.jid), password)
 
-    team_members = [n.strip() for n in config.get('team', 'members').decode('utf-8').strip().split(u',')]
+    # traffic is logged by the TrafficLogger, sampled
+    TrafficLogger(config.getfloat('log', 'traffic_sample_rate')).setHandlerParent(xmppclient)
 
-    mucbot = HipchatBot(bot,
-                        config.get('hipchat', 'room_server'),
-                        config.get('hipchat', 'room_jid'),
-                        config.get('team', 'room_name'),
-                        config.get('hipchat', 'nickname'),
-                        config.get('hipchat', 'stfu_minutes'),
-                        team_members)
-    mucbot.setHandlerParent(xmppclient)
+    bot.connection_monitor = ConnectionMonitor(settings.reconnect_initial_delay, settings.reconnect_max_delay)
+    bot.connection_monitor.setHandlerParent(xmppclient)
+
+    # one room handler per team, all on the same XMPP connection
+    for team in bot.teams:
+        team.mucbot = make_team_handler(bot, team)
+        team.mucbot.connection_monitor = bot.connection_monitor
+        bot.connection_monitor.mucbots.append(team.mucbot)
+        team.mucbot.setHandlerParent(xmppclient)
     keepalive.setHandlerParent(xmppclient)
 
     return xmppclient
+
+
+# the team options of the command rate limits
+RATE_LIMIT_OPTIONS = [u'cmd_rate_per_user', u'cmd_burst_per_user', u'cmd_rate_per_command', u'cmd_burst_per_command']
+
+
+def make_rate_limiter(team_settings):
+    return CommandRateLimiter(team_settings.cmd_rate_per_user,
+                              team_settings.cmd_burst_per_user,
+                              team_settings.cmd_rate_per_command,
+                              team_settings.cmd_burst_per_command)
+
+
+def make_team_handler(bot, team):
+    section = team.section
+    settings = bot.settings.hipchat
+    team_settings = team.settings
+    mucbot = HipchatBot(bot,
+                        team,
+                        settings.room_server,
+                        team_settings.room_jid,
+                        team_settings.room_name,
+                        settings.nickname,
+                        settings.stfu_minutes,
+                        team_settings.members,
+                        settings.send_interval,
+                        settings.send_merge_window,
+                        settings.send_queue_size,
+                        make_rate_limiter(team_settings))
+    mucbot.question_rely_interval = team_settings.question_interval
+    mucbot.commands.profiler = bot.profiler
+    # with HA, a new leader continues from the last handled message, so it's saved right away
+    save_delay = 0.0 if bot.leader_election is not None else 5.0
+    mucbot.replayer = CommandReplayer(mucbot, settings.replay_max_messages, save_delay=save_delay)
+
+    load_command_plugins(mucbot.commands, team_settings.command_plugins, mucbot)
+
+    # apply config changes without restarting
+    bot.config_events.subscribe(section, mucbot._on_team_config_changed,
+                                [u'members', u'question_interval'] + RATE_LIMIT_OPTIONS)
+    bot.config_events.subscribe(u'hipchat', mucbot._on_hipchat_config_changed,
+                                [u'stfu_minutes', u'send_interval', u'send_merge_window', u'send_queue_size',
+                                 u'replay_max_messages'])
+    return mucbot
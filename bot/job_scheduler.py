@@ -0,0 +1,291 @@
+import heapq
+import itertools
+import logging
+import time
+
+from croniter import croniter
+from twisted.internet import defer, reactor
+
+from .util.date import to_human_readable_time
+
+
+class CronTrigger(object):
+    """
+    Fires at the times given by a cron expression.
+    """
+
+    def __init__(self, cron_expr):
+        # validates the expression
+        croniter(cron_expr)
+        self.cron_expr = cron_expr
+
+    def get_next_time(self, current_time):
+        return croniter(self.cron_expr, current_time).get_next(float)
+
+    def get_times_between(self, start_time, end_time, max_count=1000):
+        """
+        Gets the times after start_time and not later than end_time.
+        :param start_time: The start time (exclusive).
+        :param end_time: The end time (inclusive).
+        :param max_count: The maximum number of times to return.
+        :return: A list of times in ascending order.
+        """
+        times = []
+        it = croniter(self.cron_expr, start_time)
+        while len(times) < max_count:
+            next_time = it.get_next(float)
+            if next_time > end_time:
+                break
+            times.append(next_time)
+        return times
+
+    def __repr__(self):
+        return u"cron(%s)" % self.cron_expr
+
+
+class IntervalTrigger(object):
+    """
+    Fires at a fixed interval.
+    """
+
+    def __init__(self, interval):
+        if interval <= 0:
+            raise RuntimeError(u"invalid job interval: %s" % interval)
+        self.interval = interval
+
+    def get_next_time(self, current_time):
+        return current_time + self.interval
+
+    def __repr__(self):
+        return u"every %s" % to_human_readable_time(self.interval)
+
+
+class Job(object):
+    """
+    A periodic job in the JobScheduler.
+    """
+
+    def __init__(self, scheduler, name, trigger, func, args, kwargs):
+        self._scheduler = scheduler
+        self.name = name
+        self.trigger = trigger
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+        self.next_time = None
+        # the sequence number of the job's current heap entry
+        self.seq = None
+        self.cancelled = False
+        self.running = False
+
+        self.run_count = 0
+        self.error_count = 0
+        self.skip_count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_run_time = None
+
+    def cancel(self):
+        """
+        Cancels the job. It won't be run again.
+        """
+        self._scheduler.cancel(self)
+
+    def get_stats(self):
+        return {u'trigger': repr(self.trigger),
+                u'next_time': self.next_time,
+                u'run_count': self.run_count,
+                u'error_count': self.error_count,
+                u'skip_count': self.skip_count,
+                u'total_time': self.total_time,
+                u'max_time': self.max_time,
+                u'last_run_time': self.last_run_time,
+                }
+
+
+class JobScheduler(object):
+    """
+    Runs cron and interval jobs. The jobs are kept in a min-heap ordered by their next run time
+    and a single reactor timer is scheduled for the earliest one.
+
+    The timer wakes up at least every check_interval seconds to detect clock jumps. When the
+    wall clock jumps, the next run times of all jobs are recalculated from the new time, and a
+    job that was due is run once.
+    """
+
+    def __init__(self, check_interval=60.0, jump_threshold=30.0, clock=reactor):
+        """
+        :param check_interval: The maximum time in seconds between two timer wake-ups.
+        :param jump_threshold: The difference in seconds between the expected and the actual time
+                               that is considered a clock jump.
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._clock = clock
+        self.check_interval = check_interval
+        self.jump_threshold = jump_threshold
+
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._timer = None
+        self._timer_time = None
+        self._running = False
+
+        self.clock_jump_count = 0
+        # (optional) the Profiler the jobs are run with
+        self.profiler = None
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def add_cron_job(self, name, cron_expr, func, *args, **kwargs):
+        """
+        Adds a job that runs at the times given by a cron expression.
+        :param name: The unique job name.
+        :param cron_expr: The cron expression.
+        :param func: The function to run, it may return a Deferred.
+        :return: The Job.
+        """
+        return self._add_job(name, CronTrigger(cron_expr), func, args, kwargs)
+
+    def add_interval_job(self, name, interval, func, *args, **kwargs):
+        """
+        Adds a job that runs every interval seconds, the first run is after one interval.
+        :param name: The unique job name.
+        :param interval: The interval in seconds.
+        :param func: The function to run, it may return a Deferred.
+        :return: The Job.
+        """
+        return self._add_job(name, IntervalTrigger(interval), func, args, kwargs)
+
+    def _add_job(self, name, trigger, func, args, kwargs):
+        if name in self._jobs:
+            raise RuntimeError(u"duplicate job name: %s" % name)
+        job = Job(self, name, trigger, func, args, kwargs)
+        self._jobs[name] = job
+        self._push(job, trigger.get_next_time(self._clock.seconds()))
+        self._logger.info(u"added job %s (%r), next run after %s", name, trigger,
+                          to_human_readable_time(job.next_time - self._clock.seconds()))
+        self._reschedule_timer()
+        return job
+
+    def cancel(self, job):
+        """
+        Cancels a job. The heap entry is removed lazily.
+        :param job: The Job or its name.
+        """
+        if not isinstance(job, Job):
+            job = self._jobs.get(job)
+        if job is None or job.cancelled:
+            return
+        job.cancelled = True
+        self._jobs.pop(job.name, None)
+        self._logger.info(u"cancelled job %s", job.name)
+        self._reschedule_timer()
+
+    def get_job(self, name):
+        return self._jobs.get(name)
+
+    def start(self):
+        self._running = True
+        self._reschedule_timer()
+
+    def stop(self):
+        self._running = False
+        self._cancel_timer()
+
+    def _push(self, job, next_time):
+        job.next_time = next_time
+        job.seq = next(self._counter)
+        heapq.heappush(self._heap, (next_time, job.seq, job))
+
+    def _peek(self):
+        # drop cancelled jobs and stale entries of rescheduled jobs
+        while self._heap:
+            _, seq, job = self._heap[0]
+            if not job.cancelled and seq == job.seq:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+
+    def _cancel_timer(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        self._timer_time = None
+
+    def _reschedule_timer(self):
+        self._cancel_timer()
+        if not self._running:
+            return
+        current_time = self._clock.seconds()
+        later = self.check_interval
+        entry = self._peek()
+        if entry is not None:
+            later = min(max(entry[0] - current_time, 0.0), later)
+        self._timer_time = current_time + later
+        self._timer = self._clock.callLater(later, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        current_time = self._clock.seconds()
+        drift = current_time - self._timer_time
+        if abs(drift) > self.jump_threshold:
+            self._on_clock_jump(drift, current_time)
+
+        # run all due jobs
+        while True:
+            entry = self._peek()
+            if entry is None or entry[0] > current_time:
+                break
+            heapq.heappop(self._heap)
+            job = entry[2]
+            self._push(job, job.trigger.get_next_time(current_time))
+            self._run_job(job)
+
+        self._reschedule_timer()
+
+    def _on_clock_jump(self, drift, current_time):
+        self.clock_jump_count += 1
+        self._logger.warning(u"clock jumped %s by %s, recalculating the job times",
+                             u"forward" if drift > 0 else u"backward", to_human_readable_time(abs(drift)))
+        for job in self._jobs.itervalues():
+            if drift > 0 and job.next_time <= current_time:
+                # the job was due, run it once
+                continue
+            self._push(job, job.trigger.get_next_time(current_time))
+
+    def _run_job(self, job):
+        if job.running:
+            # the previous run hasn't finished yet
+            job.skip_count += 1
+            self._logger.warning(u"job %s is still running, skipped", job.name)
+            return
+        job.running = True
+        start_time = time.time()
+        func = job.func if self.profiler is None else self.profiler.wrap(u'job %s' % job.name, job.func)
+        d = defer.maybeDeferred(func, *job.args, **job.kwargs)
+        d.addCallbacks(self._on_job_success, self._on_job_failure,
+                       callbackArgs=(job, start_time), errbackArgs=(job, start_time))
+
+    def _on_job_success(self, result, job, start_time):
+        self._update_stats(job, start_time)
+
+    def _on_job_failure(self, failure, job, start_time):
+        job.error_count += 1
+        self._logger.error(u"job %s failed: %s", job.name, failure.getTraceback())
+        self._update_stats(job, start_time)
+
+    def _update_stats(self, job, start_time):
+        elapsed = time.time() - start_time
+        job.running = False
+        job.run_count += 1
+        job.last_run_time = start_time
+        job.total_time += elapsed
+        job.max_time = max(job.max_time, elapsed)
+
+    def get_stats(self):
+        return {u'clock_jump_count': self.clock_jump_count,
+                u'jobs': dict((name, job.get_stats()) for name, job in self._jobs.iteritems()),
+                }
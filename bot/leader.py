@@ -0,0 +1,172 @@
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+
+from twisted.internet import reactor
+
+
+class LeaderElection(object):
+    """
+    Elects the leader of the instances that share a state directory. The leader holds an exclusive
+    advisory lock (flock) on the lock file, which the OS releases when the process dies, and renews
+    a lease every heartbeat. The standbys try to take the lock at every heartbeat.
+    An instance is the leader as long as it holds the lock, a heartbeat gives up the lock when the lock
+    file has been removed or replaced. The lease file tells the standbys who the leader is. A leader that
+    hangs keeps its lock, so the standbys only warn when its lease has expired.
+    """
+
+    def __init__(self, storage, lock_file, instance_id=None, lease=15.0, heartbeat_interval=5.0, clock=reactor):
+        """
+        :param storage: The FileStorage the lease file is written with.
+        :param lock_file: The lock file in the shared state directory, the lease is written to <lock_file>.lease.
+        :param instance_id: The name of this instance, <host>:<pid> by default.
+        :param lease: The lease in seconds.
+        :param heartbeat_interval: The interval in seconds between two heartbeats, shorter than the lease.
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._storage = storage
+        self._clock = clock
+        self.lock_file = lock_file
+        self.lease_file = lock_file + u'.lease'
+        self.instance_id = instance_id or u'%s:%s' % (socket.gethostname().decode('utf-8'), os.getpid())
+        self.lease = lease
+        self.heartbeat_interval = heartbeat_interval
+
+        self._lock_fd = None
+        self._lease_expires = None
+        self._heartbeat_call = None
+        self._was_leader = False
+        self._listeners = []
+
+        self.elected_count = 0
+        # the leader according to the lease file, as last read by a standby
+        self.leader_lease = None
+
+    @property
+    def is_leader(self):
+        # a stalled reactor delays the renewal of the lease, but nobody else can take the lock meanwhile
+        return self._lock_fd is not None
+
+    def add_listener(self, callback):
+        """
+        Adds a listener that is called with is_leader when this instance becomes the leader or stops being it.
+        :param callback: The listener.
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        """
+        Tries to become the leader right away, so the role is known when the rest of the bot starts,
+        and starts the heartbeats. The listeners are only called for the later changes.
+        """
+        self.heartbeat(notify=False)
+
+    def stop(self):
+        """
+        Stops the heartbeats and gives up the leadership, so a standby can take over at its next heartbeat.
+        """
+        if self._heartbeat_call is not None and self._heartbeat_call.active():
+            self._heartbeat_call.cancel()
+        self._heartbeat_call = None
+        if self._lock_fd is not None:
+            self._logger.info(u"giving up the leadership")
+            self._release_lock()
+        self._check_role_changed()
+
+    def heartbeat(self, notify=True):
+        """
+        Renews the lease of the leader, or tries to take the lock if this instance is a standby.
+        :param notify: If False, the listeners are not called.
+        """
+        self._heartbeat_call = self._clock.callLater(self.heartbeat_interval, self.heartbeat)
+
+        if self._lock_fd is not None and not self._is_lock_file_valid():
+            self._logger.error(u"the lock file %s has been removed or replaced, giving up the leadership",
+                               self.lock_file)
+            self._release_lock()
+        if self._lock_fd is None:
+            self._try_lock()
+
+        if self._lock_fd is not None:
+            self._renew_lease()
+        else:
+            self._check_leader_lease()
+        if notify:
+            self._check_role_changed()
+        else:
+            self._was_leader = self.is_leader
+
+    def _try_lock(self):
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            os.close(fd)
+            if e.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                self._logger.error(u"failed to lock %s: %s", self.lock_file, e)
+            return False
+        self._lock_fd = fd
+        self.elected_count += 1
+        self._logger.info(u"%s is elected as the leader", self.instance_id)
+        return True
+
+    def _release_lock(self):
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+            self._lease_expires = None
+
+    def _is_lock_file_valid(self):
+        # another instance could lock a new file if ours has been removed
+        try:
+            return os.fstat(self._lock_fd).st_ino == os.stat(self.lock_file).st_ino
+        except OSError:
+            return False
+
+    def _renew_lease(self):
+        current_time = self._clock.seconds()
+        self._lease_expires = current_time + self.lease
+        lease = {u'leader': self.instance_id,
+                 u'renewed': current_time,
+                 u'expires': self._lease_expires,
+                 }
+        self._storage.write(self.lease_file, json.dumps(lease)).addErrback(self._on_lease_write_failure)
+
+    def _on_lease_write_failure(self, failure):
+        # the lease is only informational for the standbys, the lock decides
+        self._logger.warning(u"failed to write the lease file: %s", failure.getErrorMessage())
+
+    def _check_leader_lease(self):
+        try:
+            with open(self.lease_file, 'rb') as f:
+                self.leader_lease = json.loads(f.read().decode('utf-8'))
+        except (IOError, ValueError):
+            self.leader_lease = None
+            return
+        expires = self.leader_lease.get(u'expires')
+        if expires is not None and self._clock.seconds() > expires + self.lease:
+            self._logger.warning(u"the lease of the leader %s has expired, but it still holds the lock, "
+                                 u"restart it to fail over", self.leader_lease.get(u'leader'))
+
+    def _check_role_changed(self):
+        is_leader = self.is_leader
+        if is_leader == self._was_leader:
+            return
+        self._was_leader = is_leader
+        self._logger.info(u"%s is now %s", self.instance_id, u"the leader" if is_leader else u"a standby")
+        for callback in self._listeners:
+            callback(is_leader)
+
+    def get_stats(self):
+        leader = self.instance_id if self.is_leader else (self.leader_lease or {}).get(u'leader')
+        return {u'instance_id': self.instance_id,
+                u'role': u'leader' if self.is_leader else u'standby',
+                u'leader': leader,
+                u'lease_expires': self._lease_expires,
+                u'elected_count': self.elected_count,
+                }
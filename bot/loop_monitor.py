@@ -0,0 +1,146 @@
+import collections
+import logging
+import math
+import sys
+import thread
+import threading
+import traceback
+
+from twisted.internet import reactor
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Gets a percentile with the nearest-rank method.
+    :param sorted_values: A sorted list of values.
+    :param percentile: The percentile (0 - 100).
+    :return: The value, or None if the list is empty.
+    """
+    if not sorted_values:
+        return
+    rank = int(math.ceil(percentile / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class LoopLagMonitor(object):
+    """
+    Measures how late the reactor runs a call scheduled at a fixed interval. The lag is the time the
+    reactor spent on other callbacks (or blocked in one) when the call was due.
+    A watchdog thread checks if the reactor has stopped ticking, and captures the stack of the reactor
+    thread while it's blocked, so the slow callback can be found in the log.
+    """
+
+    def __init__(self, interval=0.5, slow_threshold=0.25, window_size=1200, max_stack_depth=8,
+                 clock=reactor, use_watchdog=True):
+        """
+        :param interval: The tick interval in seconds.
+        :param slow_threshold: A lag longer than this many seconds is logged as a slow callback.
+        :param window_size: The number of recent lag samples the percentiles are computed from.
+        :param max_stack_depth: The number of innermost frames logged of a blocked reactor thread.
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._clock = clock
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.max_stack_depth = max_stack_depth
+        self._use_watchdog = use_watchdog
+
+        self._samples = collections.deque(maxlen=window_size)
+        self._call = None
+        self._expected_time = None
+        self._reactor_thread_id = None
+        self._watchdog = None
+        self._stop_event = None
+        # the stack captured by the watchdog during the current stall
+        self._stall_stack = None
+
+        self.tick_count = 0
+        self.slow_count = 0
+        self.max_lag = 0.0
+        # the recent slow callbacks: (time, lag, call site)
+        self.recent_slow_calls = collections.deque(maxlen=10)
+
+    @property
+    def is_running(self):
+        return self._call is not None
+
+    def start(self):
+        """
+        Starts the monitor, it must be called from the reactor thread.
+        """
+        if self.is_running:
+            return
+        self._reactor_thread_id = thread.get_ident()
+        self._schedule(self._clock.seconds())
+        if self._use_watchdog:
+            # each watchdog thread has its own event, so a restart doesn't keep an old thread running
+            self._stop_event = threading.Event()
+            self._watchdog = threading.Thread(target=self._run_watchdog, args=(self._stop_event,),
+                                              name=u'LoopLagWatchdog')
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        if self._stop_event is not None:
+            self._stop_event.set()
+        self._stop_event = None
+        self._watchdog = None
+
+    def _schedule(self, current_time):
+        self._expected_time = current_time + self.interval
+        self._call = self._clock.callLater(self.interval, self._tick)
+
+    def _tick(self):
+        current_time = self._clock.seconds()
+        lag = max(current_time - self._expected_time, 0.0)
+        self._samples.append(lag)
+        self.tick_count += 1
+        self.max_lag = max(self.max_lag, lag)
+
+        if lag > self.slow_threshold:
+            self.slow_count += 1
+            call_site = self._stall_stack
+            self.recent_slow_calls.append((current_time, lag, call_site))
+            if call_site is not None:
+                self._logger.warning(u"reactor was blocked for %.3f seconds in:\n%s", lag, call_site)
+            else:
+                self._logger.warning(u"reactor was blocked for %.3f seconds", lag)
+        # the next expected time must be set first, or the watchdog could capture the stall again
+        self._schedule(current_time)
+        self._stall_stack = None
+
+    def _run_watchdog(self, stop_event):
+        # checks a few times per tick interval
+        while not stop_event.wait(max(self.slow_threshold, self.interval) / 2.0):
+            self.check_stall()
+
+    def check_stall(self):
+        """
+        Captures the stack of the reactor thread if it has been blocked longer than the threshold.
+        Called by the watchdog thread.
+        """
+        expected_time = self._expected_time
+        if expected_time is None or self._stall_stack is not None:
+            return
+        if self._clock.seconds() - expected_time <= self.slow_threshold:
+            return
+        frame = sys._current_frames().get(self._reactor_thread_id)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame)[-self.max_stack_depth:]
+        self._stall_stack = u"".join(line.decode('utf-8', 'replace') for line in stack).rstrip()
+
+    def get_stats(self):
+        samples = sorted(self._samples)
+        return {u'ticks': self.tick_count,
+                u'slow_count': self.slow_count,
+                u'max_lag': self.max_lag,
+                u'p50': get_percentile(samples, 50),
+                u'p90': get_percentile(samples, 90),
+                u'p99': get_percentile(samples, 99),
+                u'recent_slow_calls': [{u'time': t, u'lag': lag, u'call_site': call_site}
+                                       for t, lag, call_site in self.recent_slow_calls],
+                }
@@ -0,0 +1,120 @@
+import collections
+import logging
+
+from twisted.internet import reactor
+
+CODE_PREFIX = u'/code '
+
+
+def merge_messages(msg1, msg2):
+    """
+    Merges two messages into one.
+    :param msg1: The first message.
+    :param msg2: The second message.
+    :return: The merged message, or None if the messages cannot be merged.
+    """
+    is_code1 = msg1.startswith(CODE_PREFIX)
+    is_code2 = msg2.startswith(CODE_PREFIX)
+    if is_code1 != is_code2:
+        # '/code' applies to the whole message, it can't be mixed with normal text
+        return
+    if is_code2:
+        msg2 = msg2[len(CODE_PREFIX):]
+    return msg1 + u'\n' + msg2
+
+
+class MessageOutbox(object):
+    """
+    A rate-limited queue for outgoing group chat messages.
+    Consecutive messages to the same room within the merge window are sent as one message.
+    """
+
+    def __init__(self, send_func, send_interval=1.0, merge_window=0.5, max_size=100, clock=reactor):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._clock = clock
+        self._send_func = send_func
+        self.send_interval = send_interval
+        self.merge_window = merge_window
+        self.max_size = max_size
+
+        # each item is [room_jid, message, time of the first message]
+        self._queue = collections.deque()
+        self._last_send_time = None
+        self._send_call = None
+        self._paused = False
+
+        self.sent_count = 0
+        self.merged_count = 0
+        self.dropped_count = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def pause(self):
+        """
+        Stops sending messages (e.g., while disconnected). New messages are still queued
+        until the queue is full.
+        """
+        self._paused = True
+        if self._send_call is not None:
+            self._send_call.cancel()
+            self._send_call = None
+
+    def resume(self):
+        """
+        Resumes sending the queued messages in order.
+        """
+        self._paused = False
+        self._schedule_send()
+
+    def put(self, room_jid, msg):
+        """
+        Queues a message.
+        :param room_jid: The room JID.
+        :param msg: The message (unicode).
+        """
+        current_time = self._clock.seconds()
+        if self._queue:
+            last_item = self._queue[-1]
+            if last_item[0] == room_jid and current_time - last_item[2] <= self.merge_window:
+                merged_msg = merge_messages(last_item[1], msg)
+                if merged_msg is not None:
+                    last_item[1] = merged_msg
+                    self.merged_count += 1
+                    return
+
+        if len(self._queue) >= self.max_size:
+            self._queue.popleft()
+            self.dropped_count += 1
+            self._logger.warning(u"outbox is full, dropped the oldest message (%s dropped in total)",
+                                 self.dropped_count)
+        self._queue.append([room_jid, msg, current_time])
+        self._schedule_send()
+
+    def _schedule_send(self):
+        if self._paused or self._send_call is not None or not self._queue:
+            return
+        current_time = self._clock.seconds()
+        later = max(self._queue[0][2] + self.merge_window - current_time, 0.0)
+        if self._last_send_time is not None:
+            later = max(self._last_send_time + self.send_interval - current_time, later)
+        self._send_call = self._clock.callLater(later, self._send_next)
+
+    def _send_next(self):
+        self._send_call = None
+        room_jid, msg, _ = self._queue.popleft()
+        self._send_func(room_jid, msg)
+        self.sent_count += 1
+        self._last_send_time = self._clock.seconds()
+        self._schedule_send()
+
+    def get_stats(self):
+        return {u'sent': self.sent_count,
+                u'merged': self.merged_count,
+                u'dropped': self.dropped_count,
+                u'queued': len(self._queue),
+                }
@@ -0,0 +1,164 @@
+import cProfile
+import datetime
+import functools
+import logging
+import os
+import pstats
+import time
+from StringIO import StringIO
+
+
+class Profiler(object):
+    """
+    An on-demand cProfile session for the code that runs on the reactor: command handlers, scheduled
+    jobs and HTTP callbacks are run through call() and only profiled while a session is active.
+    Only the synchronous part of a call is profiled, the work done later by the Deferred it returns
+    is profiled when its own callbacks are run through call().
+    When a session is stopped, the raw profile (for pstats or snakeviz) and a summary of the slowest
+    functions are written to the output directory.
+    """
+
+    def __init__(self, storage, output_dir=u'profiles', top_n=30):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._storage = storage
+        self.output_dir = output_dir
+        self.top_n = top_n
+
+        self._profile = None
+        self._session_name = None
+        self._session_start_time = None
+        self._depth = 0
+        # label -> [calls, total time, max time]
+        self._label_stats = {}
+
+    @property
+    def is_active(self):
+        return self._profile is not None
+
+    @property
+    def session_name(self):
+        return self._session_name
+
+    def start(self):
+        """
+        Starts a profiling session.
+        :return: The session name, or None if a session is already active.
+        """
+        if self.is_active:
+            return
+        self._profile = cProfile.Profile()
+        self._session_start_time = time.time()
+        self._session_name = datetime.datetime.fromtimestamp(self._session_start_time).strftime(u'%Y%m%d-%H%M%S')
+        self._label_stats = {}
+        self._logger.info(u"profiling session %s started", self._session_name)
+        return self._session_name
+
+    def stop(self):
+        """
+        Stops the profiling session and writes the profile and the summary in the storage thread pool.
+        :return: A Deferred that fires with the (profile file, summary file) paths,
+                 or None if there is no active session.
+        """
+        if not self.is_active:
+            return
+        profile = self._profile
+        self._profile = None
+        label_stats = self._label_stats
+        self._label_stats = {}
+        duration = time.time() - self._session_start_time
+        self._logger.info(u"profiling session %s stopped after %.1f seconds", self._session_name, duration)
+
+        base_path = os.path.join(self.output_dir, u'profile-%s' % self._session_name)
+        return self._storage.run(self._write_files, profile, label_stats, duration, base_path)
+
+    def call(self, label, func, *args, **kwargs):
+        """
+        Calls a function, and profiles it if a session is active.
+        :param label: The label of the call in the summary, e.g. u'job rotation[team]'.
+        :param func: The function.
+        :return: The result of the function.
+        """
+        profile = self._profile
+        if profile is None:
+            return func(*args, **kwargs)
+
+        # nested calls are profiled by the outermost one
+        if self._depth == 0:
+            profile.enable()
+        self._depth += 1
+        start_time = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start_time
+            self._depth -= 1
+            if self._depth == 0:
+                profile.disable()
+            stats = self._label_stats.setdefault(label, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def wrap(self, label, func):
+        """
+        Wraps a function with call(), e.g. to pass it as a callback.
+        :param label: The label of the calls in the summary.
+        :param func: The function.
+        :return: The wrapped function.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(label, func, *args, **kwargs)
+        return wrapper
+
+    def _write_files(self, profile, label_stats, duration, base_path):
+        # runs in the storage thread pool
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        profile_file = base_path + u'.prof'
+        summary_file = base_path + u'.txt'
+        profile.dump_stats(profile_file)
+        with open(summary_file, 'w') as f:
+            f.write(format_summary(profile, label_stats, duration, self.top_n).encode('utf-8'))
+        self._logger.info(u"profile written to %s, summary in %s", profile_file, summary_file)
+        return profile_file, summary_file
+
+
+def format_summary(profile, label_stats, duration, top_n):
+    """
+    Formats the summary of a profiling session.
+    :param profile: The cProfile.Profile.
+    :param label_stats: A dictionary of label -> [calls, total time, max time].
+    :param duration: The duration of the session in seconds.
+    :param top_n: The number of functions to list.
+    :return: The summary (unicode).
+    """
+    lines = [u"profiling session of %.1f seconds" % duration, u"",
+             u"%-50s %8s %10s %10s" % (u"label", u"calls", u"total(s)", u"max(s)")]
+    for label, (calls, total_time, max_time) in sorted(label_stats.items(), key=lambda i: -i[1][1]):
+        lines.append(u"%-50s %8d %10.3f %10.3f" % (label, calls, total_time, max_time))
+    lines.append(u"")
+
+    buf = StringIO()
+    try:
+        stats = pstats.Stats(profile, stream=buf)
+    except TypeError:
+        # nothing has been profiled
+        lines.append(u"no profiled calls")
+        return u"\n".join(lines) + u"\n"
+    stats.sort_stats('cumulative').print_stats(top_n)
+    stats.sort_stats('tottime').print_stats(top_n)
+    return u"\n".join(lines) + u"\n" + buf.getvalue().decode('utf-8', 'replace')
+
+
+def profiled(label):
+    """
+    Decorator that runs a method through the bot's profiler, the object needs a bot attribute.
+    :param label: The label of the calls in the summary.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            return self.bot.profiler.call(label, func, self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,281 @@
+import calendar
+import collections
+import logging
+
+from dateutil import parser as date_parser
+from twisted.internet import defer, reactor
+
+
+def parse_message_time(date_str):
+    """
+    Converts the date string of a room history item into a UTC timestamp.
+    :param date_str: The ISO 8601 date string, e.g., u'2016-10-01T09:00:00.123456+00:00'.
+    :return: The timestamp in seconds.
+    """
+    date = date_parser.parse(date_str)
+    return calendar.timegm(date.utctimetuple()) + date.microsecond / 1000000.0
+
+
+class CommandReplayer(object):
+    """
+    Keeps track of the last processed room message and, after (re)joining the room,
+    replays the commands sent while the bot was away.
+    Each message is handled at most once: messages are deduplicated by ID and
+    everything not newer than the last processed message is skipped.
+    The times are in the server's clock, as the dates of the history. The live messages only have the
+    local receive time and an XMPP ID that differs from the history ID, so the recent live commands are
+    kept by sender and text, matched to the history, and the offset between the clocks is learned from them.
+    """
+
+    def __init__(self, mucbot, max_messages=200, max_seen_ids=1000, save_delay=5.0, max_live_messages=20,
+                 max_clock_skew=300.0, clock=reactor):
+        """
+        :param mucbot: The HipchatBot of the team.
+        :param max_messages: The maximum number of history messages to check, 0 disables replaying.
+        :param max_seen_ids: The number of recent message IDs kept for deduplication.
+        :param save_delay: The delay in seconds before the last processed message is saved, 0 saves right away.
+        :param max_live_messages: The number of recent live commands kept to be matched to the history.
+        :param max_clock_skew: The maximum difference in seconds between the server and the local clock.
+        """
+        self._logger = logging.getLogger(u'%s[%s]' % (self.__class__.__name__, mucbot.team.section))
+        self._clock = clock
+        self.mucbot = mucbot
+        self.team = mucbot.team
+        self.max_messages = max_messages
+        self.max_seen_ids = max_seen_ids
+        self.save_delay = save_delay
+        self.max_live_messages = max_live_messages
+        self.max_clock_skew = max_clock_skew
+
+        # message ID -> message time
+        self._seen_ids = collections.OrderedDict()
+        self._save_call = None
+        self._in_progress = False
+        # the Deferreds waiting for the current replay to finish
+        self._replay_waiters = []
+        # live messages may arrive while the history is being fetched, so keep the starting point
+        self._replay_since = None
+        # the messages from this time on have been received live
+        self._replay_until = None
+
+        self.replayed_count = 0
+
+        self.state = None
+        self.last_message_id = None
+        self.last_message_time = None
+        # the recent live commands: (sender, message, local receive time)
+        self._live_messages = collections.deque(maxlen=max_live_messages)
+        # the server time minus the local time
+        self.clock_offset = 0.0
+        self.reload_state()
+
+    def reload_state(self):
+        """
+        Restores the last processed message from the team state.
+        """
+        self.state = self.team.state[u'history']
+        self.last_message_id = self.state.get(u'last_message_id')
+        self.last_message_time = self.state.get(u'last_message_time')
+        self.clock_offset = self.state.get(u'clock_offset', 0.0)
+        # only the live commands that have been handled
+        self._live_messages = collections.deque((tuple(m) for m in self.state.get(u'live_messages', [])),
+                                                maxlen=self.max_live_messages)
+        if self.last_message_time is not None:
+            # a standby records the messages without handling them, the ones after the last message
+            # the leader has handled must be replayed
+            for message_id, message_time in self._seen_ids.items():
+                if message_time > self.last_message_time:
+                    del self._seen_ids[message_id]
+
+    def record_live(self, message_id, user_nick, msg, receive_time):
+        """
+        Records a processed live message.
+        :param message_id: The XMPP message ID, can be None.
+        :param user_nick: The sender.
+        :param msg: The message.
+        :param receive_time: The local time the message was received.
+        """
+        if message_id and message_id in self._seen_ids:
+            return
+        if msg.startswith(u'!'):
+            self._live_messages.append((user_nick, msg, receive_time))
+        self.record(message_id, receive_time + self.clock_offset)
+
+    def record(self, message_id, message_time):
+        """
+        Records a processed message.
+        :param message_id: The message ID, can be None.
+        :param message_time: The server time of the message in seconds.
+        """
+        if message_id:
+            if message_id in self._seen_ids:
+                return
+            self._seen_ids[message_id] = message_time
+            while len(self._seen_ids) > self.max_seen_ids:
+                self._seen_ids.popitem(last=False)
+            self.last_message_id = message_id
+        if self.last_message_time is None or message_time > self.last_message_time:
+            self.last_message_time = message_time
+        self._schedule_save()
+
+    def _schedule_save(self):
+        if self.save_delay <= 0:
+            self._save()
+        # save with a delay, so a busy room doesn't cause a write per message
+        elif self._save_call is None:
+            self._save_call = self._clock.callLater(self.save_delay, self._save)
+
+    def flush(self):
+        """
+        Saves the last processed message now if it hasn't been saved yet.
+        :return: A Deferred that fires when the state is saved.
+        """
+        if self._save_call is None:
+            return defer.succeed(None)
+        self._save_call.cancel()
+        return self._save()
+
+    def _save(self):
+        self._save_call = None
+        self.state[u'last_message_id'] = self.last_message_id
+        self.state[u'last_message_time'] = self.last_message_time
+        self.state[u'clock_offset'] = self.clock_offset
+        self.state[u'live_messages'] = [list(m) for m in self._live_messages]
+        return self.team.save_state()
+
+    def replay(self, until=None):
+        """
+        Fetches the history since the last processed message and handles the missed commands.
+        :param until: (optional) The local time of the first message that is handled live, now by default.
+        :return: A Deferred that fires when the missed commands have been handled, or the history couldn't be fetched.
+        """
+        if self._in_progress:
+            return self._wait_for_replay()
+        if self.last_message_time is None or self.max_messages <= 0:
+            return defer.succeed(None)
+        if not self.mucbot.bot.is_leader:
+            # the leader handles the commands
+            return defer.succeed(None)
+        self._in_progress = True
+        self._replay_since = self.last_message_time
+        self._replay_until = (until if until is not None else self._clock.seconds()) + self.clock_offset
+        self._logger.info(u"checking missed commands since message %s...", self.last_message_id)
+        # the history may be delivered right away
+        d = self._wait_for_replay()
+        self.mucbot.bot.hipchat_api.view_room_history(self.team.room_name,
+                                                      max_results=self.max_messages,
+                                                      not_before=self.last_message_id,
+                                                      callback=self._on_history,
+                                                      failure_callback=self._on_history_failure)
+        return d
+
+    def _wait_for_replay(self):
+        d = defer.Deferred()
+        self._replay_waiters.append(d)
+        return d
+
+    def _finish_replay(self):
+        self._in_progress = False
+        waiters = self._replay_waiters
+        self._replay_waiters = []
+        for d in waiters:
+            d.callback(None)
+
+    def _on_history(self, result):
+        try:
+            self._replay_history(result)
+        finally:
+            self._finish_replay()
+
+    def _replay_history(self, result):
+        items = result.get(u'items', [])
+        if len(items) >= self.max_messages:
+            self._logger.warning(u"more than %s messages were missed, the older ones are not checked",
+                                 self.max_messages)
+
+        live_ids = self._match_live_messages(items)
+        replayed_count = 0
+        for item in items:
+            message_id = item.get(u'id')
+            if message_id in self._seen_ids or message_id in live_ids:
+                continue
+            try:
+                message_time = parse_message_time(item[u'date'])
+            except (KeyError, ValueError):
+                continue
+            if message_time <= self._replay_since:
+                continue
+            if message_time >= self._replay_until:
+                # received live after the history was requested
+                continue
+
+            if self._replay_message(item):
+                replayed_count += 1
+            self.record(message_id, message_time)
+
+        if live_ids:
+            self._schedule_save()
+        self.replayed_count += replayed_count
+        self._logger.info(u"replayed %s missed command(s)", replayed_count)
+
+    def _match_live_messages(self, items):
+        """
+        Finds the history items of the live commands, which have been handled, and updates the clock offset
+        and the last processed message with them.
+        :param items: The history items.
+        :return: The IDs of the items that have been handled live.
+        """
+        candidates = []
+        for item in items:
+            sender = item.get(u'from')
+            if not isinstance(sender, dict) or not item.get(u'message'):
+                continue
+            try:
+                message_time = parse_message_time(item[u'date'])
+            except (KeyError, ValueError):
+                continue
+            candidates.append((item.get(u'id'), sender.get(u'name'), item[u'message'].strip(), message_time))
+
+        live_ids = set()
+        unmatched = []
+        for user_nick, msg, receive_time in self._live_messages:
+            estimated_time = receive_time + self.clock_offset
+            best = None
+            for candidate in candidates:
+                message_id, name, message, message_time = candidate
+                if message_id in live_ids or name != user_nick or message != msg:
+                    continue
+                diff = abs(message_time - estimated_time)
+                if diff <= self.max_clock_skew and (best is None or diff < abs(best[3] - estimated_time)):
+                    best = candidate
+            if best is None:
+                unmatched.append((user_nick, msg, receive_time))
+                continue
+            message_id, _, _, message_time = best
+            live_ids.add(message_id)
+            # the delivery delay is counted as skew, it only makes the offset a bit smaller
+            self.clock_offset = message_time - receive_time
+            if message_time > self.last_message_time:
+                self.last_message_id = message_id
+                self.last_message_time = message_time
+        self._live_messages = collections.deque(unmatched, maxlen=self.max_live_messages)
+        return live_ids
+
+    def _on_history_failure(self, failure):
+        self._finish_replay()
+
+    def _replay_message(self, item):
+        sender = item.get(u'from')
+        msg = item.get(u'message')
+        # notifications have a plain string as the sender
+        if not isinstance(sender, dict) or not msg:
+            return False
+        user_nick = sender.get(u'name')
+        if user_nick is None or user_nick == self.mucbot.nickname:
+            return False
+        msg = msg.strip()
+        if not msg.startswith(u'!'):
+            return False
+
+        self._logger.info(u"replaying missed command from '%s': %s", user_nick, msg)
+        return self.mucbot.commands.dispatch(None, user_nick, msg)
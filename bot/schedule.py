@@ -1,73 +1,192 @@
-from ConfigParser import ConfigParser
-import codecs
 import datetime
-import json
 import logging
-import os
-import time
 
-from croniter import croniter
 from twisted.internet import reactor
 
+from .job_scheduler import CronTrigger
 from .util.date import to_human_readable_time
 from .util.team_scheduler import TeamRoundRobinScheduler
 
 
 class Schedule(object):
 
-    def __init__(self, bot):
-        self._logger = logging.getLogger(self.__class__.__name__)
+    def __init__(self, bot, team, clock=reactor):
+        self._logger = logging.getLogger(u'%s[%s]' % (self.__class__.__name__, team.section))
+        self._clock = clock
         self.bot = bot
-        self.config = bot.config
+        self.team = team
 
         # team members are sorted alphabetically
-        team_members = [n.strip() for n in self.config.get(u'team', u'members').strip().split(u',')]
+        team_members = team.members
         self.team_members = sorted(team_members)
 
-        self._team_scheduler = TeamRoundRobinScheduler(team_members, bot.days_off_parser)
-
-        # load cache file
-        self.cache_file = self.config.get(u'team', u'cache_file')
-        self.cache_config = ConfigParser()
-        if os.path.exists(self.cache_file):
-            with codecs.open(self.cache_file, 'r', 'utf-8') as f:
-                self.cache_config.readfp(f)
-
-        if not self.cache_config.has_section(u'schedule'):
-            self.cache_config.add_section(u'schedule')
-        if not self.cache_config.has_option(u'schedule', u'last_idx'):
-            self.cache_config.set(u'schedule', u'last_idx', 0)
-
-        current_idx = self.cache_config.getint(u'schedule', u'last_idx')
-        self._team_scheduler.set_current_person_idx(current_idx)
-
-        self.crontab = croniter(self.config.get(u'team', u'topic_update_time'))
-
-        self.next_scheduled_defer = None
+        self._team_scheduler = TeamRoundRobinScheduler(team_members, team.days_off_parser)
+
+        # index the mention names we already know and keep them updated
+        self._index_mention_names()
+        bot.hipchat_db.add_user_listener(self.member_index.set_mention_name)
+
+        self.state = None
+        # the time of the last rotation, None if the bot has never rotated
+        self.last_rotation_time = None
+        self.reload_state()
+
+        self.job = None
+        bot.config_events.subscribe(team.section, self._on_config_changed,
+                                    [u'members', u'topic_update_time', u'topic_template'])
+
+    def _index_mention_names(self):
+        for name in self.team_members:
+            data = self.bot.hipchat_db.get_user_data(name)
+            if data is not None:
+                self.member_index.set_mention_name(name, data.mention_name)
+
+    def reload_state(self):
+        """
+        Restores the rotation position from the team state, e.g. after the state file has been
+        reloaded when this instance becomes the leader.
+        """
+        # the rotation position is kept by name, so it doesn't move when members are added or reordered
+        team_members = self.team.members
+        self.state = self.team.state[u'schedule']
+        current_person = self.state.get(u'current_person')
+        if current_person in team_members:
+            self._team_scheduler.set_current_person_idx(team_members.index(current_person))
+        else:
+            # the person has been removed, continue from about the same position
+            self._team_scheduler.set_current_person_idx(self.state.get(u'current_idx', 0))
+        self.last_rotation_time = self.state.get(u'last_rotation')
 
     def start(self):
-        next_time = self.crontab.get_next() - time.time()
-        self._logger.info(u"next update will be after %s", to_human_readable_time(next_time))
-        self.next_scheduled_defer = reactor.callLater(next_time, self._regular_task)
+        # a standby catches up when it becomes the leader
+        if self.bot.is_leader:
+            self.catch_up()
+        self._add_job()
+
+    def _add_job(self):
+        self.job = self.bot.job_scheduler.add_cron_job(u'rotation[%s]' % self.team.section,
+                                                       self.team.settings.topic_update_time,
+                                                       self._regular_task)
+
+    def _on_config_changed(self, options):
+        if u'members' in options:
+            self.set_members(self.team.members)
+        if u'topic_update_time' in options:
+            self.reschedule()
+        if u'topic_template' in options:
+            self._logger.info(u"the new topic template will be used from the next update")
+
+    def set_members(self, team_members):
+        """
+        Changes the team members, the current person-on-duty is kept if they are still in the team.
+        :param team_members: The new list of team members.
+        """
+        if not team_members:
+            self._logger.error(u"the team has no members, keep the current members")
+            return
+        self._team_scheduler.set_teammate_list(team_members)
+        self.team_members = sorted(team_members)
+        self._index_mention_names()
+        self._logger.info(u"team members changed to %s, the person-on-duty is %s",
+                          u", ".join(team_members), self.get_current_person()[0])
+        # the days off are listed per member
+        self.bot.status_cache.invalidate(u'days_off')
+        return self._save_state()
+
+    def reschedule(self):
+        """
+        Replaces the rotation job with one using the current topic_update_time.
+        """
+        if self.job is None:
+            # not started yet
+            return
+        # the cron expression has been validated with the settings
+        self.job.cancel()
+        self._add_job()
+        # the next rotation time has changed
+        self.bot.status_cache.invalidate(u'teams')
+
+    def catch_up(self, max_count=1000):
+        """
+        Applies the rotations that were missed while the bot was down, then updates the topic and
+        notifies the person-on-duty once.
+        :param max_count: The maximum number of missed rotations to apply.
+        :return: The number of missed rotations that are applied.
+        """
+        current_time = self._clock.seconds()
+        if self.last_rotation_time is None:
+            # first start, nothing is missed
+            self.last_rotation_time = current_time
+            self._save_state()
+            return 0
+
+        trigger = CronTrigger(self.team.settings.topic_update_time)
+        missed_times = trigger.get_times_between(self.last_rotation_time, current_time, max_count)
+        if not missed_times:
+            return 0
+        if len(missed_times) == max_count:
+            self._logger.warning(u"too many missed rotations, only %s are applied", max_count)
+
+        # skip the closure days and the people who were not available on each missed date
+        applied_count = 0
+        for missed_time in missed_times:
+            missed_date = datetime.date.fromtimestamp(missed_time)
+            if self.get_team_closure(missed_date) is not None:
+                continue
+            self._team_scheduler.switch_to_next_person(missed_date)
+            applied_count += 1
+        self.last_rotation_time = missed_times[-1]
+        self._logger.info(u"applied %s missed rotation(s) since %s", applied_count,
+                          datetime.datetime.fromtimestamp(missed_times[0]).strftime(u'%Y-%m-%d %H:%M'))
+
+        if applied_count:
+            self._update_hipchat_info()
+        self._save_state()
+        return applied_count
 
     def _regular_task(self):
-        # switch to the next person
-        self.switch_to_next_person()
-
-        next_time = self.crontab.get_next() - time.time()
-        self._logger.info(u"next update will be after %s", to_human_readable_time(next_time))
-        self.next_scheduled_defer = reactor.callLater(next_time, self._regular_task)
+        if not self.bot.is_leader:
+            self._logger.info(u"not the leader, skip the rotation")
+            return
+        current_time = self._clock.seconds()
+        closure = self.get_team_closure(datetime.date.fromtimestamp(current_time))
+        if closure is not None:
+            self._logger.info(u"the team is closed today (%s), skip the rotation", closure)
+            self.last_rotation_time = current_time
+            return self._save_state()
 
-    def _update_cache(self):
-        self.cache_config.set(u'schedule', u'last_idx', self.get_current_person()[1])
-        with codecs.open(self.cache_file, 'w', 'utf-8') as f:
-            self.cache_config.write(f)
+        # switch to the next person
+        d = self.switch_to_next_person()
+        self._logger.info(u"next update will be after %s",
+                          to_human_readable_time(self.job.next_time - self._clock.seconds()))
+        return d
+
+    def set_closure_index(self, closure_index):
+        self._team_scheduler.closure_index = closure_index
+
+    def get_team_closure(self, date):
+        """
+        Checks if the whole team is closed on the given date.
+        :param date: The date.
+        :return: The summary of the closure, or None.
+        """
+        closure_index = self._team_scheduler.closure_index
+        return closure_index.get_team_closure(date) if closure_index is not None else None
+
+    def _save_state(self):
+        current_person, current_idx = self.get_current_person()
+        self.state[u'current_person'] = current_person
+        self.state[u'current_idx'] = current_idx
+        self.state[u'last_rotation'] = self.last_rotation_time
+        self.bot.status_cache.invalidate(u'teams')
+        return self.team.save_state()
 
     def switch_to_next_person(self):
-        current_date = datetime.date.fromtimestamp(time.time())
-        self._team_scheduler.switch_to_next_person(current_date)
-        self._update_cache()
+        current_time = self._clock.seconds()
+        self._team_scheduler.switch_to_next_person(datetime.date.fromtimestamp(current_time))
+        self.last_rotation_time = current_time
         self._update_hipchat_info()
+        return self._save_state()
 
     def _update_hipchat_info(self):
         current_person, person_idx = self.get_current_person()
@@ -75,16 +194,16 @@ class Schedule(object):
         self._logger.info(u"today's person-on-duty is %s, index: %s", current_person, person_idx)
 
         # set room topic
-        room_name = self.config.get(u'team', u'room_name')
-        topic = self.config.get(u'team', u'topic_template').replace(u'<name>', current_person)
+        room_name = self.team.room_name
+        topic = self.team.settings.topic_template.render(current_person)
         self.bot.hipchat_api.set_room_topic(room_name, topic)
+        self.state[u'last_topic'] = topic
 
         # try to get mention name
         msg = u" >>> Today's person-on-duty is %s" % current_person
-        data = None
-        if self.bot.hipchat_db.has(current_person):
-            data = json.loads(self.bot.hipchat_db.get(current_person), encoding='utf-8')
-            mention_name = data[u'mention_name']
+        data = self.bot.hipchat_db.get_user_data(current_person)
+        if data is not None:
+            mention_name = data.mention_name
             msg += u" @%s" % mention_name
 
         # send room message
@@ -93,23 +212,42 @@ class Schedule(object):
 
         # also send private message if data is available
         if data is not None:
-            user_id = data[u'id']
-            msg = u"Hi %(name)s, you are the person-on-duty of room %(room)s today." % {u'name': data[u'name'],
+            user_id = data.id
+            msg = u"Hi %(name)s, you are the person-on-duty of room %(room)s today." % {u'name': data.name,
                                                                                         u'room': room_name}
             msg += u"\nAll potential questions will be forwarded to you."
             self.bot.hipchat_api.send_private_message(user_id, msg)
 
+    @property
+    def member_index(self):
+        return self._team_scheduler.member_index
+
     def get_current_person(self):
         return self._team_scheduler.get_current_person()
 
+    def get_forecast(self, days=14, max_count=30):
+        """
+        Gets the coming rotations, the closure days are included without a person.
+        :param days: The number of days to look ahead.
+        :param max_count: The maximum number of rotations.
+        :return: A list of (date, person name or None, closure summary or None) tuples.
+        """
+        current_time = self._clock.seconds()
+        trigger = CronTrigger(self.team.settings.topic_update_time)
+        dates = [datetime.date.fromtimestamp(t)
+                 for t in trigger.get_times_between(current_time, current_time + days * 24 * 3600, max_count)]
+        closures = dict((d, self.get_team_closure(d)) for d in dates)
+        people = dict(self._team_scheduler.get_forecast([d for d in dates if closures[d] is None]))
+        return [(d, people.get(d), closures[d]) for d in dates]
+
     def get_next_available_person(self):
-        current_date = datetime.date.fromtimestamp(time.time())
+        current_date = datetime.date.fromtimestamp(self._clock.seconds())
         next_person_name, next_idx = self._team_scheduler.get_next_person(current_date)
         return next_idx, next_person_name
 
     def set_current_person(self, name):
         result = self._team_scheduler.set_current_person(name)
         if result is not None:
-            self._update_cache()
             self._update_hipchat_info()
+            self._save_state()
         return result
@@ -0,0 +1,169 @@
+import collections
+import logging
+
+from twisted.internet import defer, reactor
+
+
+def _chain(result, d):
+    d.callback(result)
+    return result
+
+
+class StartupPhase(object):
+    """
+    A part of the start-up that runs in parallel with the others, e.g. fetching the config or joining a room.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+        self.deferred = defer.Deferred()
+
+    @property
+    def is_done(self):
+        return self.end_time is not None
+
+    @property
+    def is_ready(self):
+        return self.is_done and self.error is None
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time if self.is_done else None
+
+    def get_stats(self):
+        return {u'ready': self.is_ready,
+                u'duration': self.duration,
+                u'error': self.error,
+                }
+
+
+class StartupTracker(object):
+    """
+    Tracks the start-up phases, so the features can wait for only the phases they need,
+    and reports how long each phase took.
+    """
+
+    def __init__(self, clock=reactor):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._clock = clock
+        self._phases = collections.OrderedDict()
+        self._start_time = clock.seconds()
+        self._report_logged = False
+
+    def begin(self, name):
+        """
+        Starts a phase. Starting a phase twice has no effect.
+        :param name: The phase name.
+        :return: The StartupPhase.
+        """
+        phase = self._get_phase(name)
+        if phase.start_time is None:
+            phase.start_time = self._clock.seconds()
+            self._logger.debug(u"phase %s started", name)
+        return phase
+
+    def _get_phase(self, name):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = StartupPhase(name)
+        return phase
+
+    def finish(self, name):
+        """
+        Marks a phase as ready. Finishing a phase again (e.g. joining a room again) has no effect.
+        :param name: The phase name.
+        """
+        phase = self.begin(name)
+        if phase.is_done:
+            return
+        phase.end_time = self._clock.seconds()
+        self._logger.info(u"phase %s is ready after %.2f seconds", name, phase.duration)
+        phase.deferred.callback(name)
+        self._check_all_done()
+
+    def fail(self, name, error):
+        """
+        Marks a phase as failed, the features that need it will never be ready.
+        :param name: The phase name.
+        :param error: The error message.
+        """
+        phase = self.begin(name)
+        if phase.is_done:
+            return
+        phase.end_time = self._clock.seconds()
+        phase.error = error
+        self._logger.error(u"phase %s failed after %.2f seconds: %s", name, phase.duration, error)
+        self._check_all_done()
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        Runs a phase. The phase is ready when the function returns, or when the Deferred it returns fires.
+        :param name: The phase name.
+        :param func: The function.
+        :return: A Deferred that fires with the result, or fails with the error.
+        """
+        self.begin(name)
+
+        def on_success(result):
+            self.finish(name)
+            return result
+
+        def on_failure(failure):
+            self.fail(name, failure.getErrorMessage())
+            return failure
+
+        return defer.maybeDeferred(func, *args, **kwargs).addCallbacks(on_success, on_failure)
+
+    def is_ready(self, *names):
+        """
+        Checks if all the given phases are ready. A phase that hasn't started yet is not ready.
+        """
+        return all(name in self._phases and self._phases[name].is_ready for name in names)
+
+    def when_ready(self, *names):
+        """
+        Waits for the given phases.
+        :return: A Deferred that fires when all the given phases are ready.
+        """
+        deferreds = []
+        for name in names:
+            phase = self._get_phase(name)
+            if not phase.is_ready:
+                # each waiter gets its own Deferred, so callbacks don't change the result for the others
+                d = defer.Deferred()
+                phase.deferred.addCallback(_chain, d)
+                deferreds.append(d)
+        if not deferreds:
+            return defer.succeed(None)
+        return defer.gatherResults(deferreds).addCallback(lambda _: None)
+
+    def _check_all_done(self):
+        phases = [phase for phase in self._phases.itervalues() if phase.start_time is not None]
+        if self._report_logged or not all(phase.is_done for phase in phases):
+            return
+        self._report_logged = True
+        self._logger.info(u"start-up finished after %.2f seconds: %s",
+                          self._clock.seconds() - self._start_time, self.format_report())
+
+    def format_report(self):
+        """
+        Formats the time spent in each phase.
+        :return: A unicode string.
+        """
+        parts = []
+        for phase in self._phases.itervalues():
+            if phase.start_time is None:
+                parts.append(u"%s not started" % phase.name)
+            elif phase.error is not None:
+                parts.append(u"%s failed (%.2fs)" % (phase.name, phase.duration))
+            elif phase.is_done:
+                parts.append(u"%s %.2fs" % (phase.name, phase.duration))
+            else:
+                parts.append(u"%s pending" % phase.name)
+        return u", ".join(parts)
+
+    def get_stats(self):
+        return collections.OrderedDict((name, phase.get_stats()) for name, phase in self._phases.iteritems())
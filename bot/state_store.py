@@ -0,0 +1,135 @@
+from ConfigParser import ConfigParser
+import codecs
+import json
+import logging
+import os
+
+from twisted.internet import defer
+
+# the version of the state file layout, increase it and add a migration when the layout changes
+SCHEMA_VERSION = 1
+
+
+def _migrate_from_v0(data):
+    # version 0 is an empty state
+    data[u'teams'] = data.get(u'teams', {})
+    data[u'user_db'] = data.get(u'user_db', {})
+    return data
+
+
+# migration functions from a version to the next one
+MIGRATIONS = {0: _migrate_from_v0,
+              }
+
+
+def migrate_state(data):
+    """
+    Migrates the given state to the current schema version.
+    :param data: The state dictionary.
+    :return: The migrated state dictionary.
+    """
+    version = data.get(u'version', 0)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(u"the state file version %s is newer than the supported version %s" %
+                           (version, SCHEMA_VERSION))
+    while version < SCHEMA_VERSION:
+        data = MIGRATIONS[version](data)
+        version += 1
+        data[u'version'] = version
+    return data
+
+
+def load_legacy_cache(cache_file, team_members):
+    """
+    Loads the team state from an old ConfigParser cache file.
+    :param cache_file: The cache file path.
+    :param team_members: The team members in config order, used to convert the index to a name.
+    :return: The team state dictionary, or None if the file doesn't exist.
+    """
+    if not os.path.isfile(cache_file):
+        return
+    cache_config = ConfigParser()
+    with codecs.open(cache_file, 'r', 'utf-8') as f:
+        cache_config.readfp(f)
+
+    schedule = {}
+    if cache_config.has_option(u'schedule', u'last_idx') and team_members:
+        idx = cache_config.getint(u'schedule', u'last_idx') % len(team_members)
+        schedule[u'current_person'] = team_members[idx]
+        schedule[u'current_idx'] = idx
+    if cache_config.has_option(u'schedule', u'last_rotation'):
+        schedule[u'last_rotation'] = cache_config.getfloat(u'schedule', u'last_rotation')
+
+    history = {}
+    if cache_config.has_option(u'history', u'last_message_id'):
+        history[u'last_message_id'] = cache_config.get(u'history', u'last_message_id') or None
+    if cache_config.has_option(u'history', u'last_message_time'):
+        history[u'last_message_time'] = cache_config.getfloat(u'history', u'last_message_time')
+    return {u'schedule': schedule, u'history': history}
+
+
+class StateStore(object):
+    """
+    Keeps the runtime state of the bot (rotation positions, sync cursors, etc.) in one JSON file.
+    The file is written through the FileStorage, which replaces it atomically.
+    """
+
+    def __init__(self, storage, file_path):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.storage = storage
+        self.file_path = file_path
+        self._data = migrate_state({})
+        # a standby instance must not overwrite the state file of the leader
+        self.read_only = False
+
+    def load(self):
+        """
+        Loads the state file if it exists.
+        :return: True if the state file exists, otherwise False.
+        """
+        if not os.path.exists(self.file_path):
+            self._logger.info(u"no state file %s", self.file_path)
+            return False
+        with codecs.open(self.file_path, 'r', 'utf-8') as f:
+            data = json.load(f)
+        version = data.get(u'version', 0)
+        self._data = migrate_state(data)
+        if version != self._data[u'version']:
+            self._logger.info(u"migrated state file from version %s to %s", version, self._data[u'version'])
+        return True
+
+    @property
+    def data(self):
+        return self._data
+
+    def get_team_state(self, section):
+        """
+        Gets the state dictionary of a team, it's created if it doesn't exist.
+        :param section: The team section name.
+        :return: The team state dictionary.
+        """
+        team_state = self._data[u'teams'].get(section)
+        if team_state is None:
+            team_state = self._data[u'teams'][section] = {u'schedule': {}, u'history': {}}
+        return team_state
+
+    def set_team_state(self, section, team_state):
+        self._data[u'teams'][section] = team_state
+
+    def has_team_state(self, section):
+        return section in self._data[u'teams']
+
+    def get_user_db_state(self):
+        return self._data[u'user_db']
+
+    def dumps(self):
+        return json.dumps(self._data, indent=2, sort_keys=True, ensure_ascii=False)
+
+    def save(self):
+        """
+        Saves the state file in the storage thread pool.
+        :return: A Deferred that fires when the file is written.
+        """
+        if self.read_only:
+            return defer.succeed(None)
+        return self.storage.write(self.file_path, self.dumps())
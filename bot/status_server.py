@@ -0,0 +1,166 @@
+"""
+A read-only HTTP status API for dashboards.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import time
+
+from twisted.internet import reactor
+from twisted.web import http, resource, server
+
+
+class StatusCache(object):
+    """
+    Caches the serialized status resources. A resource is built again when it has been invalidated
+    by a state change, or when it's older than its maximum age.
+    """
+
+    def __init__(self, clock=reactor):
+        self._clock = clock
+        # name -> version, bumped when the state of the resource changes
+        self._version_dict = {}
+        # name -> (cache key, build time, body, etag)
+        self._entry_dict = {}
+
+        self.hit_count = 0
+        self.build_count = 0
+
+    def invalidate(self, *names):
+        """
+        Marks resources as changed.
+        :param names: The resource names.
+        """
+        for name in names:
+            self._version_dict[name] = self._version_dict.get(name, 0) + 1
+
+    def get(self, name, build_func, max_age=None):
+        """
+        Gets a serialized resource.
+        :param name: The resource name.
+        :param build_func: Called to build the data of the resource, must return a JSON-serializable object.
+        :param max_age: (optional) The maximum age in seconds, for the resources that change all the time.
+        :return: A tuple of the body (bytes) and the ETag.
+        """
+        current_time = self._clock.seconds()
+        # the forecasts change at midnight without a state change
+        key = (self._version_dict.get(name, 0), datetime.date.fromtimestamp(current_time))
+        entry = self._entry_dict.get(name)
+        if entry is not None and entry[0] == key and (max_age is None or current_time - entry[1] < max_age):
+            self.hit_count += 1
+            return entry[2], entry[3]
+
+        body = json.dumps(build_func(), sort_keys=True, indent=2, ensure_ascii=False).encode('utf-8')
+        etag = b'"%s"' % hashlib.sha1(body).hexdigest()
+        self._entry_dict[name] = (key, current_time, body, etag)
+        self.build_count += 1
+        return body, etag
+
+
+class JsonResource(resource.Resource):
+    """
+    A cached JSON resource that supports conditional requests with If-None-Match.
+    """
+    isLeaf = True
+
+    def __init__(self, cache, name, build_func, max_age=None):
+        resource.Resource.__init__(self)
+        self.cache = cache
+        self.name = name
+        self.build_func = build_func
+        self.max_age = max_age
+
+    def render_GET(self, request):
+        body, etag = self.cache.get(self.name, self.build_func, self.max_age)
+        request.setHeader(b'content-type', b'application/json; charset=utf-8')
+        request.setHeader(b'cache-control', b'no-cache')
+        request.setHeader(b'etag', etag)
+        if_none_match = request.getHeader(b'if-none-match')
+        if if_none_match is not None and etag in [t.strip() for t in if_none_match.split(b',')]:
+            request.setResponseCode(http.NOT_MODIFIED)
+            return b''
+        return body
+
+
+def format_date(d):
+    return d.strftime(u'%Y-%m-%d') if isinstance(d, datetime.date) else d
+
+
+class StatusServer(object):
+    """
+    Serves the status of the bot as JSON:
+      /status/teams    : the current and the next person-on-duty and the rotation forecast of each team
+      /status/days_off : the days off of the members of each team
+      /status/health   : the connection, the start-up phases, the user database sync, the reactor lag
+                         and the HA role
+    """
+
+    def __init__(self, bot, forecast_days=14, health_max_age=5.0):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.bot = bot
+        self.forecast_days = forecast_days
+        self._port = None
+
+        cache = bot.status_cache
+        self.root = resource.Resource()
+        status = resource.Resource()
+        self.root.putChild(b'status', status)
+        status.putChild(b'teams', JsonResource(cache, u'teams', self.get_teams))
+        status.putChild(b'days_off', JsonResource(cache, u'days_off', self.get_days_off))
+        status.putChild(b'health', JsonResource(cache, u'health', self.get_health, health_max_age))
+
+    def start(self, port, interface=u''):
+        """
+        Starts listening.
+        :param port: The TCP port.
+        :param interface: The interface to listen on, all interfaces if empty.
+        """
+        self._port = reactor.listenTCP(port, server.Site(self.root), interface=interface)
+        self._logger.info(u"status server listening on %s:%s", interface or u'*', port)
+
+    def stop(self):
+        if self._port is not None:
+            d = self._port.stopListening()
+            self._port = None
+            return d
+
+    def get_teams(self):
+        teams = {}
+        for team in self.bot.teams:
+            schedule = team.schedule
+            current_person, current_idx = schedule.get_current_person()
+            next_idx, next_person = schedule.get_next_available_person()
+            teams[team.section] = {
+                u'room': team.room_name,
+                u'members': list(team.members),
+                u'current_person': current_person,
+                u'next_person': next_person,
+                u'last_rotation': schedule.last_rotation_time,
+                u'forecast': [{u'date': format_date(d), u'person': person, u'closure': closure}
+                              for d, person, closure in schedule.get_forecast(self.forecast_days)],
+            }
+        return teams
+
+    def get_days_off(self):
+        days_off = {}
+        for team in self.bot.teams:
+            parser = team.days_off_parser
+            days_off[team.section] = dict((name, [format_date(d) for d in parser.get_my_days_off(name) or []])
+                                          for name in team.members)
+        return days_off
+
+    def get_health(self):
+        stats = self.bot.get_stats()
+        health = {u'time': time.time(),
+                  u'startup': stats[u'startup'],
+                  u'connection': stats.get(u'connection'),
+                  u'loop_lag': stats.get(u'loop_lag'),
+                  u'leader': stats.get(u'leader'),
+                  u'user_db': self.bot.hipchat_db.get_stats(),
+                  u'teams_ready': dict((team.section, team.is_ready) for team in self.bot.teams),
+                  }
+        if health[u'loop_lag'] is not None:
+            # the call sites are for the log, not for dashboards
+            health[u'loop_lag'] = dict((k, v) for k, v in health[u'loop_lag'].items() if k != u'recent_slow_calls')
+        return health
@@ -0,0 +1,93 @@
+import codecs
+import logging
+import os
+
+from twisted.internet import defer, reactor as default_reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class FileStorage(object):
+    """
+    Writes files in a thread pool so that slow disks don't block the reactor.
+    Writes to the same file are done in the order they are requested.
+    """
+
+    def __init__(self, max_threads=2, thread_pool=None, reactor=default_reactor):
+        """
+        :param max_threads: The maximum number of threads.
+        :param thread_pool: (optional) The thread pool, a new one is made by default.
+        :param reactor: The reactor the results are delivered in.
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._reactor = reactor
+        if thread_pool is None:
+            thread_pool = ThreadPool(minthreads=1, maxthreads=max_threads, name=self.__class__.__name__)
+        self._thread_pool = thread_pool
+        self._lock_dict = {}
+
+    def start(self):
+        self._thread_pool.start()
+        self._reactor.addSystemEventTrigger(u'during', u'shutdown', self._thread_pool.stop)
+
+    def write(self, file_path, data):
+        """
+        Writes the given data to the given file with utf-8 encoding.
+        :param file_path: The file path.
+        :param data: The unicode string to write.
+        :return: A Deferred that fires with the file path once the data is written.
+        """
+        lock = self._lock_dict.get(file_path)
+        if lock is None:
+            lock = self._lock_dict[file_path] = defer.DeferredLock()
+        d = lock.run(threads.deferToThreadPool, self._reactor, self._thread_pool, write_file_utf8, file_path, data)
+        d.addErrback(self._on_write_failure, file_path)
+        return d
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs a function in the thread pool, e.g. to load a file.
+        :param func: The function.
+        :return: A Deferred that fires with the result of the function.
+        """
+        return threads.deferToThreadPool(self._reactor, self._thread_pool, func, *args, **kwargs)
+
+    def _on_write_failure(self, failure, file_path):
+        self._logger.error(u"failed to write %s: %s", file_path, failure.getErrorMessage())
+        return failure
+
+
+def write_file_utf8(file_path, data):
+    """
+    Writes the given data to a temporary file and then replaces the given file with it,
+    so that the file is never partially written. The data is flushed to disk before the
+    replace, and the directory entry after it.
+    :param file_path: The file path.
+    :param data: The unicode string to write.
+    :return: The file path.
+    """
+    temp_file_path = file_path + u'.tmp'
+    with codecs.open(temp_file_path, 'w', 'utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temp_file_path, file_path)
+    fsync_dir(os.path.dirname(os.path.abspath(file_path)))
+    return file_path
+
+
+def fsync_dir(dir_path):
+    """
+    Flushes a directory to disk, so that a rename in it survives a crash.
+    :param dir_path: The directory path.
+    """
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        # not supported on this platform
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
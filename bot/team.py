@@ -0,0 +1,148 @@
+import logging
+
+from .schedule import Schedule
+from .state_store import load_legacy_cache
+from .util.closure_calendar import load_closure_index
+from .util.daysoff_parser import DaysOffParser
+
+
+class Team(object):
+    """
+    A team configured in a config section. Each team has its own room, schedule and days-off list,
+    and shares the XMPP client, the user database and the API client with the other teams.
+    """
+
+    def __init__(self, bot, section):
+        self._logger = logging.getLogger(u'%s[%s]' % (self.__class__.__name__, section))
+        self.bot = bot
+        self.section = section
+
+        self.days_off_file = self.settings.daysoff_file
+        self.days_off_parser = DaysOffParser(self.days_off_file)
+
+        # the runtime state of the team in the state store
+        self.state = None
+
+        self.schedule = None
+        self.mucbot = None
+
+    @property
+    def settings(self):
+        # always the latest settings, they are replaced as a whole when the config changes
+        return self.bot.settings.get_team(self.section)
+
+    @property
+    def members(self):
+        return self.settings.members
+
+    @property
+    def room_name(self):
+        return self.settings.room_name
+
+    @property
+    def room_jid(self):
+        return self.settings.room_jid
+
+    @property
+    def ready_phases(self):
+        # the start-up phases the schedule and the commands of this team need
+        return [u'config', u'days_off[%s]' % self.section]
+
+    @property
+    def is_ready(self):
+        return self.bot.startup.is_ready(*self.ready_phases)
+
+    def when_ready(self):
+        return self.bot.startup.when_ready(*self.ready_phases)
+
+    def initialize(self):
+        state_store = self.bot.state_store
+        if not state_store.has_team_state(self.section):
+            # migrate the old cache file
+            cache_file = self.settings.cache_file
+            team_state = load_legacy_cache(cache_file, self.members)
+            if team_state is not None:
+                self._logger.info(u"migrating %s to the state file", cache_file)
+                state_store.set_team_state(self.section, team_state)
+        self.state = state_store.get_team_state(self.section)
+
+        self.schedule = Schedule(self.bot, self)
+        self.bot.config_events.subscribe(self.section, self._on_closure_config_changed,
+                                         [u'closure_calendars', u'member_regions'])
+
+    def start(self):
+        """
+        Loads the days-off list in the storage thread pool, and starts the schedule when the team is ready.
+        :return: A Deferred that fires when the days-off list is loaded.
+        """
+        d = self.bot.startup.run(u'days_off[%s]' % self.section, self._load_files)
+        self.when_ready().addCallback(self._start_schedule)
+        return d
+
+    def _load_files(self):
+        settings = self.settings
+
+        # a standby must not write the files of the leader
+        save = self.bot.is_leader
+
+        def load():
+            # runs in the storage thread pool
+            self.days_off_parser.load(save=save)
+            return load_closure_index(settings.closure_calendars, settings.member_regions)
+
+        return self.bot.storage.run(load).addCallback(self._set_closure_index)
+
+    def _set_closure_index(self, closure_index):
+        self.schedule.set_closure_index(closure_index)
+        self.bot.status_cache.invalidate(u'days_off', u'teams')
+
+    def _on_closure_config_changed(self, options):
+        settings = self.settings
+        d = self.bot.storage.run(load_closure_index, settings.closure_calendars, settings.member_regions)
+        d.addCallbacks(self._set_closure_index, self._on_closure_load_failure)
+
+    def _on_closure_load_failure(self, failure):
+        self._logger.error(u"failed to load the closure calendars, keep the current ones: %s",
+                           failure.getErrorMessage())
+
+    def reload_state(self):
+        """
+        Takes the team state from the state store again, after the state file has been reloaded.
+        """
+        self.state = self.bot.state_store.get_team_state(self.section)
+        self.schedule.reload_state()
+        if self.mucbot is not None and self.mucbot.replayer is not None:
+            self.mucbot.replayer.reload_state()
+
+    def take_over(self):
+        """
+        Starts acting as the leader: catches up the rotations and replays the commands missed since
+        the previous leader stopped. The state and the days-off list must have been reloaded.
+        """
+        if not self.is_ready:
+            # the schedule catches up when the team is ready
+            return
+        self.bot.status_cache.invalidate(u'days_off', u'teams')
+        self.schedule.catch_up()
+        if self.mucbot is not None and self.mucbot.replayer is not None and self.mucbot.connected:
+            self.mucbot.replayer.replay()
+
+    def _start_schedule(self, _):
+        self._logger.info(u"starting schedule...")
+        self.schedule.start()
+
+    def save_days_off(self):
+        """
+        Saves the days-off file in the storage thread pool.
+        :return: A Deferred that fires when the file is written.
+        """
+        # the forecast depends on the days off
+        self.bot.status_cache.invalidate(u'days_off', u'teams')
+        return self.bot.storage.write(self.days_off_file, self.days_off_parser.dumps())
+
+    def save_state(self):
+        """
+        Saves the state store, which includes the state of this team.
+        :return: A Deferred that fires when the file is written.
+        """
+        return self.bot.state_store.save()
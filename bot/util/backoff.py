@@ -0,0 +1,26 @@
+import random
+
+
+class ExponentialBackoff(object):
+    """
+    Exponential backoff delays with jitter.
+    """
+
+    def __init__(self, initial_delay=1.0, max_delay=300.0, factor=2.0, jitter=0.1):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        Gets the delay before the next attempt.
+        :return: The delay in seconds.
+        """
+        delay = min(self.initial_delay * (self.factor ** self.attempts), self.max_delay)
+        self.attempts += 1
+        return delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+    def reset(self):
+        self.attempts = 0
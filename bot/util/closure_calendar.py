@@ -0,0 +1,260 @@
+import codecs
+import csv
+import datetime
+import logging
+import os
+import re
+
+from dateutil.rrule import rrulestr
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# an UNTIL in UTC, e.g. UNTIL=20301225T000000Z
+RE_UTC_UNTIL = re.compile(u'(UNTIL=[0-9]{8}(T[0-9]{6})?)Z', re.IGNORECASE)
+
+
+def parse_ics_date(value):
+    """
+    Parses an iCalendar DATE or DATE-TIME value, only the date part is used.
+    :param value: The value string, e.g. 20161225 or 20161225T090000Z.
+    :return: The date.
+    """
+    value = value.strip()
+    return datetime.date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+
+def unfold_ics_lines(text):
+    """
+    Unfolds the content lines of an iCalendar file, a line starting with a space or a tab continues the previous one.
+    :param text: The file content.
+    :return: A list of content lines.
+    """
+    lines = []
+    for line in text.splitlines():
+        if line[:1] in (u' ', u'\t') and lines:
+            lines[-1] += line[1:]
+        elif line.strip():
+            lines.append(line)
+    return lines
+
+
+class ClosureEvent(object):
+    """
+    A closure of one or more days, which may recur.
+    """
+    __slots__ = ('summary', 'start', 'days', 'rrule', 'exdates', '_rule')
+
+    def __init__(self, summary, start, days=1, rrule=None, exdates=()):
+        self.summary = summary
+        self.start = start
+        self.days = max(days, 1)
+        self.rrule = rrule
+        self.exdates = frozenset(exdates)
+        self._rule = parse_rrule(rrule, start) if rrule is not None else None
+
+    def get_dates(self, year=None):
+        """
+        Gets the closed dates of this event.
+        :param year: The year to expand the recurrence rule for, required for recurring events.
+        :return: A list of dates.
+        """
+        if self._rule is None:
+            starts = [self.start]
+        else:
+            # a closure that starts in December may continue in the next year
+            starts = [d.date() for d in self._rule.between(datetime.datetime(year - 1, 12, 1),
+                                                           datetime.datetime(year, 12, 31, 23, 59, 59), inc=True)]
+        dates = []
+        for start in starts:
+            if start in self.exdates:
+                continue
+            dates.extend(start + i * ONE_DAY for i in xrange(self.days))
+        return dates
+
+
+def parse_rrule(rrule, start):
+    """
+    Parses a recurrence rule. The times are ignored, so an UNTIL in UTC is used as a date in local time.
+    :param rrule: The RRULE value, e.g. FREQ=YEARLY;UNTIL=20301225T000000Z.
+    :param start: The date of the first occurrence.
+    :return: The dateutil rule set.
+    """
+    dtstart = datetime.datetime.combine(start, datetime.time())
+    try:
+        rule = rrulestr(RE_UTC_UNTIL.sub(u'\\1', rrule), dtstart=dtstart, forceset=True)
+        # the occurrences are generated lazily, so check the rule once now
+        rule.after(dtstart, inc=True)
+    except (ValueError, TypeError) as e:
+        raise RuntimeError(u"invalid RRULE '%s' in closure calendar: %s" % (rrule, e))
+    return rule
+
+
+class ClosureCalendar(object):
+    """
+    The closure days loaded from .ics or .csv files. The single dates are indexed when loaded,
+    the recurring events are expanded one year at a time when a date of that year is checked.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._date_dict = {}
+        self._recurring_events = []
+        # year -> {date: summary} of the expanded recurring events
+        self._year_cache = {}
+
+    def __len__(self):
+        return len(self._date_dict) + len(self._recurring_events)
+
+    def add_event(self, event):
+        if event.rrule is not None:
+            self._recurring_events.append(event)
+            self._year_cache.clear()
+            return
+        for d in event.get_dates():
+            self._date_dict.setdefault(d, event.summary)
+
+    def load(self, file_name):
+        """
+        Loads the closures from a file, the format is chosen by the extension (.ics or .csv).
+        :param file_name: The file name.
+        """
+        if not os.path.exists(file_name):
+            raise RuntimeError(u"closure calendar %s doesn't exist." % file_name)
+        self._logger.debug(u"loading closure calendar %s", file_name)
+        if file_name.lower().endswith(u'.csv'):
+            with open(file_name, 'rb') as f:
+                events = parse_csv(f)
+        else:
+            with codecs.open(file_name, 'r', 'utf-8') as f:
+                events = parse_ics(f.read())
+        for event in events:
+            self.add_event(event)
+
+    def get_closure(self, date):
+        """
+        Checks if the given date is a closure day.
+        :param date: The date.
+        :return: The summary of the closure, or None if it's not closed.
+        """
+        summary = self._date_dict.get(date)
+        if summary is not None or not self._recurring_events:
+            return summary
+        year_dict = self._year_cache.get(date.year)
+        if year_dict is None:
+            year_dict = self._year_cache[date.year] = self._expand_year(date.year)
+        return year_dict.get(date)
+
+    def _expand_year(self, year):
+        year_dict = {}
+        for event in self._recurring_events:
+            for d in event.get_dates(year):
+                year_dict.setdefault(d, event.summary)
+        return year_dict
+
+
+def parse_ics(text):
+    """
+    Parses the VEVENTs of an iCalendar file. DTSTART, DTEND, RRULE, EXDATE and SUMMARY are used,
+    the times are ignored, so an event closes the whole days it covers.
+    :param text: The file content.
+    :return: A list of ClosureEvents.
+    """
+    events = []
+    props = None
+    for line in unfold_ics_lines(text):
+        name_part, _, value = line.partition(u':')
+        name = name_part.split(u';', 1)[0].strip().upper()
+        if name == u'BEGIN' and value.strip().upper() == u'VEVENT':
+            props = {u'EXDATE': []}
+        elif name == u'END' and value.strip().upper() == u'VEVENT':
+            if props is not None and u'DTSTART' in props:
+                events.append(_make_ics_event(props))
+            props = None
+        elif props is not None:
+            if name == u'EXDATE':
+                props[u'EXDATE'].extend(parse_ics_date(v) for v in value.split(u',') if v.strip())
+            else:
+                props[name] = value.strip()
+    return events
+
+
+def _make_ics_event(props):
+    start = parse_ics_date(props[u'DTSTART'])
+    # DTEND is exclusive
+    end = parse_ics_date(props[u'DTEND']) if u'DTEND' in props else start + ONE_DAY
+    return ClosureEvent(props.get(u'SUMMARY', u'closed').replace(u'\\,', u','),
+                        start,
+                        (end - start).days,
+                        props.get(u'RRULE'),
+                        props[u'EXDATE'])
+
+
+def parse_csv(f):
+    """
+    Parses a CSV file with the columns date (YYYY-MM-DD) and an optional summary.
+    Empty lines, comment lines starting with # and a header line are skipped.
+    :param f: The file opened in binary mode.
+    :return: A list of ClosureEvents.
+    """
+    events = []
+    for row in csv.reader(f):
+        row = [cell.decode('utf-8').strip() for cell in row]
+        if not row or not row[0] or row[0].startswith(u'#') or row[0].lower() == u'date':
+            continue
+        try:
+            date = datetime.datetime.strptime(row[0], u'%Y-%m-%d').date()
+        except ValueError:
+            raise RuntimeError(u"invalid date in closure calendar: %s" % row[0])
+        summary = row[1] if len(row) > 1 and row[1] else u'closed'
+        events.append(ClosureEvent(summary, date))
+    return events
+
+
+class ClosureIndex(object):
+    """
+    The closure days of a team: the team-wide calendar closes the whole team, and a region calendar
+    only makes the members in that region unavailable.
+    """
+
+    def __init__(self, team_calendar=None, region_calendars=None, member_regions=None):
+        self.team_calendar = team_calendar if team_calendar is not None else ClosureCalendar()
+        self.region_calendars = region_calendars or {}
+        self.member_regions = member_regions or {}
+
+    def get_team_closure(self, date):
+        """
+        Checks if the whole team is closed on the given date.
+        :param date: The date.
+        :return: The summary of the closure, or None.
+        """
+        return self.team_calendar.get_closure(date)
+
+    def get_member_closure(self, name, date):
+        """
+        Checks if a member is off because of a team-wide or a regional closure.
+        :param name: The member's name.
+        :param date: The date.
+        :return: The summary of the closure, or None.
+        """
+        summary = self.team_calendar.get_closure(date)
+        if summary is not None:
+            return summary
+        calendar = self.region_calendars.get(self.member_regions.get(name))
+        return calendar.get_closure(date) if calendar is not None else None
+
+
+def load_closure_index(closure_calendars, member_regions):
+    """
+    Loads the closure calendars of a team.
+    :param closure_calendars: A list of (region, file name) tuples, the region is None for team-wide calendars.
+    :param member_regions: A list of (member name, region) tuples.
+    :return: The ClosureIndex.
+    """
+    team_calendar = ClosureCalendar()
+    region_calendars = {}
+    for region, file_name in closure_calendars:
+        if region is None:
+            team_calendar.load(file_name)
+        else:
+            region_calendars.setdefault(region, ClosureCalendar()).load(file_name)
+    return ClosureIndex(team_calendar, region_calendars, dict(member_regions))
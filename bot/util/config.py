@@ -2,6 +2,7 @@
 Configuration related code.
 """
 from ConfigParser import ConfigParser
+from StringIO import StringIO
 import codecs
 import os
 
@@ -15,6 +16,38 @@ DEFAULT_DICT = {u'HCBOT_HIPCHAT_JID': u'',
                 u'HCBOT_HIPCHAT_NICKNAME':     u'',
                 u'HCBOT_HIPCHAT_STFU_MINUTES': u'0',
                 u'HCBOT_HIPCHAT_DB':           u'hipchat_db',
+                u'HCBOT_HIPCHAT_DB_RESYNC_HOURS': u'120',
+                u'HCBOT_HIPCHAT_STATE_FILE':     u'state.json',
+                u'HCBOT_HIPCHAT_SEND_INTERVAL':     u'1.0',
+                u'HCBOT_HIPCHAT_SEND_MERGE_WINDOW': u'0.5',
+                u'HCBOT_HIPCHAT_SEND_QUEUE_SIZE':   u'100',
+                u'HCBOT_HIPCHAT_TEAMS':             u'team',
+                u'HCBOT_HIPCHAT_RECONNECT_INITIAL_DELAY': u'1.0',
+                u'HCBOT_HIPCHAT_RECONNECT_MAX_DELAY':     u'300',
+                u'HCBOT_HIPCHAT_REPLAY_MAX_MESSAGES':     u'200',
+                u'HCBOT_HIPCHAT_CONFIG_WATCH_INTERVAL':   u'5',
+                u'HCBOT_HIPCHAT_ADMINS':                  u'',
+
+                u'HCBOT_LOG_LEVEL':               u'INFO',
+                u'HCBOT_LOG_LOGGER_LEVELS':       u'',
+                u'HCBOT_LOG_TRAFFIC_SAMPLE_RATE': u'0.0',
+
+                u'HCBOT_MONITOR_LOOP_INTERVAL':  u'0.5',
+                u'HCBOT_MONITOR_SLOW_THRESHOLD': u'0.25',
+
+                u'HCBOT_STATUS_PORT':          u'0',
+                u'HCBOT_STATUS_INTERFACE':     u'127.0.0.1',
+                u'HCBOT_STATUS_FORECAST_DAYS': u'14',
+
+                u'HCBOT_PROFILE_ENABLED':    u'false',
+                u'HCBOT_PROFILE_OUTPUT_DIR': u'profiles',
+                u'HCBOT_PROFILE_TOP_N':      u'30',
+
+                u'HCBOT_HA_ENABLED':            u'false',
+                u'HCBOT_HA_LOCK_FILE':          u'leader.lock',
+                u'HCBOT_HA_LEASE':              u'15',
+                u'HCBOT_HA_HEARTBEAT_INTERVAL': u'5',
+                u'HCBOT_HA_INSTANCE_ID':        u'',
 
                 u'HCBOT_TEAM_MEMBERS':           u'',
                 u'HCBOT_TEAM_DAYSOFF_FILE':      u'daysoff.txt',
@@ -22,8 +55,20 @@ DEFAULT_DICT = {u'HCBOT_HIPCHAT_JID': u'',
                 u'HCBOT_TEAM_ROOM_NAME':         u'',
                 u'HCBOT_TEAM_TOPIC_UPDATE_TIME': u'0 9 * * MON-FRI *',
                 u'HCBOT_TEAM_TOPIC_TEMPLATE':    u'Current person on-duty: <name>',
+                u'HCBOT_TEAM_COMMAND_PLUGINS':   u'',
+                u'HCBOT_TEAM_CMD_RATE_PER_USER':     u'10',
+                u'HCBOT_TEAM_CMD_BURST_PER_USER':    u'5',
+                u'HCBOT_TEAM_CMD_RATE_PER_COMMAND':  u'20',
+                u'HCBOT_TEAM_CMD_BURST_PER_COMMAND': u'10',
+                u'HCBOT_TEAM_QUESTION_INTERVAL':     u'10',
+                u'HCBOT_TEAM_ROOM_JID':              u'',
+                u'HCBOT_TEAM_CLOSURE_CALENDARS':     u'',
+                u'HCBOT_TEAM_MEMBER_REGIONS':        u'',
                 }
 
+# the options of team sections whose default values are prefixed with the section name
+TEAM_FILE_OPTIONS = [u'daysoff_file', u'cache_file']
+
 
 def set_default_config(config, set_all=False):
     """
@@ -95,9 +140,64 @@ def init_config(config_file):
 
     # override the config file values with environment variables (if present)
     override_config_with_env(config_parser)
+
+    # set the missing settings of the other team sections
+    for section in get_team_sections(config_parser):
+        set_team_default_config(config_parser, section)
     return config_parser
 
 
+def get_team_sections(config):
+    """
+    Gets the config sections of all teams.
+    :param config: The given config parser.
+    :return: A list of section names.
+    """
+    return [s.strip() for s in config.get(u'hipchat', u'teams').split(u',') if s.strip()]
+
+
+def set_team_default_config(config, section):
+    """
+    Sets the missing settings of a team section to the defaults. The default file names
+    of the teams other than [team] are prefixed with the section name, so they don't share files.
+    :param config: The given config parser.
+    :param section: The team section.
+    """
+    if not config.has_section(section):
+        config.add_section(section)
+    for env_name, value in DEFAULT_DICT.iteritems():
+        default_section, option = get_config_name_from_env_name(env_name)
+        if default_section != u'team' or config.has_option(section, option):
+            continue
+        if section != u'team' and option in TEAM_FILE_OPTIONS:
+            value = u'%s-%s' % (section, value)
+        config.set(section, option, value)
+
+
+def copy_config(config):
+    """
+    Copies a config parser.
+    :param config: The given config parser.
+    :return: A new config parser with the same sections and values.
+    """
+    new_config = ConfigParser()
+    for section in config.sections():
+        new_config.add_section(section)
+        for option, value in config.items(section, raw=True):
+            new_config.set(section, option, value)
+    return new_config
+
+
+def get_team_members(config, section):
+    """
+    Gets the list of team members of a team.
+    :param config: The given config parser.
+    :param section: The team section.
+    :return: A list of member names in the configured order.
+    """
+    return [n.strip() for n in config.get(section, u'members').split(u',') if n.strip()]
+
+
 def read_config_file_utf8(config, file_path):
     """
     Reads a config file with utf-8 encoding.
@@ -116,3 +216,14 @@ def write_config_file_utf8(config, file_path):
     """
     with codecs.open(file_path, 'w', 'utf-8') as f:
         config.write(f)
+
+
+def config_to_string(config):
+    """
+    Serializes a config parser in the config file format.
+    :param config: The config parser.
+    :return: The serialized unicode string.
+    """
+    buf = StringIO()
+    config.write(buf)
+    return buf.getvalue()
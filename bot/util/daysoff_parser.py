@@ -1,15 +1,107 @@
+import bisect
 import codecs
 import datetime
 import logging
 import os
 import re
 import time
+from array import array
+
+from .names import intern_name
 
 WEEKDAYS = [u"MON", u"TUE", u"WED", u"THU", u"FRI"]
 
 RE_DATE = re.compile("^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1])$")
 
 
+class DaysOffRecord(object):
+    """
+    The days off of one person: the regular days off as a bitmask of WEEKDAYS, and the single dates
+    as sorted date ordinals in an array.
+    """
+    __slots__ = ('weekday_mask', 'ordinals')
+
+    def __init__(self):
+        self.weekday_mask = 0
+        self.ordinals = array('i')
+
+    def __len__(self):
+        return bin(self.weekday_mask).count(u'1') + len(self.ordinals)
+
+    def add(self, day):
+        """
+        Adds a day off.
+        :param day: A date or a weekday string as returned by sanitize_dates().
+        :return: True if it's added, False if it was already there.
+        """
+        if isinstance(day, basestring):
+            bit = 1 << WEEKDAYS.index(day[:3])
+            if self.weekday_mask & bit:
+                return False
+            self.weekday_mask |= bit
+            return True
+
+        ordinal = day.toordinal()
+        idx = bisect.bisect_left(self.ordinals, ordinal)
+        if idx < len(self.ordinals) and self.ordinals[idx] == ordinal:
+            return False
+        self.ordinals.insert(idx, ordinal)
+        return True
+
+    def remove(self, day):
+        """
+        Removes a day off.
+        :param day: A date or a weekday string as returned by sanitize_dates().
+        :return: True if it's removed, False if it wasn't there.
+        """
+        if isinstance(day, basestring):
+            bit = 1 << WEEKDAYS.index(day[:3])
+            if not self.weekday_mask & bit:
+                return False
+            self.weekday_mask &= ~bit
+            return True
+
+        ordinal = day.toordinal()
+        idx = bisect.bisect_left(self.ordinals, ordinal)
+        if idx == len(self.ordinals) or self.ordinals[idx] != ordinal:
+            return False
+        del self.ordinals[idx]
+        return True
+
+    def remove_before(self, ordinal):
+        """
+        Removes the dates before the given date ordinal.
+        """
+        idx = bisect.bisect_left(self.ordinals, ordinal)
+        if idx > 0:
+            del self.ordinals[:idx]
+
+    def is_off(self, date, first_ordinal):
+        """
+        Checks if the given date is a day off.
+        :param date: The date.
+        :param first_ordinal: The ordinal of the first date that counts, the dates before it are expired.
+        """
+        weekday = date.weekday()
+        if weekday < len(WEEKDAYS) and self.weekday_mask & (1 << weekday):
+            return True
+        ordinal = date.toordinal()
+        if ordinal < first_ordinal:
+            return False
+        idx = bisect.bisect_left(self.ordinals, ordinal)
+        return idx < len(self.ordinals) and self.ordinals[idx] == ordinal
+
+    def to_list(self, first_ordinal=0):
+        """
+        Gets the days off as a list of the weekday strings followed by the dates.
+        :param first_ordinal: The ordinal of the first date to include, the dates before it are expired.
+        """
+        days = [weekday for i, weekday in enumerate(WEEKDAYS) if self.weekday_mask & (1 << i)]
+        idx = bisect.bisect_left(self.ordinals, first_ordinal)
+        days.extend(datetime.date.fromordinal(ordinal) for ordinal in self.ordinals[idx:])
+        return days
+
+
 class DaysOffParser(object):
     """
     This parser manages a list of people and their days-off lists.
@@ -18,12 +110,14 @@ class DaysOffParser(object):
     def __init__(self, file_name=None):
         self._logger = logging.getLogger(self.__class__.__name__)
         self._file_name = file_name
+        # name -> DaysOffRecord
         self._data_dict = {}
 
-    def load(self, file_name=None):
+    def load(self, file_name=None, save=True):
         """
         Loads the people availability list from the given file.
         :param file_name: The file name.
+        :param save: If True, the list is written back to the file.
         """
         file_name = file_name if file_name is not None else self._file_name
 
@@ -39,61 +133,66 @@ class DaysOffParser(object):
         for l in lines:
             if l.startswith(u'[') and l.endswith(u']'):
                 if person_name is not None:
-                    data_dict[person_name] = sanitize_dates(date_string_list)[0]
-                person_name = l.strip(u'[]')
+                    data_dict[person_name] = make_record(date_string_list)
+                person_name = intern_name(l.strip(u'[]'))
                 date_string_list = []
             elif l.startswith(u'#') or len(l) == 0:
                 continue
             else:
                 date_string_list.append(l)
         if person_name is not None:
-            data_dict[person_name] = sanitize_dates(date_string_list)[0]
+            data_dict[person_name] = make_record(date_string_list)
 
         self._data_dict = data_dict
-        self.save(file_name)
+        if save:
+            self.save(file_name)
 
     def save(self, file_name=None):
         """
         Saves the people availability list to the given file.
         :param file_name: The file name.
         """
-        self._automatic_clean()
-
         file_name = file_name if file_name is not None else self._file_name
         if file_name is None:
+            self._automatic_clean()
             return
 
-        # sort the people list
-        people_list = [{u'name': name, u'date_list': date_list} for name, date_list in self._data_dict.iteritems()]
-        people_list = sorted(people_list, key=lambda p: p[u'name'])
-
+        data = self.dumps()
         self._logger.debug(u"saving people availability list to %s", file_name)
+        with codecs.open(file_name, 'w', 'utf-8') as f:
+            f.write(data)
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    def dumps(self):
+        """
+        Serializes the people availability list in the days-off file format.
+        The past dates are cleaned up before serialization.
+        :return: The serialized string.
+        """
+        self._automatic_clean()
+
         lines = []
-        for person in people_list:
-            lines.append(u"[%s]" % person[u'name'])
-            for d in person[u'date_list']:
+        for name in sorted(self._data_dict):
+            lines.append(u"[%s]" % name)
+            for d in self._data_dict[name].to_list():
                 if isinstance(d, basestring):
-                    lines.append(d.upper())
+                    lines.append(d)
                 else:
                     lines.append(d.strftime(u"%Y-%m-%d"))
             lines.append(u"")
 
-        lines = [l + os.linesep for l in lines]
-        with codecs.open(file_name, 'w', 'utf-8') as f:
-            f.writelines(lines)
+        return u"".join(l + os.linesep for l in lines)
 
     def _automatic_clean(self):
         """
         Automatically cleans up the past dates.
         """
-        current_date = datetime.date.fromtimestamp(time.time())
-        for name, date_list in self._data_dict.iteritems():
-            new_list = []
-            for d in date_list:
-                if isinstance(d, datetime.date) and d < current_date:
-                    continue
-                new_list.append(d)
-            self._data_dict[name] = new_list
+        current_ordinal = get_today_ordinal()
+        for record in self._data_dict.itervalues():
+            record.remove_before(current_ordinal)
 
     def add(self, name, date_string_list):
         """
@@ -102,21 +201,21 @@ class DaysOffParser(object):
         :param date_string_list: The not-available date strings to add.
         :return: True or False indicating if there is any change being made.
         """
-        new_person = name not in self._data_dict
-        has_change = False
-
-        person_date_list = self._data_dict.get(name, [])
+        record = self._data_dict.get(name)
+        new_person = record is None
+        if new_person:
+            record = DaysOffRecord()
 
         # add dates
+        has_change = False
         valid_date_list, _ = sanitize_dates(date_string_list)
         for nd in valid_date_list:
-            if nd not in person_date_list:
-                person_date_list.append(nd)
+            if record.add(nd):
                 has_change = True
 
         # add to list if it's a new person and there is any valid change
         if new_person and has_change:
-            self._data_dict[name] = person_date_list
+            self._data_dict[intern_name(name)] = record
 
         return has_change
 
@@ -127,19 +226,18 @@ class DaysOffParser(object):
         :param date_string_list: The not-available dates to remove.
         :return: True or False indicating if there is any change being made.
         """
-        if name not in self._data_dict:
+        record = self._data_dict.get(name)
+        if record is None:
             return False
-        person_data_list = self._data_dict[name]
 
         # remove
         has_change = False
         valid_data_list, _ = sanitize_dates(date_string_list)
         for nd in valid_data_list:
-            if nd in person_data_list:
-                person_data_list.remove(nd)
+            if record.remove(nd):
                 has_change = True
                 # remove this person if the date list becomes empty
-                if not person_data_list:
+                if not record:
                     del self._data_dict[name]
                     break
 
@@ -149,9 +247,11 @@ class DaysOffParser(object):
         """
         Gets the given person's days-off list.
         :param name: The given person's name.
-        :return: The list if the person exists, otherwise None.
+        :return: A list of the weekday strings followed by the dates if the person exists, otherwise None.
         """
-        return self._data_dict.get(name)
+        record = self._data_dict.get(name)
+        # the past dates are only cleaned up when the list is saved
+        return record.to_list(get_today_ordinal()) if record is not None else None
 
     def check_availability(self, name, date):
         """
@@ -160,24 +260,25 @@ class DaysOffParser(object):
         :param date: The given date string.
         :return: True or False.
         """
-        # saving does the automatic cleanup
-        self.save()
-
-        if name not in self._data_dict:
+        record = self._data_dict.get(name)
+        if record is None:
             return True
+        # the past dates don't count, as if they were cleaned up
+        return not record.is_off(date, get_today_ordinal())
 
-        is_available = True
-        for d in self._data_dict[name]:
-            # convert weekday to date
-            if isinstance(d, basestring):
-                is_available = WEEKDAYS.index(d) != date.weekday()
-                if not is_available:
-                    break
-            elif date == d:
-                is_available = False
-                break
 
-        return is_available
+def get_today_ordinal():
+    return datetime.date.fromtimestamp(time.time()).toordinal()
+
+
+def make_record(date_string_list):
+    """
+    Makes the DaysOffRecord of the given date strings, the invalid ones are ignored.
+    """
+    record = DaysOffRecord()
+    for d in sanitize_dates(date_string_list)[0]:
+        record.add(d)
+    return record
 
 
 def sanitize_dates(date_string_list):
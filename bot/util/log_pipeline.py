@@ -0,0 +1,178 @@
+"""
+Asynchronous logging. The calling thread (normally the reactor thread) merges the message with its
+arguments and puts the record into a queue, a background thread formats and writes it.
+"""
+from Queue import Full, Queue
+import atexit
+import logging
+import re
+import sys
+import threading
+
+LOG_FORMAT = u'%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# query parameters and headers that carry secrets
+RE_SECRETS = re.compile(r'(auth_token=|Bearer\s+)[^&\s\'"]+')
+REDACTED = u'<redacted>'
+
+
+def redact(text):
+    """
+    Removes the auth tokens from the given text.
+    :param text: The text.
+    :return: The text with the tokens replaced.
+    """
+    return RE_SECRETS.sub(lambda m: m.group(1) + REDACTED, text)
+
+
+class RedactingFilter(logging.Filter):
+    """
+    Removes the auth tokens from log messages.
+    """
+
+    def filter(self, record):
+        msg = record.getMessage()
+        redacted_msg = redact(msg)
+        if redacted_msg != msg:
+            record.msg = redacted_msg
+            record.args = None
+        return True
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts log records into a queue. Records are dropped if the queue is full.
+    As with the standard library's QueueHandler, the message and the exception are rendered
+    on the calling thread, so the background thread doesn't read arguments that may have changed.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped_count = 0
+
+    def prepare(self, record):
+        """
+        Renders the message and the exception of a record and drops the arguments and the traceback.
+        :param record: The log record.
+        :return: The record to put into the queue.
+        """
+        msg = self.format(record)
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        # the traceback is in the message, it must not be added again by the listener's formatter
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            self.dropped_count += 1
+        except Exception:
+            self.handleError(record)
+
+    def handleError(self, record):
+        # never write to stderr on the calling thread
+        self.dropped_count += 1
+
+
+class QueueListener(object):
+    """
+    Takes log records from a queue and passes them to the handlers on a background thread.
+    """
+
+    _sentinel = None
+
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name=u'LogQueueListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Writes the remaining records and stops the background thread.
+        """
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get(True)
+            if record is self._sentinel:
+                break
+            self.handle(record)
+
+
+def start_logging(level=logging.INFO, queue_size=10000, stream=None):
+    """
+    Sets up the root logger to log asynchronously to the given stream.
+    :param level: The root log level.
+    :param queue_size: The maximum number of pending records.
+    :param stream: The output stream, stderr by default.
+    :return: The QueueListener, which is stopped when the process exits.
+    """
+    stream_handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    # redacting is done on the logging thread together with formatting
+    stream_handler.addFilter(RedactingFilter())
+
+    queue = Queue(queue_size)
+    listener = QueueListener(queue, [stream_handler])
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(queue))
+    root_logger.setLevel(level)
+    return listener
+
+
+def parse_log_levels(levels_str):
+    """
+    Parses the per-logger levels.
+    :param levels_str: A comma-separated string of <logger name>:<level>, e.g., u'HipChatApi:WARNING'.
+    :return: A list of (logger name, level) tuples.
+    """
+    levels = []
+    for item in levels_str.split(u','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, level_name = item.rpartition(u':')
+        level = logging.getLevelName(level_name.strip().upper())
+        if not sep or not name.strip() or not isinstance(level, int):
+            raise RuntimeError(u"invalid log level setting: %s" % item)
+        levels.append((name.strip(), level))
+    return levels
+
+
+def apply_log_config(config):
+    """
+    Applies the log levels in the config.
+    :param config: The config parser.
+    """
+    level = logging.getLevelName(config.get(u'log', u'level').strip().upper())
+    if not isinstance(level, int):
+        raise RuntimeError(u"invalid log level: %s" % config.get(u'log', u'level'))
+    logging.getLogger().setLevel(level)
+
+    for name, level in parse_log_levels(config.get(u'log', u'logger_levels')):
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,144 @@
+class _TrieNode(object):
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        self.children = {}
+        # member name -> number of indexed keys of that member passing through this node
+        self.names = {}
+
+
+class MemberNameIndex(object):
+    """
+    A prefix trie over team member names and their mention names.
+    It resolves (abbreviated, non-case-sensitive) person arguments to team members.
+    """
+
+    def __init__(self, member_list=None):
+        self._root = _TrieNode()
+        # member name -> {key: count} of the keys indexed for that member
+        self._member_keys = {}
+        self._mention_names = {}
+
+        for name in member_list or []:
+            self.add_member(name)
+
+    @property
+    def members(self):
+        return sorted(self._member_keys)
+
+    def has_member(self, name):
+        return name in self._member_keys
+
+    def get_mention_name(self, name):
+        return self._mention_names.get(name)
+
+    def _insert(self, key, name):
+        keys = self._member_keys[name]
+        keys[key] = keys.get(key, 0) + 1
+
+        node = self._root
+        node.names[name] = node.names.get(name, 0) + 1
+        for c in key:
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = _TrieNode()
+            child.names[name] = child.names.get(name, 0) + 1
+            node = child
+
+    def _delete(self, key, name):
+        keys = self._member_keys[name]
+        keys[key] -= 1
+        if keys[key] == 0:
+            del keys[key]
+
+        node = self._root
+        self._decrease(node, name)
+        for c in key:
+            child = node.children[c]
+            self._decrease(child, name)
+            if not child.names:
+                # nobody else uses this branch
+                del node.children[c]
+                break
+            node = child
+
+    @staticmethod
+    def _decrease(node, name):
+        node.names[name] -= 1
+        if node.names[name] == 0:
+            del node.names[name]
+
+    def add_member(self, name):
+        """
+        Adds a team member to the index.
+        :param name: The member's name.
+        """
+        if name in self._member_keys:
+            return
+        self._member_keys[name] = {}
+        self._insert(name.lower(), name)
+
+    def remove_member(self, name):
+        """
+        Removes a team member (and the mention name) from the index.
+        :param name: The member's name.
+        """
+        if name not in self._member_keys:
+            return
+        for key, count in self._member_keys[name].items():
+            for _ in xrange(count):
+                self._delete(key, name)
+        del self._member_keys[name]
+        self._mention_names.pop(name, None)
+
+    def set_members(self, member_list):
+        """
+        Updates the index to the given member list, only the changed members are (re-)indexed.
+        :param member_list: The new member list.
+        """
+        new_members = set(member_list)
+        for name in set(self._member_keys) - new_members:
+            self.remove_member(name)
+        for name in member_list:
+            self.add_member(name)
+
+    def set_mention_name(self, name, mention_name):
+        """
+        Sets the mention name of a team member. Non-members are ignored.
+        :param name: The member's name.
+        :param mention_name: The member's mention name.
+        """
+        if name not in self._member_keys:
+            return
+        old_mention_name = self._mention_names.get(name)
+        if old_mention_name == mention_name:
+            return
+        if old_mention_name is not None:
+            self._delete(old_mention_name.lower(), name)
+        self._mention_names[name] = mention_name
+        self._insert(mention_name.lower(), name)
+
+    def find(self, prefix):
+        """
+        Finds all team members whose name or mention name starts with the given prefix.
+        :param prefix: The given prefix (non-case-sensitive).
+        :return: A sorted list of the matching member names.
+        """
+        node = self._root
+        for c in prefix.lower():
+            node = node.children.get(c)
+            if node is None:
+                return []
+        return sorted(node.names)
+
+    def resolve(self, prefix):
+        """
+        Resolves the given prefix to a list of candidates. If the prefix exactly matches
+        a name or a mention name, only the exact matches are returned.
+        :param prefix: The given prefix (non-case-sensitive).
+        :return: A sorted list of the candidate member names.
+        """
+        candidates = self.find(prefix)
+        key = prefix.lower()
+        exact_matches = [name for name in candidates if key in self._member_keys[name]]
+        return exact_matches if exact_matches else candidates
@@ -0,0 +1,12 @@
+# the shared copy of each person's name, the built-in intern() only accepts byte strings in Python 2.
+# the table only grows, so only the names in the days-off lists are interned, not the whole user directory
+_name_table = {}
+
+
+def intern_name(name):
+    """
+    Gets the shared copy of a name, so the days-off lists of all teams refer to the same string object.
+    :param name: The name (unicode).
+    :return: The shared copy.
+    """
+    return _name_table.setdefault(name, name)
@@ -0,0 +1,94 @@
+import time
+
+
+class TokenBucket(object):
+    """
+    A token bucket that refills at a fixed rate up to its capacity.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'last_time')
+
+    def __init__(self, rate, capacity, current_time):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_time = current_time
+
+    def refill(self, current_time):
+        elapsed = max(current_time - self.last_time, 0.0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.last_time = current_time
+
+    def has_token(self):
+        return self.tokens >= 1.0
+
+    def consume(self):
+        self.tokens -= 1.0
+
+
+class CommandRateLimiter(object):
+    """
+    Limits the command rate with a token bucket per user and a token bucket per command.
+    A rate of 0 disables the corresponding limit.
+    """
+
+    def __init__(self, user_rate, user_burst, command_rate, command_burst, time_func=time.time):
+        """
+        :param user_rate: Commands per minute per user.
+        :param user_burst: Maximum burst of commands per user.
+        :param command_rate: Calls per minute per command (of all users).
+        :param command_burst: Maximum burst of calls per command.
+        :param time_func: The function that returns the current time in seconds.
+        """
+        self.user_rate = user_rate / 60.0
+        self.user_burst = max(user_burst, 1)
+        self.command_rate = command_rate / 60.0
+        self.command_burst = max(command_burst, 1)
+        self._time_func = time_func
+
+        self._user_bucket_dict = {}
+        self._command_bucket_dict = {}
+        # the keys of the limits that have been reported, so we only reply once
+        self._notified_keys = set()
+
+        self.rejected_count = 0
+
+    def _get_bucket(self, bucket_dict, key, rate, burst, current_time):
+        bucket = bucket_dict.get(key)
+        if bucket is None:
+            bucket = bucket_dict[key] = TokenBucket(rate, burst, current_time)
+        else:
+            bucket.refill(current_time)
+        return bucket
+
+    def check(self, user_nick, command_name):
+        """
+        Checks if a user can run a command now, and takes the tokens if so.
+        :param user_nick: The user's nickname.
+        :param command_name: The command name.
+        :return: A tuple (allowed, key), where key is u'user' or u'command' indicating
+                 which limit is hit and None if the rejection has already been reported
+                 (or the command is allowed).
+        """
+        current_time = self._time_func()
+        buckets = []
+        if self.user_rate > 0:
+            buckets.append((u'user', (u'user', user_nick),
+                            self._get_bucket(self._user_bucket_dict, user_nick,
+                                             self.user_rate, self.user_burst, current_time)))
+        if self.command_rate > 0:
+            buckets.append((u'command', (u'command', command_name),
+                            self._get_bucket(self._command_bucket_dict, command_name,
+                                             self.command_rate, self.command_burst, current_time)))
+
+        for limit, key, bucket in buckets:
+            if not bucket.has_token():
+                self.rejected_count += 1
+                if key in self._notified_keys:
+                    return False, None
+                self._notified_keys.add(key)
+                return False, limit
+
+        for limit, key, bucket in buckets:
+            bucket.consume()
+            self._notified_keys.discard(key)
+        return True, None
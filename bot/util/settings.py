@@ -0,0 +1,251 @@
+"""
+Typed, immutable settings built from the config parser.
+The settings are validated when they are built, so errors are found when the config is loaded
+instead of when the values are used. A new Settings object is built for each config change and
+swapped in as a whole, so readers always see a consistent set of values.
+"""
+from collections import namedtuple
+
+from croniter import croniter
+
+from .config import get_team_members, get_team_sections
+
+NAME_PLACEHOLDER = u'<name>'
+
+BOOLEAN_VALUES = {u'true': True, u'yes': True, u'on': True, u'1': True,
+                  u'false': False, u'no': False, u'off': False, u'0': False}
+
+
+class TopicTemplate(object):
+    """
+    A topic template compiled for rendering with the name of the person-on-duty.
+    """
+    __slots__ = ('template', '_parts')
+
+    def __init__(self, template):
+        self.template = template
+        self._parts = template.split(NAME_PLACEHOLDER)
+
+    @property
+    def has_name(self):
+        return len(self._parts) > 1
+
+    def render(self, name):
+        return name.join(self._parts)
+
+    def __eq__(self, other):
+        return isinstance(other, TopicTemplate) and self.template == other.template
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return u"TopicTemplate(%r)" % self.template
+
+
+HipchatSettings = namedtuple('HipchatSettings', ['jid', 'auth_token', 'room_jid', 'room_server', 'api_server',
+                                                 'nickname', 'stfu_minutes', 'db', 'db_resync_hours',
+                                                 'send_interval', 'send_merge_window', 'send_queue_size',
+                                                 'reconnect_initial_delay', 'reconnect_max_delay',
+                                                 'replay_max_messages', 'config_watch_interval', 'admins'])
+
+MonitorSettings = namedtuple('MonitorSettings', ['loop_interval', 'slow_threshold'])
+
+StatusSettings = namedtuple('StatusSettings', ['port', 'interface', 'forecast_days'])
+
+ProfileSettings = namedtuple('ProfileSettings', ['enabled', 'output_dir', 'top_n'])
+
+HASettings = namedtuple('HASettings', ['enabled', 'lock_file', 'lease', 'heartbeat_interval', 'instance_id'])
+
+TeamSettings = namedtuple('TeamSettings', ['section', 'members', 'member_set', 'room_name', 'room_jid',
+                                           'daysoff_file', 'cache_file', 'topic_update_time', 'topic_template',
+                                           'command_plugins', 'cmd_rate_per_user', 'cmd_burst_per_user',
+                                           'cmd_rate_per_command', 'cmd_burst_per_command', 'question_interval',
+                                           'closure_calendars', 'member_regions'])
+
+
+class Settings(namedtuple('Settings', ['hipchat', 'monitor', 'profile', 'status', 'ha', 'teams'])):
+    __slots__ = ()
+
+    def get_team(self, section):
+        """
+        Gets the settings of a team.
+        :param section: The team section name.
+        :return: The TeamSettings, or None if there is no such team.
+        """
+        for team in self.teams:
+            if team.section == section:
+                return team
+
+
+class _Reader(object):
+    """
+    Reads typed values and collects the errors.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.errors = []
+
+    def get(self, section, option):
+        return unicode(self.config.get(section, option)).strip()
+
+    def _get_number(self, section, option, number_type, minimum):
+        value = self.get(section, option)
+        try:
+            number = number_type(value)
+        except ValueError:
+            self.errors.append(u"[%s] %s: '%s' is not a number" % (section, option, value))
+            return minimum
+        if number < minimum:
+            self.errors.append(u"[%s] %s: must be at least %s" % (section, option, minimum))
+            return minimum
+        return number
+
+    def get_int(self, section, option, minimum=0):
+        return self._get_number(section, option, int, minimum)
+
+    def get_float(self, section, option, minimum=0.0):
+        return self._get_number(section, option, float, minimum)
+
+    def get_bool(self, section, option):
+        value = self.get(section, option).lower()
+        if value not in BOOLEAN_VALUES:
+            self.errors.append(u"[%s] %s: '%s' is not a boolean" % (section, option, value))
+            return False
+        return BOOLEAN_VALUES[value]
+
+
+def _build_team_settings(reader, section):
+    config = reader.config
+    members = tuple(get_team_members(config, section))
+    if not members:
+        reader.errors.append(u"[%s] members: the team has no members" % section)
+    elif len(set(members)) != len(members):
+        reader.errors.append(u"[%s] members: duplicate members" % section)
+
+    topic_update_time = reader.get(section, u'topic_update_time')
+    try:
+        croniter(topic_update_time)
+    except (KeyError, ValueError) as e:
+        reader.errors.append(u"[%s] topic_update_time: invalid cron expression '%s' (%s)" %
+                             (section, topic_update_time, e))
+
+    topic_template = reader.get(section, u'topic_template')
+    if not topic_template:
+        reader.errors.append(u"[%s] topic_template: empty template" % section)
+
+    room_jid = reader.get(section, u'room_jid') or reader.get(u'hipchat', u'room_jid')
+    closure_calendars = _parse_closure_calendars(reader, section)
+    member_regions = _parse_member_regions(reader, section)
+    command_plugins = tuple(_split_list(reader.get(section, u'command_plugins')))
+
+    return TeamSettings(section=section,
+                        members=members,
+                        member_set=frozenset(members),
+                        room_name=reader.get(section, u'room_name'),
+                        room_jid=room_jid,
+                        daysoff_file=reader.get(section, u'daysoff_file'),
+                        cache_file=reader.get(section, u'cache_file'),
+                        topic_update_time=topic_update_time,
+                        topic_template=TopicTemplate(topic_template),
+                        command_plugins=command_plugins,
+                        cmd_rate_per_user=reader.get_float(section, u'cmd_rate_per_user'),
+                        cmd_burst_per_user=reader.get_int(section, u'cmd_burst_per_user'),
+                        cmd_rate_per_command=reader.get_float(section, u'cmd_rate_per_command'),
+                        cmd_burst_per_command=reader.get_int(section, u'cmd_burst_per_command'),
+                        question_interval=reader.get_float(section, u'question_interval'),
+                        closure_calendars=closure_calendars,
+                        member_regions=member_regions,
+                        )
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(u',') if item.strip()]
+
+
+def _parse_closure_calendars(reader, section):
+    # "holidays.ics, nl:holidays-nl.csv", the calendars without a region are team-wide
+    calendars = []
+    for item in _split_list(reader.get(section, u'closure_calendars')):
+        region, _, file_name = item.rpartition(u':')
+        region = region.strip() or None
+        file_name = file_name.strip()
+        if not file_name.lower().endswith((u'.ics', u'.csv')):
+            reader.errors.append(u"[%s] closure_calendars: '%s' is not an .ics or .csv file" % (section, item))
+            continue
+        calendars.append((region, file_name))
+    return tuple(calendars)
+
+
+def _parse_member_regions(reader, section):
+    # "alice:nl, bob:us"
+    member_regions = []
+    for item in _split_list(reader.get(section, u'member_regions')):
+        name, _, region = (part.strip() for part in item.partition(u':'))
+        if not name or not region:
+            reader.errors.append(u"[%s] member_regions: '%s' should be <name>:<region>" % (section, item))
+            continue
+        member_regions.append((name, region))
+    return tuple(member_regions)
+
+
+def build_settings(config):
+    """
+    Builds and validates the settings from the given config.
+    :param config: The config parser (initialized by init_config()).
+    :return: The Settings.
+    """
+    reader = _Reader(config)
+    db = reader.get(u'hipchat', u'db')
+    if not db:
+        reader.errors.append(u"[hipchat] db: empty path")
+    hipchat = HipchatSettings(jid=reader.get(u'hipchat', u'jid'),
+                              auth_token=reader.get(u'hipchat', u'auth_token'),
+                              room_jid=reader.get(u'hipchat', u'room_jid'),
+                              room_server=reader.get(u'hipchat', u'room_server'),
+                              api_server=reader.get(u'hipchat', u'api_server'),
+                              nickname=reader.get(u'hipchat', u'nickname'),
+                              stfu_minutes=reader.get_int(u'hipchat', u'stfu_minutes'),
+                              db=db,
+                              db_resync_hours=reader.get_float(u'hipchat', u'db_resync_hours'),
+                              send_interval=reader.get_float(u'hipchat', u'send_interval'),
+                              send_merge_window=reader.get_float(u'hipchat', u'send_merge_window'),
+                              send_queue_size=reader.get_int(u'hipchat', u'send_queue_size', 1),
+                              reconnect_initial_delay=reader.get_float(u'hipchat', u'reconnect_initial_delay'),
+                              reconnect_max_delay=reader.get_float(u'hipchat', u'reconnect_max_delay'),
+                              replay_max_messages=reader.get_int(u'hipchat', u'replay_max_messages'),
+                              config_watch_interval=reader.get_float(u'hipchat', u'config_watch_interval'),
+                              admins=frozenset(_split_list(reader.get(u'hipchat', u'admins'))),
+                              )
+    monitor = MonitorSettings(loop_interval=reader.get_float(u'monitor', u'loop_interval'),
+                              slow_threshold=reader.get_float(u'monitor', u'slow_threshold'),
+                              )
+    status = StatusSettings(port=reader.get_int(u'status', u'port'),
+                            interface=reader.get(u'status', u'interface'),
+                            forecast_days=reader.get_int(u'status', u'forecast_days', 1),
+                            )
+    profile = ProfileSettings(enabled=reader.get_bool(u'profile', u'enabled'),
+                              output_dir=reader.get(u'profile', u'output_dir'),
+                              top_n=reader.get_int(u'profile', u'top_n', 1),
+                              )
+    ha = HASettings(enabled=reader.get_bool(u'ha', u'enabled'),
+                    lock_file=reader.get(u'ha', u'lock_file'),
+                    lease=reader.get_float(u'ha', u'lease', 1.0),
+                    heartbeat_interval=reader.get_float(u'ha', u'heartbeat_interval', 0.1),
+                    instance_id=reader.get(u'ha', u'instance_id'),
+                    )
+    if ha.enabled:
+        if not ha.lock_file:
+            reader.errors.append(u"[ha] lock_file: no lock file")
+        if ha.heartbeat_interval >= ha.lease:
+            reader.errors.append(u"[ha] heartbeat_interval: must be shorter than the lease")
+
+    sections = get_team_sections(config)
+    if not sections:
+        reader.errors.append(u"[hipchat] teams: no teams")
+    teams = tuple(_build_team_settings(reader, section) for section in sections)
+
+    if reader.errors:
+        raise RuntimeError(u"invalid config:\n  " + u"\n  ".join(reader.errors))
+    return Settings(hipchat=hipchat, monitor=monitor, profile=profile, status=status, ha=ha, teams=teams)
@@ -1,17 +1,27 @@
+from .member_index import MemberNameIndex
+
+
 class TeamRoundRobinScheduler(object):
     """
     A round robin scheduler for switching man on duty in a team on a daily basis.
     """
 
-    def __init__(self, teammate_list, daysoff_parser):
+    def __init__(self, teammate_list, daysoff_parser, closure_index=None):
         self._teammate_list = teammate_list
         self._daysoff_parser = daysoff_parser
+        # the team-wide and regional closure days, checked before the days-off lists
+        self.closure_index = closure_index
         self._idx = 0
+        self._member_index = MemberNameIndex(teammate_list)
 
     @property
     def teammate_list(self):
         return self._teammate_list
 
+    @property
+    def member_index(self):
+        return self._member_index
+
     def get_current_person(self):
         """
         Gets the current person's name and index.
@@ -22,18 +32,29 @@ class TeamRoundRobinScheduler(object):
     def set_current_person(self, name):
         """
         Sets the current person to the given one.
-        :param name: The name of the person to set to.
-        :return: The person's name if successful, otherwise None.
-        """
-        person_idx = None
-        for idx in xrange(len(self._teammate_list)):
-            if self._teammate_list[idx].lower().startswith(name.lower()):
-                person_idx = idx
-                break
-        if person_idx is None:
+        :param name: The name (or mention name) prefix of the person to set to.
+        :return: The person's name if the name matches exactly one person, otherwise None.
+        """
+        candidates = self._member_index.resolve(name)
+        if len(candidates) != 1:
             return
-        self._idx = person_idx
-        return self._teammate_list[person_idx]
+        self._idx = self._teammate_list.index(candidates[0])
+        return candidates[0]
+
+    def set_teammate_list(self, teammate_list):
+        """
+        Changes the team members. The current person stays the same if they are still in the team,
+        otherwise the rotation continues from the same position.
+        :param teammate_list: The new list of team members.
+        """
+        current_person = self._teammate_list[self._idx]
+        old_idx = self._idx
+        self._teammate_list = teammate_list
+        self._member_index.set_members(teammate_list)
+        if current_person in teammate_list:
+            self._idx = teammate_list.index(current_person)
+        else:
+            self._idx = old_idx % len(teammate_list)
 
     def set_current_person_idx(self, idx):
         """
@@ -51,6 +72,8 @@ class TeamRoundRobinScheduler(object):
         """
         if name not in self._teammate_list:
             return True
+        if self.closure_index is not None and self.closure_index.get_member_closure(name, check_date) is not None:
+            return False
         return self._daysoff_parser.check_availability(name, check_date)
 
     def get_next_person(self, check_date=None):
@@ -73,6 +96,22 @@ class TeamRoundRobinScheduler(object):
 
         return self._teammate_list[idx], idx
 
+    def get_forecast(self, check_dates):
+        """
+        Gets the people on duty of the coming rotations without switching.
+        :param check_dates: The dates of the coming rotations in ascending order.
+        :return: A list of (date, name) tuples.
+        """
+        current_idx = self._idx
+        forecast = []
+        try:
+            for check_date in check_dates:
+                name, self._idx = self.get_next_person(check_date)
+                forecast.append((check_date, name))
+        finally:
+            self._idx = current_idx
+        return forecast
+
     def switch_to_next_person(self, check_date=None):
         """
         Switches to the next person.
@@ -0,0 +1,72 @@
+import datetime
+import os
+import unittest
+
+from bot.util.closure_calendar import ClosureCalendar, load_closure_index, parse_ics
+from bot.util.daysoff_parser import DaysOffParser
+from bot.util.team_scheduler import TeamRoundRobinScheduler
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__)).decode('utf-8')
+ICS_FILE = os.path.join(BASE_DIR, u'data', u'closures.ics')
+CSV_FILE = os.path.join(BASE_DIR, u'data', u'closures-nl.csv')
+
+
+class ClosureCalendarTest(unittest.TestCase):
+    """
+    Tests for ClosureCalendar and ClosureIndex.
+    """
+
+    def test_load_ics(self):
+        """
+        Tests loading an iCalendar file with a recurring event.
+        """
+        calendar = ClosureCalendar()
+        calendar.load(ICS_FILE)
+        self.assertEqual(u'Team offsite, all hands', calendar.get_closure(datetime.date(2016, 10, 13)),
+                         u"the folded summary should be unfolded.")
+        self.assertIsNone(calendar.get_closure(datetime.date(2016, 10, 14)), u"DTEND should be exclusive.")
+        self.assertEqual(u'Christmas', calendar.get_closure(datetime.date(2020, 12, 26)),
+                         u"the recurring event should be expanded for any year.")
+        self.assertIsNone(calendar.get_closure(datetime.date(2017, 12, 25)), u"EXDATE should be excluded.")
+        self.assertEqual([2016, 2017, 2020], sorted(calendar._year_cache), u"only the checked years should be expanded.")
+
+    def test_rrule_until(self):
+        """
+        Tests a recurring event with an UNTIL in UTC, and that an invalid RRULE is rejected when it's loaded.
+        """
+        events = parse_ics(u"BEGIN:VEVENT\nDTSTART;VALUE=DATE:20161225\n"
+                           u"RRULE:FREQ=YEARLY;UNTIL=20201225T000000Z\nSUMMARY:Christmas\nEND:VEVENT\n")
+        calendar = ClosureCalendar()
+        calendar.add_event(events[0])
+        self.assertEqual(u'Christmas', calendar.get_closure(datetime.date(2020, 12, 25)),
+                         u"the last occurrence should be included.")
+        self.assertIsNone(calendar.get_closure(datetime.date(2021, 12, 25)),
+                          u"there should be no occurrences after UNTIL.")
+        self.assertRaises(RuntimeError, parse_ics,
+                          u"BEGIN:VEVENT\nDTSTART:20161225\nRRULE:FREQ=SOMETIMES\nEND:VEVENT\n")
+
+    def test_load_csv(self):
+        """
+        Tests loading a CSV file.
+        """
+        calendar = ClosureCalendar()
+        calendar.load(CSV_FILE)
+        self.assertEqual(2, len(calendar), u"the header and the comments should be skipped.")
+        self.assertEqual(u"King's Day", calendar.get_closure(datetime.date(2016, 4, 27)),
+                         u"the date should be closed.")
+        self.assertRaises(RuntimeError, calendar.load, os.path.join(BASE_DIR, u'data', u'non-existing.csv'))
+
+    def test_scheduler(self):
+        """
+        Tests that the scheduler checks the closures before the days-off list.
+        """
+        index = load_closure_index([(None, ICS_FILE), (u'nl', CSV_FILE)], [(u'alice', u'nl')])
+        scheduler = TeamRoundRobinScheduler([u'alice', u'bob', u'carol'], DaysOffParser(), index)
+        self.assertFalse(scheduler.check_availability(u'bob', datetime.date(2016, 12, 25)),
+                         u"nobody should be available on a team-wide closure.")
+        self.assertFalse(scheduler.check_availability(u'alice', datetime.date(2016, 4, 27)),
+                         u"alice should be off on a closure of alice's region.")
+        self.assertEqual((u'bob', 1), scheduler.get_next_person(datetime.date(2016, 4, 27)),
+                         u"bob should be next on a regional closure of alice.")
+        self.assertIsNone(index.get_team_closure(datetime.date(2016, 4, 27)),
+                          u"a regional closure should not close the team.")
@@ -0,0 +1,99 @@
+import datetime
+import unittest
+
+from bot.commands import CommandRegistry, command, dates_and_others, no_args, rest_of_line, split_args
+
+
+class _Handlers(object):
+
+    def __init__(self):
+        self.calls = []
+
+    @command(u'!ECHO', parser=rest_of_line)
+    def cmd_echo(self, room, user_nick, args):
+        self.calls.append((u'!ECHO', user_nick, args))
+
+    @command(u'!PING', parser=no_args, members_only=False)
+    def cmd_ping(self, room, user_nick, args):
+        self.calls.append((u'!PING', user_nick, args))
+
+    @command(u'!FAIL', parser=no_args)
+    def cmd_fail(self, room, user_nick, args):
+        raise RuntimeError(u"failed")
+
+
+class CommandRegistryTest(unittest.TestCase):
+    """
+    Tests for CommandRegistry.
+    """
+
+    def setUp(self):
+        self.handlers = _Handlers()
+        self.registry = CommandRegistry({u'alice'})
+        self.registry.register_object_commands(self.handlers)
+
+    def test_dispatch(self):
+        """
+        Tests dispatching commands to the handlers.
+        """
+        self.assertTrue(self.registry.dispatch(None, u'alice', u'!ECHO  hello world '),
+                        u"!ECHO should be handled.")
+        self.assertFalse(self.registry.dispatch(None, u'alice', u'hello world'),
+                         u"a normal message should not be handled.")
+        self.assertFalse(self.registry.dispatch(None, u'alice', u'!UNKNOWN'),
+                         u"an unknown command should not be handled.")
+        self.assertEqual([(u'!ECHO', u'alice', u'hello world')], self.handlers.calls,
+                         u"!ECHO should be called once with the parsed arguments.")
+        self.assertEqual(1, self.registry.get(u'!ECHO').call_count,
+                         u"!ECHO should be counted once.")
+
+    def test_members_only(self):
+        """
+        Tests that non-members can only use the public commands.
+        """
+        self.assertTrue(self.registry.dispatch(None, u'bob', u'!ECHO hi'),
+                        u"!ECHO from a non-member should be consumed.")
+        self.assertTrue(self.registry.dispatch(None, u'bob', u'!PING'),
+                        u"!PING should be handled.")
+        self.assertEqual([(u'!PING', u'bob', None)], self.handlers.calls,
+                         u"only !PING should be called.")
+
+    def test_permission_hook(self):
+        """
+        Tests rejecting commands with a permission hook.
+        """
+        self.registry.add_permission_hook(lambda cmd, user_nick: cmd.name != u'!ECHO')
+        self.registry.dispatch(None, u'alice', u'!ECHO hi')
+        self.registry.dispatch(None, u'alice', u'!PING')
+        self.assertEqual([(u'!PING', u'alice', None)], self.handlers.calls,
+                         u"!ECHO should be rejected by the hook.")
+
+    def test_handler_failure(self):
+        """
+        Tests that a failing handler is counted as an error.
+        """
+        timings = []
+        self.registry.add_timing_hook(lambda cmd, elapsed: timings.append(cmd.name))
+        self.registry.dispatch(None, u'alice', u'!FAIL')
+        self.assertEqual(1, self.registry.get_stats()[u'!FAIL'][u'errors'],
+                         u"!FAIL should have one error.")
+        self.assertEqual([u'!FAIL'], timings,
+                         u"the timing hook should be called.")
+
+    def test_duplicate_command(self):
+        """
+        Tests registering a command twice.
+        """
+        self.assertRaises(RuntimeError, self.registry.register, u'!PING', lambda *args: None)
+
+    def test_parsers(self):
+        """
+        Tests the argument parsers.
+        """
+        self.assertEqual([u'a', u'b'], split_args(u' a \tb '),
+                         u"arguments should be split by whitespaces.")
+        self.assertEqual([], split_args(u'  '),
+                         u"an empty string has no arguments.")
+        self.assertEqual(([u'MON', datetime.date(2016, 1, 31)], [u'@ALICE']),
+                         dates_and_others(u'mon 2016-01-31 @alice'),
+                         u"dates and other arguments should be separated.")
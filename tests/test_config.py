@@ -113,3 +113,22 @@ class ConfigTest(unittest.TestCase):
         config.override_config_with_env(config_parser)
         self.assertIs(config_parser.getint(u'hipchat', u'stfu_minutes'), 2,
                       u"[hipchat][stfu_minutes] mismatch")
+
+    def test_team_sections(self):
+        """
+        Tests the default settings of extra team sections.
+        """
+        config_parser = config.init_config(self.temp_config_file)
+        config_parser.set(u'hipchat', u'teams', u'team, team_ops')
+        self.assertEqual([u'team', u'team_ops'], config.get_team_sections(config_parser),
+                         u"team sections mismatch")
+
+        config_parser.add_section(u'team_ops')
+        config_parser.set(u'team_ops', u'members', u'alice, bob,')
+        config.set_team_default_config(config_parser, u'team_ops')
+        self.assertEqual(config_parser.get(u'team_ops', u'daysoff_file'), u'team_ops-daysoff.txt',
+                         u"[team_ops][daysoff_file] mismatch")
+        self.assertEqual(config_parser.get(u'team_ops', u'topic_update_time'), u'0 9 * * MON-FRI *',
+                         u"[team_ops][topic_update_time] mismatch")
+        self.assertEqual([u'alice', u'bob'], config.get_team_members(config_parser, u'team_ops'),
+                         u"[team_ops][members] mismatch")
@@ -0,0 +1,54 @@
+from ConfigParser import ConfigParser
+import unittest
+
+from bot.config_events import ConfigEventBus, diff_configs
+
+
+class ConfigEventsTest(unittest.TestCase):
+    """
+    Tests for the config events.
+    """
+
+    def test_diff_configs(self):
+        """
+        Tests diff_configs().
+        """
+        old_config = ConfigParser()
+        old_config.add_section(u'team')
+        old_config.set(u'team', u'members', u'alice, bob')
+        old_config.set(u'team', u'question_interval', 10)
+        old_config.set(u'team', u'room_name', u'room')
+
+        new_config = ConfigParser()
+        new_config.add_section(u'team')
+        new_config.set(u'team', u'members', u'alice, bob, carol')
+        new_config.set(u'team', u'question_interval', u'10')
+        new_config.add_section(u'log')
+        new_config.set(u'log', u'level', u'DEBUG')
+
+        self.assertEqual([(u'log', u'level', u'DEBUG'),
+                          (u'team', u'members', u'alice, bob, carol'),
+                          (u'team', u'room_name', None)],
+                         diff_configs(old_config, new_config),
+                         u"the changed, added and removed options should be found.")
+
+    def test_publish(self):
+        """
+        Tests notifying the subscribers of the options they subscribed to.
+        """
+        bus = ConfigEventBus()
+        all_changes = []
+        member_changes = []
+        bus.subscribe(u'team', all_changes.append)
+        bus.subscribe(u'team', member_changes.append, [u'members'])
+
+        bus.publish([(u'team', u'members', u'a'), (u'team', u'room_name', u'room'), (u'log', u'level', u'INFO')])
+        self.assertEqual([set([u'members', u'room_name'])], all_changes,
+                         u"all changes in the section should be published.")
+        self.assertEqual([set([u'members'])], member_changes,
+                         u"only the subscribed options should be published.")
+
+        bus.unsubscribe(u'team', all_changes.append)
+        bus.publish([(u'team', u'room_name', u'room2')])
+        self.assertEqual(1, len(all_changes), u"an unsubscribed callback should not be called.")
+        self.assertEqual(1, len(member_changes), u"the callback should not be called for other options.")
@@ -6,7 +6,7 @@ import unittest
 import codecs
 import os
 
-from bot.util.daysoff_parser import DaysOffParser, sanitize_dates
+from bot.util.daysoff_parser import DaysOffParser, DaysOffRecord, sanitize_dates
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__)).decode('utf-8')
 
@@ -138,6 +138,57 @@ class DaysOffParserTest(unittest.TestCase):
         self.assertFalse(parser.check_availability(u'alice', today_date),
                          u"'alice' should NOT be available today after addition.")
 
+    def test_record(self):
+        """
+        Tests the compact DaysOffRecord.
+        """
+        record = DaysOffRecord()
+        self.assertTrue(record.add(datetime.date(2016, 3, 1)), u"a new date should be added.")
+        self.assertTrue(record.add(datetime.date(2016, 2, 1)), u"a new date should be added.")
+        self.assertFalse(record.add(datetime.date(2016, 3, 1)), u"a date should only be added once.")
+        self.assertTrue(record.add(u'WEDNESDAY'), u"a new weekday should be added.")
+        self.assertFalse(record.add(u'WED'), u"a weekday should only be added once.")
+        self.assertEqual([u'WED', datetime.date(2016, 2, 1), datetime.date(2016, 3, 1)], record.to_list(),
+                         u"the weekdays should come first and the dates should be sorted.")
+        self.assertEqual(3, len(record), u"the record should have 3 days off.")
+
+        first_ordinal = datetime.date(2016, 1, 1).toordinal()
+        # 2016-02-03 is a Wednesday
+        self.assertTrue(record.is_off(datetime.date(2016, 2, 3), first_ordinal), u"Wednesdays should be off.")
+        self.assertTrue(record.is_off(datetime.date(2016, 3, 1), first_ordinal), u"2016-03-01 should be off.")
+        self.assertFalse(record.is_off(datetime.date(2016, 3, 2) + datetime.timedelta(days=1), first_ordinal),
+                         u"2016-03-03 should not be off.")
+        self.assertFalse(record.is_off(datetime.date(2016, 2, 1), datetime.date(2016, 2, 2).toordinal()),
+                         u"an expired date should not count.")
+
+        record.remove_before(datetime.date(2016, 2, 2).toordinal())
+        self.assertEqual([u'WED', datetime.date(2016, 3, 1)], record.to_list(), u"the past date should be removed.")
+        self.assertTrue(record.remove(u'WED'), u"the weekday should be removed.")
+        self.assertFalse(record.remove(datetime.date(2016, 2, 1)), u"a missing date cannot be removed.")
+        self.assertTrue(record.remove(datetime.date(2016, 3, 1)), u"the date should be removed.")
+        self.assertEqual(0, len(record), u"the record should be empty.")
+
+    def test_expired_dates_not_listed(self):
+        """
+        Tests that the past dates are not listed before they are cleaned up.
+        """
+        parser = DaysOffParser()
+        parser.add(u'alice', [u'MON', u'2099-01-01'])
+        parser._data_dict[u'alice'].add(datetime.date.today() - datetime.timedelta(days=1))
+        self.assertEqual([u'MON', datetime.date(2099, 1, 1)], parser.get_my_days_off(u'alice'),
+                         u"the past date should not be listed.")
+
+    def test_names_are_shared(self):
+        """
+        Tests that the same name is stored only once.
+        """
+        parser = DaysOffParser()
+        parser.add(u''.join([u'dav', u'id']), [u'MON'])
+        other_parser = DaysOffParser()
+        other_parser.add(u''.join([u'da', u'vid']), [u'TUE'])
+        self.assertIs(list(parser._data_dict)[0], list(other_parser._data_dict)[0],
+                      u"the parsers should share the name.")
+
     def test_sanitize_dates(self):
         """
         Tests sanitize_dates().
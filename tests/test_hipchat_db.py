@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer, task
+
+from bot.hipchat_db import HipchatUserDb, UserRecord
+from bot.profiler import Profiler
+from bot.state_store import StateStore
+
+
+class FakeStorage(object):
+
+    def write(self, file_path, data):
+        return defer.succeed(None)
+
+
+class FakeBot(object):
+
+    def __init__(self, temp_dir):
+        self.profiler = Profiler(FakeStorage())
+        self.local_state_store = StateStore(FakeStorage(), os.path.join(temp_dir, u'state.json'))
+
+
+class UserRecordTest(unittest.TestCase):
+    """
+    Tests for the UserRecord.
+    """
+
+    def test_from_api(self):
+        """
+        Tests that only the used fields of an API user object are stored.
+        """
+        user = {u'id': 42, u'name': u'Alice', u'mention_name': u'alice', u'email': u'alice@example.com',
+                u'title': u'Developer', u'presence': {u'show': u'chat'}, u'links': {u'self': u'https://x/v2/user/42'}}
+        record = UserRecord.from_api(user)
+        data = record.to_json()
+        self.assertEqual([42, u'Alice', u'alice', u'alice@example.com'], json.loads(data),
+                         u"the record should be stored as a compact list.")
+
+        parsed = UserRecord.from_json(data)
+        self.assertEqual((42, u'Alice', u'alice', u'alice@example.com'),
+                         (parsed.id, parsed.name, parsed.mention_name, parsed.email),
+                         u"the stored record should be parsed.")
+
+    def test_from_json_full_object(self):
+        """
+        Tests parsing the whole API user object stored by older versions.
+        """
+        data = json.dumps({u'id': 7, u'name': u'B\xf6b', u'mention_name': u'bob', u'title': u'Tester'})
+        record = UserRecord.from_json(data)
+        self.assertEqual((7, u'B\xf6b', u'bob', None), (record.id, record.name, record.mention_name, record.email),
+                         u"the old record should be parsed.")
+        self.assertEqual([7, u'B\xf6b', u'bob', None], json.loads(record.to_json().decode('utf-8')),
+                         u"the non-ASCII name should be stored as utf-8.")
+
+
+class HipchatUserDbTest(unittest.TestCase):
+    """
+    Tests for syncing the HipchatUserDb.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.clock = task.Clock()
+        self.bot = FakeBot(self.temp_dir)
+        self.user_db = HipchatUserDb(self.bot, u'api.example.com', u'token', os.path.join(self.temp_dir, u'db'),
+                                     clock=self.clock)
+        self.urls = []
+        self.responses = []
+        self.user_db.get_page = self._get_page
+
+    def tearDown(self):
+        self.user_db._db = None
+        shutil.rmtree(self.temp_dir)
+
+    def _get_page(self, url):
+        self.urls.append(url)
+        return self.responses.pop(0)
+
+    def test_resume_before_first_page(self):
+        """
+        Tests resuming a sync whose first page has never been completed.
+        """
+        self.bot.local_state_store.get_user_db_state()[u'sync_cursor'] = {
+            u'started': self.clock.seconds(), u'page': None, u'next': None, u'users_done': 0, u'completed': False}
+
+        self.responses.append(defer.fail(IOError(u"connection refused")))
+        d = self.user_db.populate_user_db()
+        self.clock.advance(self.user_db._fetch_interval)
+        self.assertTrue(d.called, u"the sync should finish when the first page fails.")
+        self.assertTrue(self.urls[0].startswith(b'https://api.example.com/v2/user?auth_token='),
+                        u"the sync should be resumed from the first page.")
+
+        self.responses.append(defer.succeed(json.dumps({u'items': [], u'links': {}})))
+        d = self.user_db.populate_user_db()
+        self.clock.advance(self.user_db._fetch_interval)
+        self.assertTrue(d.called, u"the next sync should not wait for the failed one.")
+        self.assertEqual(self.urls[0], self.urls[1], u"the first page should be fetched again.")
+        self.assertTrue(self.bot.local_state_store.get_user_db_state()[u'sync_cursor'][u'completed'],
+                        u"the sync should be completed.")
+
+    def test_bad_page(self):
+        """
+        Tests that a page that can't be parsed fails the sync instead of leaving it in progress.
+        """
+        self.responses.append(defer.succeed(b'<html>502 Bad Gateway</html>'))
+        d = self.user_db.populate_user_db()
+        self.clock.advance(self.user_db._fetch_interval)
+        self.assertTrue(d.called, u"the sync should finish when the page can't be parsed.")
+        self.assertFalse(self.user_db.get_stats()[u'sync_in_progress'], u"the sync should not be in progress.")
+
+        # a user without a name is skipped, the other users are stored
+        user_list = {u'items': [{u'name': u'Alice', u'mention_name': u'alice',
+                                 u'links': {u'self': u'https://api.example.com/v2/user/1'}},
+                                {u'name': u'Bob', u'mention_name': u'bob',
+                                 u'links': {u'self': u'https://api.example.com/v2/user/2'}}],
+                     u'links': {}}
+        self.responses.append(defer.succeed(json.dumps(user_list)))
+        self.responses.append(defer.succeed(json.dumps({u'id': 1, u'mention_name': u'alice'})))
+        self.responses.append(defer.succeed(json.dumps({u'id': 2, u'name': u'Bob', u'mention_name': u'bob'})))
+        d = self.user_db.populate_user_db()
+        while self.clock.getDelayedCalls():
+            self.clock.advance(self.user_db._fetch_interval)
+        self.assertTrue(d.called, u"the sync should finish when a user can't be parsed.")
+        self.assertEqual(1, self.user_db.get_stats()[u'users_done'], u"the valid user should be stored.")
+        self.assertTrue(self.user_db.get_stats()[u'sync_completed'], u"the sync should be completed.")
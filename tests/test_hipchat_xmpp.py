@@ -0,0 +1,398 @@
+import unittest
+
+from twisted.internet import defer, error, task
+from twisted.python.failure import Failure
+
+from bot.commands import no_args
+from bot.hipchat_xmpp import ConnectionMonitor, HipchatBot
+from bot.profiler import Profiler
+from bot.replay import CommandReplayer, parse_message_time
+from bot.startup import StartupTracker
+from bot.util.daysoff_parser import DaysOffParser
+
+
+class FakeStorage(object):
+
+    def write(self, file_path, data):
+        return defer.succeed(None)
+
+
+class FakeHipChatApi(object):
+
+    def __init__(self):
+        self.items = []
+        self._callback = None
+        self._failure_callback = None
+        self.private_messages = []
+
+    def view_room_history(self, room_name, max_results=100, not_before=None, callback=None, failure_callback=None,
+                          **kwargs):
+        self._callback = callback
+        self._failure_callback = failure_callback
+
+    def respond(self):
+        self._callback({u'items': self.items})
+
+    def fail(self):
+        self._failure_callback(Failure(error.TimeoutError()))
+
+    def send_private_message(self, user_id, message):
+        self.private_messages.append((user_id, message))
+
+
+class FakeBot(object):
+
+    def __init__(self, clock):
+        self.is_leader = True
+        self.leader_election = None
+        self.profiler = Profiler(FakeStorage())
+        self.startup = StartupTracker(clock)
+        self.hipchat_api = FakeHipChatApi()
+        self.hipchat_db = FakeUserDb()
+
+
+class FakeUserDb(object):
+
+    def get_user_data(self, name):
+        return FakeUserRecord(u'id-' + name) if name == u'alice' else None
+
+
+class FakeUserRecord(object):
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeSchedule(object):
+
+    def __init__(self):
+        self.current_person = u'alice'
+
+    def get_current_person(self):
+        return self.current_person, None
+
+
+class FakeTeam(object):
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.section = u'team'
+        self.room_name = u'room'
+        self.state = {u'schedule': {}, u'history': {}}
+        self.days_off_parser = DaysOffParser()
+        self.schedule = FakeSchedule()
+        self.save_deferred = None
+
+    @property
+    def ready_phases(self):
+        return [u'config', u'days_off[team]']
+
+    @property
+    def is_ready(self):
+        return self.bot.startup.is_ready(*self.ready_phases)
+
+    def when_ready(self):
+        return self.bot.startup.when_ready(*self.ready_phases)
+
+    def save_state(self):
+        pass
+
+    def save_days_off(self):
+        self.save_deferred = defer.Deferred()
+        return self.save_deferred
+
+
+class FakeUser(object):
+
+    def __init__(self, nick):
+        self.nick = nick
+
+
+class FakeMessage(object):
+
+    def __init__(self, body, stanza_id):
+        self.body = body
+        self.stanzaID = stanza_id
+
+
+def make_item(message_id, date, name, message):
+    return {u'id': message_id, u'date': date, u'from': {u'name': name}, u'message': message}
+
+
+class HipchatBotTest(unittest.TestCase):
+    """
+    Tests for the room handler HipchatBot.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(parse_message_time(u'2016-10-01T09:00:00+00:00'))
+        self.bot = FakeBot(self.clock)
+        self.team = FakeTeam(self.bot)
+        for phase in self.team.ready_phases:
+            self.bot.startup.begin(phase)
+
+        self.mucbot = HipchatBot(self.bot, self.team, u'conf.example.com', u'room', u'Room', u'Bot', 0,
+                                 [u'alice', u'bob'], clock=self.clock)
+        self.mucbot.connected = True
+        self.mucbot.replayer = CommandReplayer(self.mucbot, clock=self.clock)
+        self.pings = []
+        self.replies = []
+        self.mucbot.send_reply = self.replies.append
+
+        @self.mucbot.commands.command(u'!PING', parser=no_args)
+        def cmd_ping(room, user_nick, args):
+            self.pings.append(user_nick)
+
+    def _receive(self, nick, body, stanza_id):
+        self.mucbot.receivedGroupChat(None, FakeUser(nick), FakeMessage(body, stanza_id))
+
+    def _set_ready(self):
+        for phase in self.team.ready_phases:
+            self.bot.startup.finish(phase)
+
+    def test_held_messages(self):
+        """
+        Tests that the messages received before the team is ready are handled once after the missed commands.
+        """
+        # the bot has processed a message before it was restarted
+        self.mucbot.replayer.record(u'id1', parse_message_time(u'2016-10-01T08:00:00+00:00'))
+
+        self.clock.advance(60)
+        self._receive(u'alice', b'!PING', u'xmpp-id3')
+        self.assertEqual([], self.pings, u"the commands should wait until the team is ready.")
+
+        self._set_ready()
+        self.assertEqual([], self.pings, u"the held command should wait for the missed commands.")
+        self.clock.advance(1)
+        self._receive(u'bob', b'!PING', u'xmpp-id4')
+
+        # the history has the missed command and the held one with another ID
+        self.bot.hipchat_api.items = [make_item(u'id2', u'2016-10-01T08:30:00+00:00', u'bob', u'!PING'),
+                                      make_item(u'id3', u'2016-10-01T09:01:00+00:00', u'alice', u'!PING')]
+        self.bot.hipchat_api.respond()
+        self.assertEqual([u'bob', u'alice', u'bob'], self.pings,
+                         u"the missed command should be handled first, then the held ones in order.")
+
+        self._receive(u'bob', b'!PING', u'xmpp-id5')
+        self.assertEqual(4, len(self.pings), u"the next commands should be handled right away.")
+
+    def test_held_messages_history_failure(self):
+        """
+        Tests that the held messages are handled when the history can't be fetched.
+        """
+        self.mucbot.replayer.record(u'id1', parse_message_time(u'2016-10-01T08:00:00+00:00'))
+        self._receive(u'alice', b'!PING', u'xmpp-id3')
+        self._set_ready()
+        self.bot.hipchat_api.fail()
+        self.assertEqual([u'alice'], self.pings, u"the held command should be handled.")
+
+    def test_ready(self):
+        """
+        Tests that the commands are handled right away when the team is ready.
+        """
+        self._set_ready()
+        self._receive(u'bob', b'!PING', u'xmpp-id1')
+        self.assertEqual([u'bob'], self.pings, u"the command should be handled.")
+        self._receive(u'carol', b'!PING', u'xmpp-id2')
+        self.assertEqual([u'bob'], self.pings, u"the commands of non-members should be ignored.")
+
+    def test_skewed_server_clock(self):
+        """
+        Tests that a command handled live is not replayed when the server's clock is ahead.
+        """
+        self._set_ready()
+        self._receive(u'bob', b'!PING', u'xmpp-id1')
+        self.clock.advance(60)
+        # the server is 2 seconds ahead and the history has another ID for the message
+        self.bot.hipchat_api.items = [make_item(u'id1', u'2016-10-01T09:00:02+00:00', u'bob', u'!PING')]
+        self.mucbot.replayer.replay()
+        self.bot.hipchat_api.respond()
+        self.assertEqual([u'bob'], self.pings, u"the command should only be handled once.")
+
+    def test_reply_after_write(self):
+        """
+        Tests that a command replies once the days-off file is written.
+        """
+        self._set_ready()
+        self._receive(u'alice', b'!IM_OFF 2099-01-01', u'xmpp-id1')
+        self.assertEqual([], self.replies, u"the reply should wait for the write.")
+        self.team.save_deferred.callback(None)
+        self.assertEqual(1, len(self.replies), u"the reply should be sent when the file is written.")
+        self.assertIn(u'2099-01-01', self.replies[0], u"the reply should list the new day off.")
+
+    def test_set_topic_template_ha(self):
+        """
+        Tests that the topic template can't be changed in the room with HA enabled.
+        """
+        self._set_ready()
+        self.bot.leader_election = object()
+        self._receive(u'alice', b'!SET_TOPIC_TEMPLATE On duty: <name>', u'xmpp-id1')
+        self.assertEqual(1, len(self.replies), u"the command should reply.")
+        self.assertIn(u'HA enabled', self.replies[0], u"the change should be rejected.")
+
+    def test_question_forwarded(self):
+        """
+        Tests that the first question of a non-member is forwarded to the person-on-duty right away.
+        """
+        self._set_ready()
+        self._receive(u'carol', b'Is the build broken?', u'xmpp-id1')
+        self._receive(u'bob', b'Is it?', u'xmpp-id2')
+        self.clock.advance(0)
+        self.assertEqual([(u'id-alice', u"carol asked in room Room:\n[carol] Is the build broken?")],
+                         self.bot.hipchat_api.private_messages,
+                         u"only the question of the non-member should be forwarded.")
+
+    def test_question_digest(self):
+        """
+        Tests that the questions within the question interval are forwarded together once it ends.
+        """
+        self._set_ready()
+        self.mucbot.question_rely_interval = 10.0
+        self._receive(u'carol', b'first?', u'xmpp-id1')
+        self.clock.advance(0)
+        self._receive(u'carol', b'second?', u'xmpp-id2')
+        self.clock.advance(5.0)
+        self._receive(u'dave', b'third?', u'xmpp-id3')
+        self.assertEqual(1, len(self.bot.hipchat_api.private_messages),
+                         u"the questions should wait until the interval ends.")
+
+        self.clock.advance(5.0)
+        self.assertEqual((u'id-alice', u"2 questions were asked in room Room:\n[carol] second?\n[dave] third?"),
+                         self.bot.hipchat_api.private_messages[-1], u"the questions should be forwarded together.")
+
+        self.clock.advance(20.0)
+        self._receive(u'carol', b'fourth?', u'xmpp-id4')
+        self.clock.advance(0)
+        self.assertEqual(3, len(self.bot.hipchat_api.private_messages),
+                         u"a question after the interval should be forwarded right away.")
+
+    def test_question_digest_size(self):
+        """
+        Tests that the questions beyond the digest size are only counted.
+        """
+        self._set_ready()
+        self.mucbot.max_digest_questions = 2
+        self._receive(u'carol', b'first?', u'xmpp-id1')
+        self.clock.advance(0)
+        for i in range(4):
+            self._receive(u'carol', b'more %d?' % i, u'xmpp-id%d' % (i + 2))
+        self.assertEqual(2, len(self.mucbot._pending_questions), u"the pending questions should be capped.")
+
+        self.clock.advance(10.0)
+        self.assertEqual((u'id-alice', u"4 questions were asked in room Room:\n[carol] more 0?\n[carol] more 1?"
+                                       u"\n... and 2 more, see the room."),
+                         self.bot.hipchat_api.private_messages[-1], u"the skipped questions should be counted.")
+
+    def test_question_unknown_person(self):
+        """
+        Tests that the questions are dropped when the person-on-duty is unknown.
+        """
+        self._set_ready()
+        self.team.schedule.current_person = u'zed'
+        self._receive(u'carol', b'anyone?', u'xmpp-id1')
+        self.clock.advance(0)
+        self.assertEqual([], self.bot.hipchat_api.private_messages, u"nothing should be sent.")
+        self.assertEqual([], self.mucbot._pending_questions, u"the questions should not pile up.")
+
+
+class RoomJoinTest(unittest.TestCase):
+    """
+    Tests for joining the room again and the ConnectionMonitor.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.bot = FakeBot(self.clock)
+        self.team = FakeTeam(self.bot)
+        self.mucbot = HipchatBot(self.bot, self.team, u'conf.example.com', u'room', u'Room', u'Bot', 0,
+                                 [u'alice', u'bob'], clock=self.clock)
+        self.mucbot._join_backoff.jitter = 0.0
+        self.mucbot.xmlstream = object()
+        self.monitor = ConnectionMonitor(clock=self.clock)
+        self.monitor.xmlstream = object()
+        self.monitor.mucbots.append(self.mucbot)
+        self.mucbot.connection_monitor = self.monitor
+
+        # the joins wait until the test answers them
+        self.joins = []
+        self.mucbot.join = self._join
+
+    def _join(self, room_jid, nickname):
+        d = defer.Deferred()
+        self.joins.append(d)
+        return d
+
+    def _fail_join(self):
+        self.joins[-1].errback(Failure(error.TimeoutError()))
+
+    def test_rejoin_backoff(self):
+        """
+        Tests that a failed join is retried with an increasing delay.
+        """
+        self.mucbot._join_room()
+        self._fail_join()
+        self.assertEqual(1, len(self.joins), u"the join should be retried later.")
+        self.clock.advance(0.9)
+        self.assertEqual(1, len(self.joins), u"the first retry should be after 1 second.")
+        self.clock.advance(0.1)
+        self.assertEqual(2, len(self.joins), u"the join should be retried.")
+
+        self._fail_join()
+        self.clock.advance(1.9)
+        self.assertEqual(2, len(self.joins), u"the delay should grow.")
+        self.clock.advance(0.1)
+        self.assertEqual(3, len(self.joins), u"the join should be retried after 2 seconds.")
+
+        self.joins[-1].callback(None)
+        self.assertTrue(self.mucbot.connected, u"the room should be joined.")
+        self.assertEqual(0, self.mucbot._join_backoff.attempts, u"the backoff should be reset.")
+
+        # the next failure starts again at the initial delay
+        self.mucbot._join_room()
+        self._fail_join()
+        self.clock.advance(1.0)
+        self.assertEqual(5, len(self.joins), u"the join should be retried after 1 second again.")
+
+    def test_no_rejoin_when_disconnected(self):
+        """
+        Tests that a failed join is not retried when the connection is lost, the reconnection joins again.
+        """
+        self.mucbot._join_room()
+        self.mucbot.xmlstream = None
+        self._fail_join()
+        self.clock.advance(300.0)
+        self.assertEqual(1, len(self.joins), u"the join should not be retried.")
+
+    def test_recovery_metrics(self):
+        """
+        Tests that the ConnectionMonitor measures the time until the rooms are joined again.
+        """
+        self.monitor.connectionInitialized()
+        self.mucbot._join_room()
+        self.joins[-1].callback(None)
+        self.assertTrue(self.monitor.is_connected, u"all rooms should be joined.")
+        self.assertEqual(0, self.monitor.reconnect_count, u"the first join is not a recovery.")
+
+        self.clock.advance(100.0)
+        self.monitor.connectionLost(Failure(error.ConnectionLost()))
+        self.mucbot.connected = False
+        self.clock.advance(3.0)
+        self.monitor.connectionLost(Failure(error.ConnectionLost()))
+        stats = self.monitor.get_stats()
+        self.assertFalse(stats[u'connected'], u"the room should not be joined.")
+        self.assertEqual(2, stats[u'disconnect_count'], u"the disconnections should be counted.")
+        self.assertEqual(3.0, stats[u'disconnected_for'], u"the time should be counted from the first loss.")
+
+        self.clock.advance(4.0)
+        self.monitor.connectionInitialized()
+        self.mucbot._join_room()
+        self._fail_join()
+        self.clock.advance(1.0)
+        self.joins[-1].callback(None)
+        stats = self.monitor.get_stats()
+        self.assertTrue(stats[u'connected'], u"the room should be joined again.")
+        self.assertEqual(1, stats[u'reconnect_count'], u"the recovery should be counted.")
+        self.assertEqual(8.0, stats[u'last_recovery_time'], u"the recovery should last until the room is joined.")
+        self.assertEqual(8.0, stats[u'total_recovery_time'], u"the recovery times should be added up.")
+        self.assertEqual(0.0, stats[u'disconnected_for'], u"the bot should not be disconnected.")
@@ -0,0 +1,75 @@
+import unittest
+
+from twisted.internet import defer, task
+
+from bot.job_scheduler import JobScheduler
+
+
+class JobSchedulerTest(unittest.TestCase):
+    """
+    Tests for JobScheduler.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = JobScheduler(check_interval=60.0, jump_threshold=30.0, clock=self.clock)
+        self.runs = []
+
+    def _pump(self, seconds, step=1.0):
+        for _ in xrange(int(seconds / step)):
+            self.clock.advance(step)
+
+    def test_interval_and_cron_jobs(self):
+        """
+        Tests running interval and cron jobs with one timer.
+        """
+        self.scheduler.add_interval_job(u'fast', 30.0, self.runs.append, u'fast')
+        self.scheduler.add_cron_job(u'cron', u'*/10 * * * *', self.runs.append, u'cron')
+        self.scheduler.start()
+        self.assertEqual(1, len(self.clock.getDelayedCalls()), u"there should be only one timer.")
+
+        self._pump(600)
+        self.assertEqual(20, self.runs.count(u'fast'), u"the interval job should run every 30 seconds.")
+        self.assertEqual(1, self.runs.count(u'cron'), u"the cron job should run every 10 minutes.")
+        self.assertEqual(20, self.scheduler.get_job(u'fast').run_count, u"the run count mismatch.")
+
+    def test_cancel(self):
+        """
+        Tests cancelling a job.
+        """
+        job = self.scheduler.add_interval_job(u'job', 10.0, self.runs.append, u'job')
+        self.scheduler.start()
+        self._pump(10)
+        job.cancel()
+        self._pump(30)
+        self.assertEqual([u'job'], self.runs, u"a cancelled job should not run again.")
+        self.assertIsNone(self.scheduler.get_job(u'job'), u"a cancelled job should be removed.")
+        self.assertRaises(RuntimeError, self.scheduler.add_interval_job, u'job2', 0, self.runs.append)
+
+    def test_clock_jump(self):
+        """
+        Tests recalculating the job times when the clock jumps forward.
+        """
+        self.scheduler.add_interval_job(u'job', 100.0, self.runs.append, u'job')
+        self.scheduler.start()
+        self.clock.advance(1000)
+        self.assertEqual(1, self.scheduler.clock_jump_count, u"the clock jump should be detected.")
+        self.assertEqual([u'job'], self.runs, u"a missed job should only run once.")
+        self.assertEqual(1100, self.scheduler.get_job(u'job').next_time,
+                         u"the next run should be calculated from the new time.")
+
+    def test_running_job_and_errors(self):
+        """
+        Tests skipping a job that is still running, and counting errors.
+        """
+        pending = defer.Deferred()
+        job = self.scheduler.add_interval_job(u'slow', 10.0, lambda: pending)
+        failing_job = self.scheduler.add_interval_job(u'failing', 10.0, lambda: 1 / 0)
+        self.scheduler.start()
+        self._pump(20)
+        self.assertEqual((0, 1), (job.run_count, job.skip_count),
+                         u"the job should be skipped while it's still running.")
+        pending.callback(None)
+        self.assertEqual(1, job.run_count, u"the job should be counted when it finishes.")
+        self.assertEqual((2, 2), (failing_job.run_count, failing_job.error_count),
+                         u"the errors should be counted.")
@@ -0,0 +1,133 @@
+from ConfigParser import ConfigParser
+import unittest
+
+from twisted.internet import task
+from twisted.python.failure import Failure
+from twisted.web.error import Error
+
+from bot.extra.kv_client import KvClient
+
+
+class FakeBot(object):
+
+    def __init__(self):
+        self.config = ConfigParser()
+        self.config.add_section(u'team')
+        self.config.add_section(u'log')
+        self.save_count = 0
+
+    def apply_config_changes(self, changes):
+        for section, option, value in changes:
+            self.config.set(section, option, value)
+        return True
+
+    def save_config(self):
+        self.save_count += 1
+
+
+class FakeFactory(object):
+
+    def __init__(self, etag):
+        self.response_headers = {'etag': [etag]}
+
+
+class FakeReactor(task.Clock):
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.connections = []
+
+    def connectTCP(self, host, port, factory, timeout=30):
+        self.connections.append((host, port, factory))
+
+
+def close_connection(factory):
+    # the result is only delivered after the connection is closed
+    factory._disconnectedDeferred.callback(None)
+
+
+class KvClientTest(unittest.TestCase):
+    """
+    Tests for KvClient.
+    """
+
+    def setUp(self):
+        self.bot = FakeBot()
+        self.reactor = FakeReactor()
+        self.results = []
+        self.client = KvClient(self.bot, u'http://localhost:8080/kv', [], callback=self.results.append,
+                               reactor=self.reactor)
+        self.changes = []
+        self.client.add_listener(self.changes.append)
+
+    def test_apply_changed_keys(self):
+        """
+        Tests that only the changed keys are applied.
+        """
+        self.client._on_get_all_keys_success(b"HCBOT_TEAM_MEMBERS = a, b\nHCBOT_LOG_LEVEL = INFO\n",
+                                             FakeFactory('"v1"'))
+        self.assertEqual([[(u'log', u'level', u'INFO'), (u'team', u'members', u'a, b')]], self.changes,
+                         u"all keys should be applied the first time.")
+        self.assertEqual('"v1"', self.client._etag, u"the ETag should be kept.")
+
+        self.client._on_get_all_keys_success(b"HCBOT_TEAM_MEMBERS = a, b, c\nHCBOT_LOG_LEVEL = INFO\n",
+                                             FakeFactory('"v2"'))
+        self.assertEqual([(u'team', u'members', u'a, b, c')], self.changes[-1],
+                         u"only the changed key should be applied.")
+        self.assertEqual(2, self.bot.save_count, u"the config should be saved for each change.")
+
+        self.client._on_get_all_keys_success(b"HCBOT_TEAM_MEMBERS = a, b, c\nHCBOT_LOG_LEVEL = INFO\n",
+                                             FakeFactory('"v3"'))
+        self.assertEqual(2, len(self.changes), u"listeners should not be called without changes.")
+        self.assertEqual(2, self.bot.save_count, u"the config should not be saved without changes.")
+
+    def test_not_modified(self):
+        """
+        Tests handling a 304 response.
+        """
+        self.client._on_get_all_keys_failure(Failure(Error('304', 'Not Modified')))
+        self.assertEqual(1, self.client.not_modified_count, u"the 304 response should be counted.")
+        self.assertEqual([], self.changes, u"nothing should be changed.")
+
+    def test_conditional_request(self):
+        """
+        Tests that the validators of the last applied document are sent with the next request.
+        """
+        self.client.update_all_keys()
+        host, port, factory = self.reactor.connections[-1]
+        self.assertEqual(('localhost', 8080, '/kv'), (host, port, factory.path), u"the URL should be requested.")
+        self.assertIsNone(factory.headers.get('if-none-match'), u"the first request should not be conditional.")
+
+        factory.response_headers = {'etag': ['"v1"'], 'last-modified': ['Sat, 01 Oct 2016 09:00:00 GMT']}
+        factory.page(b"HCBOT_LOG_LEVEL = INFO\n")
+        close_connection(factory)
+        self.reactor.advance(0)
+        self.assertEqual([True], self.results, u"the update should succeed.")
+
+        self.client.update_all_keys()
+        factory = self.reactor.connections[-1][2]
+        self.assertEqual('"v1"', factory.headers.get('if-none-match'), u"the ETag should be sent.")
+        self.assertEqual('Sat, 01 Oct 2016 09:00:00 GMT', factory.headers.get('if-modified-since'),
+                         u"the modification time should be sent.")
+
+        factory.noPage(Failure(Error('304', 'Not Modified')))
+        close_connection(factory)
+        self.reactor.advance(0)
+        self.assertEqual([True, True], self.results, u"a 304 response should be a successful update.")
+        self.assertEqual(1, self.client.not_modified_count, u"the 304 response should be counted.")
+        self.assertEqual(1, len(self.changes), u"nothing should be changed by a 304 response.")
+
+    def test_invalid_body(self):
+        """
+        Tests that a body that can't be decoded fails the update without leaving it in progress.
+        """
+        self.client.update_all_keys()
+        factory = self.reactor.connections[-1][2]
+        factory.page(b"HCBOT_TEAM_MEMBERS = \xff\xfe\n")
+        close_connection(factory)
+        self.reactor.advance(0)
+        self.assertEqual([False], self.results, u"the update should fail.")
+        self.assertEqual([], self.changes, u"nothing should be changed.")
+
+        self.client.update_all_keys()
+        self.assertEqual(2, len(self.reactor.connections), u"the next update should be started.")
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import defer, task
+
+from bot.leader import LeaderElection
+from bot.storage import write_file_utf8
+
+
+class FakeStorage(object):
+
+    def write(self, file_path, data):
+        write_file_utf8(file_path, data)
+        return defer.succeed(None)
+
+
+class LeaderElectionTest(unittest.TestCase):
+    """
+    Tests for LeaderElection.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.clock = task.Clock()
+        self.lock_file = os.path.join(self.temp_dir, u'leader.lock')
+        self.changes = []
+        self.first = self._make_election(u'first')
+        self.second = self._make_election(u'second')
+
+    def tearDown(self):
+        self.first.stop()
+        self.second.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def _make_election(self, instance_id):
+        election = LeaderElection(FakeStorage(), self.lock_file, instance_id, lease=15.0, heartbeat_interval=5.0,
+                                  clock=self.clock)
+        election.add_listener(lambda is_leader: self.changes.append((instance_id, is_leader)))
+        return election
+
+    def test_one_leader(self):
+        """
+        Tests that only one instance is elected.
+        """
+        self.first.start()
+        self.second.start()
+        self.assertTrue(self.first.is_leader, u"the first instance should be the leader.")
+        self.assertFalse(self.second.is_leader, u"the second instance should be a standby.")
+        self.assertEqual([], self.changes, u"the listeners should not be called for the initial role.")
+
+        self.clock.advance(5.0)
+        self.assertTrue(self.first.is_leader, u"the leader should renew its lease.")
+        self.assertFalse(self.second.is_leader, u"the standby should not get the lock.")
+        self.assertEqual(u'first', self.second.get_stats()[u'leader'],
+                         u"the standby should know the leader from the lease file.")
+        with open(self.first.lease_file, 'rb') as f:
+            lease = json.loads(f.read())
+        self.assertEqual(self.clock.seconds() + 15.0, lease[u'expires'], u"the lease should be renewed.")
+
+    def test_failover(self):
+        """
+        Tests that a standby takes over when the leader stops.
+        """
+        self.first.start()
+        self.second.start()
+        self.first.stop()
+        self.assertEqual([(u'first', False)], self.changes, u"the leader should give up the leadership.")
+
+        self.clock.advance(5.0)
+        self.assertTrue(self.second.is_leader, u"the standby should take over at its next heartbeat.")
+        self.assertEqual([(u'first', False), (u'second', True)], self.changes,
+                         u"the listeners should be notified.")
+
+    def test_stalled_reactor(self):
+        """
+        Tests that the leader stays the leader when its heartbeat is late.
+        """
+        self.first.start()
+        self.second.start()
+        # the reactor is blocked longer than the lease
+        self.clock.rightNow += 20.0
+        self.assertTrue(self.first.is_leader, u"the leader should keep the leadership while it holds the lock.")
+        self.clock.advance(0)
+        self.assertTrue(self.first.is_leader, u"the late heartbeat should renew the lease.")
+        self.assertFalse(self.second.is_leader, u"the standby should not get the lock.")
+        self.assertEqual([], self.changes, u"the roles should not change.")
+        self.assertEqual(self.clock.seconds() + 15.0, self.first.get_stats()[u'lease_expires'],
+                         u"the lease should be renewed.")
+
+    def test_lock_file_replaced(self):
+        """
+        Tests that the leader steps down when its lock file has been removed.
+        """
+        self.first.start()
+        os.remove(self.lock_file)
+        self.second.start()
+        self.assertTrue(self.second.is_leader, u"the second instance should lock the new lock file.")
+
+        self.clock.advance(5.0)
+        self.assertFalse(self.first.is_leader, u"the first instance should give up the removed lock file.")
+        self.assertIn((u'first', False), self.changes, u"the listeners should be notified.")
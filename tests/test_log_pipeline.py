@@ -0,0 +1,99 @@
+from Queue import Queue
+from StringIO import StringIO
+import logging
+import unittest
+
+from bot.util.log_pipeline import QueueHandler, QueueListener, RedactingFilter, parse_log_levels, redact
+
+
+class LogPipelineTest(unittest.TestCase):
+    """
+    Tests for the logging pipeline.
+    """
+
+    def test_redact(self):
+        """
+        Tests redact().
+        """
+        self.assertEqual(u"https://api/v2/room?auth_token=<redacted>&max-results=10",
+                         redact(u"https://api/v2/room?auth_token=0123abcd&max-results=10"),
+                         u"the auth token in a URL should be redacted.")
+        self.assertEqual(u"Authorization: Bearer <redacted>", redact(u"Authorization: Bearer 0123abcd"),
+                         u"the bearer token should be redacted.")
+        self.assertEqual(u"nothing secret", redact(u"nothing secret"),
+                         u"other text should not be changed.")
+
+    def test_parse_log_levels(self):
+        """
+        Tests parse_log_levels().
+        """
+        self.assertEqual([(u'HipChatApi', logging.WARNING), (u'XmppTraffic', logging.DEBUG)],
+                         parse_log_levels(u"HipChatApi:WARNING, XmppTraffic:debug,"),
+                         u"the levels should be parsed.")
+        self.assertEqual([], parse_log_levels(u""), u"an empty string should give no levels.")
+        self.assertRaises(RuntimeError, parse_log_levels, u"HipChatApi")
+        self.assertRaises(RuntimeError, parse_log_levels, u"HipChatApi:LOUD")
+
+    def test_queue_listener(self):
+        """
+        Tests writing records through the queue with the listener thread.
+        """
+        stream = StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(logging.Formatter(u'%(name)s %(message)s'))
+        stream_handler.addFilter(RedactingFilter())
+
+        queue = Queue(2)
+        queue_handler = QueueHandler(queue)
+        logger = logging.getLogger(u'LogPipelineTest')
+        logger.propagate = False
+        logger.addHandler(queue_handler)
+        try:
+            logger.warning(u"sending request to %s", u"url?auth_token=secret")
+            logger.warning(u"second")
+            logger.warning(u"dropped")
+            self.assertEqual(1, queue_handler.dropped_count, u"a record should be dropped when the queue is full.")
+
+            listener = QueueListener(queue, [stream_handler])
+            listener.start()
+            listener.stop()
+        finally:
+            logger.removeHandler(queue_handler)
+
+        self.assertEqual(u"LogPipelineTest sending request to url?auth_token=<redacted>\nLogPipelineTest second\n",
+                         stream.getvalue(), u"the records should be written in order and redacted.")
+
+    def test_prepare(self):
+        """
+        Tests that the message and the exception are rendered when the record is queued.
+        """
+        queue = Queue()
+        queue_handler = QueueHandler(queue)
+        logger = logging.getLogger(u'LogPipelineTest')
+        logger.propagate = False
+        logger.addHandler(queue_handler)
+        try:
+            members = [u'alice']
+            logger.warning(u"members: %s", members)
+            members.append(u'bob')
+            try:
+                raise ValueError(u"bad value")
+            except ValueError:
+                logger.exception(u"failed")
+        finally:
+            logger.removeHandler(queue_handler)
+
+        record = queue.get_nowait()
+        self.assertEqual(u"members: [u'alice']", record.getMessage(),
+                         u"the message should be rendered with the arguments at the time of the call.")
+        self.assertIsNone(record.args, u"the arguments should be dropped.")
+
+        stream = StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(logging.Formatter(u'%(levelname)s %(message)s'))
+        record = queue.get_nowait()
+        self.assertIsNone(record.exc_info, u"the traceback should be dropped.")
+        stream_handler.handle(record)
+        output = stream.getvalue()
+        self.assertTrue(output.startswith(u"ERROR failed\nTraceback"), u"the exception should be in the message.")
+        self.assertEqual(1, output.count(u"ValueError: bad value"), u"the exception should be written once.")
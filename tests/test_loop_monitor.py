@@ -0,0 +1,76 @@
+import unittest
+
+from twisted.internet import task
+
+from bot.loop_monitor import LoopLagMonitor, get_percentile
+
+
+class LoopLagMonitorTest(unittest.TestCase):
+    """
+    Tests for LoopLagMonitor.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.monitor = LoopLagMonitor(interval=0.5, slow_threshold=0.25, clock=self.clock, use_watchdog=False)
+        self.monitor.start()
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def test_get_percentile(self):
+        """
+        Tests get_percentile().
+        """
+        values = [0.1, 0.2, 0.3, 0.4]
+        self.assertEqual(0.2, get_percentile(values, 50), u"the median should be the 2nd value.")
+        self.assertEqual(0.4, get_percentile(values, 99), u"the 99th percentile should be the largest value.")
+        self.assertIsNone(get_percentile([], 50), u"there is no percentile without values.")
+
+    def test_lag(self):
+        """
+        Tests measuring the lag of the ticks.
+        """
+        for _ in xrange(9):
+            self.clock.advance(0.5)
+        # the reactor is blocked by a slow callback
+        self.clock.advance(1.5)
+
+        stats = self.monitor.get_stats()
+        self.assertEqual(10, stats[u'ticks'], u"every tick should be measured.")
+        self.assertEqual(1, stats[u'slow_count'], u"the blocked tick should be counted as slow.")
+        self.assertEqual(1.0, stats[u'max_lag'], u"the lag should be the delay after the expected time.")
+        self.assertEqual(0.0, stats[u'p50'], u"most ticks should be on time.")
+
+    def test_call_site(self):
+        """
+        Tests capturing the stack of the blocked reactor thread.
+        """
+        # block the "reactor" without running the scheduled calls
+        self.clock.rightNow += 1.0
+        self.monitor.check_stall()
+        self.clock.advance(0)
+
+        call_site = self.monitor.get_stats()[u'recent_slow_calls'][0][u'call_site']
+        self.assertIn(u'test_call_site', call_site, u"the blocking function should be in the call site.")
+
+    def test_stall_reset(self):
+        """
+        Tests that a stall is not captured again when the watchdog checks while the next tick is scheduled.
+        """
+        schedule = self.monitor._schedule
+
+        def schedule_with_watchdog(current_time):
+            # the watchdog thread runs just before the next expected time is set
+            self.monitor.check_stall()
+            schedule(current_time)
+        self.monitor._schedule = schedule_with_watchdog
+
+        self.clock.rightNow += 1.0
+        self.monitor.check_stall()
+        self.clock.advance(0)
+        self.assertEqual(1, self.monitor.get_stats()[u'slow_count'], u"the stall should be counted.")
+        self.assertIsNone(self.monitor._stall_stack, u"the captured stack should be cleared after the tick.")
+
+        self.clock.advance(0.5)
+        self.assertEqual(1, self.monitor.get_stats()[u'slow_count'], u"the next tick should be on time.")
@@ -0,0 +1,68 @@
+import unittest
+
+from bot.util.member_index import MemberNameIndex
+
+
+class MemberNameIndexTest(unittest.TestCase):
+    """
+    Tests for MemberNameIndex.
+    """
+
+    def test_find(self):
+        """
+        Tests finding members by name prefixes.
+        """
+        index = MemberNameIndex([u'Alice Smith', u'Alan Turing', u'Bob'])
+
+        self.assertEqual([u'Alan Turing', u'Alice Smith'], index.find(u'al'),
+                         u"'al' should match both Alan and Alice.")
+        self.assertEqual([u'Alice Smith'], index.find(u'ALI'),
+                         u"'ALI' should only match Alice.")
+        self.assertEqual([], index.find(u'charley'),
+                         u"'charley' should not match anyone.")
+
+    def test_mention_names(self):
+        """
+        Tests finding members by mention names.
+        """
+        index = MemberNameIndex([u'Alice Smith', u'Bob'])
+        index.set_mention_name(u'Alice Smith', u'asmith')
+        index.set_mention_name(u'Charley', u'charley')
+
+        self.assertEqual([u'Alice Smith'], index.find(u'asm'),
+                         u"'asm' should match Alice's mention name.")
+        self.assertEqual([], index.find(u'charley'),
+                         u"non-members should not be indexed.")
+
+        # changing the mention name removes the old one
+        index.set_mention_name(u'Alice Smith', u'alice')
+        self.assertEqual([], index.find(u'asm'),
+                         u"the old mention name should be removed.")
+        self.assertEqual([u'Alice Smith'], index.find(u'alice'),
+                         u"'alice' should match Alice.")
+
+    def test_resolve_exact_match(self):
+        """
+        Tests that exact matches take precedence over prefix matches.
+        """
+        index = MemberNameIndex([u'Bob', u'Bobby'])
+
+        self.assertEqual([u'Bob'], index.resolve(u'bob'),
+                         u"'bob' should resolve to Bob only.")
+        self.assertEqual([u'Bob', u'Bobby'], index.resolve(u'bo'),
+                         u"'bo' should be ambiguous.")
+
+    def test_set_members(self):
+        """
+        Tests updating the member list.
+        """
+        index = MemberNameIndex([u'Alice', u'Bob'])
+        index.set_mention_name(u'Alice', u'ali')
+        index.set_members([u'Alice', u'Charley'])
+
+        self.assertEqual([u'Alice', u'Charley'], index.members,
+                         u"the members should be updated.")
+        self.assertEqual([], index.find(u'b'),
+                         u"Bob should be removed.")
+        self.assertEqual(u'ali', index.get_mention_name(u'Alice'),
+                         u"Alice's mention name should be kept.")
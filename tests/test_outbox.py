@@ -0,0 +1,84 @@
+import unittest
+
+from twisted.internet import task
+
+from bot.outbox import MessageOutbox, merge_messages
+
+
+class MessageOutboxTest(unittest.TestCase):
+    """
+    Tests for MessageOutbox.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.outbox = MessageOutbox(lambda room, msg: self.sent.append((room, msg)),
+                                    send_interval=1.0, merge_window=0.5, max_size=2, clock=self.clock)
+
+    def test_merge_messages(self):
+        """
+        Tests merge_messages().
+        """
+        self.assertEqual(u"/code > a\n> b", merge_messages(u"/code > a", u"/code > b"),
+                         u"two code messages should be merged.")
+        self.assertEqual(u"a\nb", merge_messages(u"a", u"b"),
+                         u"two normal messages should be merged.")
+        self.assertIsNone(merge_messages(u"/code > a", u"b"),
+                          u"a code message and a normal message should not be merged.")
+
+    def test_merge_within_window(self):
+        """
+        Tests merging consecutive messages to the same room.
+        """
+        self.outbox.put(u'room1', u"/code > a")
+        self.clock.advance(0.2)
+        self.outbox.put(u'room1', u"/code > b")
+        self.outbox.put(u'room2', u"/code > c")
+        self.clock.advance(0.3)
+
+        self.assertEqual([(u'room1', u"/code > a\n> b")], self.sent,
+                         u"the first two messages should be merged and sent.")
+        self.clock.advance(1.0)
+        self.assertEqual((u'room2', u"/code > c"), self.sent[-1],
+                         u"the message to room2 should be sent separately.")
+        self.assertEqual({u'sent': 2, u'merged': 1, u'dropped': 0, u'queued': 0}, self.outbox.get_stats(),
+                         u"statistics mismatch.")
+
+    def test_rate_limit_and_drop(self):
+        """
+        Tests the send rate and dropping messages when the queue is full.
+        """
+        self.outbox.put(u'room1', u"a")
+        self.outbox.put(u'room2', u"b")
+        self.outbox.put(u'room1', u"c")
+
+        self.assertEqual(1, self.outbox.get_stats()[u'dropped'],
+                         u"the oldest message should be dropped.")
+        self.clock.advance(0.5)
+        self.assertEqual([(u'room2', u"b")], self.sent,
+                         u"only one message should be sent.")
+        self.clock.advance(0.5)
+        self.assertEqual(1, len(self.sent),
+                         u"the next message should wait for the send interval.")
+        self.clock.advance(0.5)
+        self.assertEqual((u'room1', u"c"), self.sent[-1],
+                         u"the next message should be sent after the send interval.")
+
+    def test_pause_resume(self):
+        """
+        Tests holding messages while paused and flushing them in order after resuming.
+        """
+        self.outbox.pause()
+        self.outbox.put(u'room1', u"a")
+        self.clock.advance(1.0)
+        self.outbox.put(u'room2', u"b")
+        self.clock.advance(10.0)
+        self.assertEqual([], self.sent,
+                         u"nothing should be sent while paused.")
+
+        self.outbox.resume()
+        self.clock.advance(0.0)
+        self.clock.advance(1.0)
+        self.assertEqual([(u'room1', u"a"), (u'room2', u"b")], self.sent,
+                         u"the messages should be sent in order after resuming.")
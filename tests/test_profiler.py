@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bot.profiler import Profiler
+
+
+class FakeStorage(object):
+
+    def run(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+
+def busy_function(n):
+    return sum(i * i for i in xrange(n))
+
+
+class ProfilerTest(unittest.TestCase):
+    """
+    Tests for Profiler.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.profiler = Profiler(FakeStorage(), os.path.join(self.temp_dir, u'profiles'), top_n=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_inactive(self):
+        """
+        Tests that calls are not profiled without a session.
+        """
+        self.assertEqual(5, self.profiler.call(u'job', busy_function, 3), u"the result should be returned.")
+        self.assertIsNone(self.profiler.stop(), u"there should be no session to stop.")
+
+    def test_session(self):
+        """
+        Tests profiling nested calls and writing the profile and the summary.
+        """
+        self.assertIsNotNone(self.profiler.start(), u"the session should be started.")
+        self.assertIsNone(self.profiler.start(), u"only one session should run at a time.")
+
+        wrapped = self.profiler.wrap(u'command !SLOW', busy_function)
+        self.profiler.call(u'groupchat', wrapped, 1000)
+        self.profiler.call(u'groupchat', busy_function, 10)
+
+        profile_file, summary_file = self.profiler.stop()
+        self.assertFalse(self.profiler.is_active, u"the session should be stopped.")
+        self.assertTrue(os.path.isfile(profile_file), u"the profile should be written.")
+        with open(summary_file) as f:
+            summary = f.read()
+        self.assertIn(u'groupchat', summary, u"the labels should be in the summary.")
+        self.assertIn(u'command !SLOW', summary, u"the nested label should be in the summary.")
+        self.assertIn(u'busy_function', summary, u"the profiled functions should be in the summary.")
@@ -0,0 +1,50 @@
+import unittest
+
+from bot.util.rate_limiter import CommandRateLimiter
+
+
+class CommandRateLimiterTest(unittest.TestCase):
+    """
+    Tests for CommandRateLimiter.
+    """
+
+    def setUp(self):
+        self.current_time = 1000.0
+
+    def _time(self):
+        return self.current_time
+
+    def test_user_limit(self):
+        """
+        Tests the per-user limit and that a rejection is only reported once.
+        """
+        limiter = CommandRateLimiter(6, 2, 0, 0, time_func=self._time)
+
+        self.assertEqual((True, None), limiter.check(u'alice', u'!IM_OFF'), u"1st command should be allowed.")
+        self.assertEqual((True, None), limiter.check(u'alice', u'!IM_OFF'), u"2nd command should be allowed.")
+        self.assertEqual((False, u'user'), limiter.check(u'alice', u'!IM_OFF'),
+                         u"3rd command should be rejected and reported.")
+        self.assertEqual((False, None), limiter.check(u'alice', u'!SHOW_POD'),
+                         u"4th command should be rejected silently.")
+        self.assertEqual((True, None), limiter.check(u'bob', u'!IM_OFF'),
+                         u"bob should not be limited.")
+
+        # 6 commands per minute: one token every 10 seconds
+        self.current_time += 10.0
+        self.assertEqual((True, None), limiter.check(u'alice', u'!IM_OFF'),
+                         u"a command should be allowed after refilling.")
+        self.assertEqual((False, u'user'), limiter.check(u'alice', u'!IM_OFF'),
+                         u"the rejection should be reported again.")
+        self.assertEqual(3, limiter.rejected_count, u"3 commands should be rejected.")
+
+    def test_command_limit(self):
+        """
+        Tests the per-command limit.
+        """
+        limiter = CommandRateLimiter(0, 0, 60, 1, time_func=self._time)
+
+        self.assertEqual((True, None), limiter.check(u'alice', u'!NEXT_POD'), u"1st command should be allowed.")
+        self.assertEqual((False, u'command'), limiter.check(u'bob', u'!NEXT_POD'),
+                         u"!NEXT_POD should be limited for everyone.")
+        self.assertEqual((True, None), limiter.check(u'bob', u'!SHOW_POD'),
+                         u"other commands should not be limited.")
@@ -0,0 +1,200 @@
+import unittest
+
+from twisted.internet import task
+
+from bot.replay import CommandReplayer, parse_message_time
+
+
+class FakeTeam(object):
+
+    def __init__(self):
+        self.section = u'team'
+        self.room_name = u'room'
+        self.state = {u'schedule': {}, u'history': {}}
+        self.save_count = 0
+
+    def save_state(self):
+        self.save_count += 1
+
+
+class FakeHipChatApi(object):
+
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+        # if True, the response is only given by respond()
+        self.hold = False
+        self._callback = None
+
+    def view_room_history(self, room_name, max_results=100, not_before=None, callback=None, **kwargs):
+        self.requests.append((room_name, max_results, not_before))
+        self._callback = callback
+        if not self.hold:
+            self.respond()
+
+    def respond(self):
+        self._callback({u'items': self.items})
+
+
+class FakeCommands(object):
+
+    def __init__(self):
+        self.dispatched = []
+
+    def dispatch(self, room, user_nick, msg):
+        self.dispatched.append((user_nick, msg))
+        return True
+
+
+class FakeBot(object):
+    is_leader = True
+
+
+class FakeMucBot(object):
+
+    def __init__(self, items):
+        self.nickname = u'Bot'
+        self.team = FakeTeam()
+        self.bot = FakeBot()
+        self.bot.hipchat_api = FakeHipChatApi(items)
+        self.commands = FakeCommands()
+
+
+def make_item(message_id, date, name, message):
+    return {u'id': message_id, u'date': date, u'from': {u'name': name}, u'message': message}
+
+
+class CommandReplayerTest(unittest.TestCase):
+    """
+    Tests for CommandReplayer.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        items = [make_item(u'id1', u'2016-10-01T09:00:00+00:00', u'Alice', u'!SHOW_POD'),
+                 make_item(u'id2', u'2016-10-01T09:01:00+00:00', u'Alice', u'!SHOW_DAYS'),
+                 make_item(u'id3', u'2016-10-01T09:02:00+00:00', u'Bob', u'hello'),
+                 make_item(u'id4', u'2016-10-01T09:03:00+00:00', u'Bot', u'!NEXT_POD'),
+                 {u'id': u'id5', u'date': u'2016-10-01T09:04:00+00:00', u'from': u'bot', u'message': u'!HELP'},
+                 make_item(u'id6', u'2016-10-01T09:05:00+00:00', u'Bob', u'!SHOW_NEXT_POD'),
+                 ]
+        self.mucbot = FakeMucBot(items)
+        # the room is joined after the messages have been sent
+        self.clock.advance(parse_message_time(u'2016-10-01T09:10:00+00:00'))
+        self.replayer = CommandReplayer(self.mucbot, max_messages=10, clock=self.clock)
+
+    def test_parse_message_time(self):
+        """
+        Tests parse_message_time().
+        """
+        self.assertEqual(1475312400.5, parse_message_time(u'2016-10-01T11:00:00.5+02:00'),
+                         u"the time should be converted to a UTC timestamp.")
+
+    def test_replay(self):
+        """
+        Tests replaying the missed commands.
+        """
+        self.replayer.replay()
+        self.assertEqual([], self.mucbot.bot.hipchat_api.requests,
+                         u"nothing should be replayed without a processed message.")
+
+        self.replayer.record(u'id1', parse_message_time(u'2016-10-01T09:00:00+00:00'))
+        self.replayer.replay()
+        self.assertEqual([(u'room', 10, u'id1')], self.mucbot.bot.hipchat_api.requests,
+                         u"the history since the last message should be requested.")
+        self.assertEqual([(u'Alice', u'!SHOW_DAYS'), (u'Bob', u'!SHOW_NEXT_POD')], self.mucbot.commands.dispatched,
+                         u"only the missed commands from other users should be replayed.")
+        self.assertEqual(u'id6', self.replayer.last_message_id,
+                         u"the last message ID should be updated.")
+
+        self.replayer.replay()
+        self.assertEqual(2, len(self.mucbot.commands.dispatched),
+                         u"the commands should only be replayed once.")
+
+    def test_live_message_during_replay(self):
+        """
+        Tests that a live message that arrives while the history is being fetched is not replayed.
+        """
+        api = self.mucbot.bot.hipchat_api
+        api.hold = True
+        self.replayer.record(u'id1', parse_message_time(u'2016-10-01T09:00:00+00:00'))
+        self.replayer.replay()
+
+        # the live message has an XMPP ID, the history has another ID for it
+        self.clock.advance(60)
+        self.replayer.record(u'xmpp-id7', self.clock.seconds())
+        api.items.append(make_item(u'id7', u'2016-10-01T09:11:00+00:00', u'Carol', u'!SHOW_POD'))
+        api.respond()
+        self.assertEqual([(u'Alice', u'!SHOW_DAYS'), (u'Bob', u'!SHOW_NEXT_POD')], self.mucbot.commands.dispatched,
+                         u"the live message should not be replayed.")
+
+    def test_save(self):
+        """
+        Tests saving the last processed message with a delay.
+        """
+        self.replayer.record(u'id1', 100.0)
+        self.replayer.record(u'id2', 101.0)
+        self.assertEqual(0, self.mucbot.team.save_count, u"the state should not be saved right away.")
+        self.clock.advance(self.replayer.save_delay)
+        self.assertEqual(1, self.mucbot.team.save_count, u"the state should be saved once.")
+
+        replayer = CommandReplayer(self.mucbot, clock=self.clock)
+        self.assertEqual((u'id2', 101.0), (replayer.last_message_id, replayer.last_message_time),
+                         u"the last processed message should be loaded from the state.")
+
+    def test_flush(self):
+        """
+        Tests saving the last processed message before the delay has passed.
+        """
+        self.replayer.record(u'id1', 100.0)
+        self.replayer.flush()
+        self.assertEqual(1, self.mucbot.team.save_count, u"the state should be saved right away.")
+        self.clock.advance(self.replayer.save_delay)
+        self.assertEqual(1, self.mucbot.team.save_count, u"the state should not be saved again.")
+
+        replayer = CommandReplayer(self.mucbot, save_delay=0, clock=self.clock)
+        replayer.record(u'id2', 101.0)
+        self.assertEqual(2, self.mucbot.team.save_count, u"the state should be saved without a delay.")
+
+    def test_takeover(self):
+        """
+        Tests that a new leader only skips the messages the previous leader has handled.
+        """
+        self.mucbot.team.state[u'history'] = {u'last_message_id': u'id1',
+                                              u'last_message_time': parse_message_time(u'2016-10-01T09:01:00+00:00')}
+        # the standby has seen the messages, the leader stopped after handling id2
+        for item in self.mucbot.bot.hipchat_api.items:
+            self.replayer.record(item[u'id'], parse_message_time(item[u'date']))
+        self.replayer.reload_state()
+        self.replayer.replay()
+        self.assertEqual([(u'Bob', u'!SHOW_NEXT_POD')], self.mucbot.commands.dispatched,
+                         u"the command after the last handled message should be replayed.")
+
+    def test_skewed_clock(self):
+        """
+        Tests that a live command is not replayed when the server's clock is ahead of the local clock.
+        """
+        self.replayer.record(u'id1', parse_message_time(u'2016-10-01T09:00:00+00:00'))
+        # the server dates the live message 2 seconds later than it's received
+        self.replayer.record_live(u'xmpp-id7', u'Carol', u'!NEXT_POD', self.clock.seconds())
+        self.replayer.flush()
+        api = self.mucbot.bot.hipchat_api
+        api.items.append(make_item(u'id7', u'2016-10-01T09:10:02+00:00', u'Carol', u'!NEXT_POD'))
+
+        # the bot is restarted
+        self.clock.advance(60)
+        replayer = CommandReplayer(self.mucbot, max_messages=10, clock=self.clock)
+        replayer.replay()
+        self.assertEqual([], self.mucbot.commands.dispatched, u"the live command should not be replayed.")
+        self.assertEqual(2.0, replayer.clock_offset, u"the clock offset should be learned from the live command.")
+        self.assertEqual((u'id7', parse_message_time(u'2016-10-01T09:10:02+00:00')),
+                         (replayer.last_message_id, replayer.last_message_time),
+                         u"the last processed message should be the history item of the live command.")
+
+        # the next live messages are dated with the server's clock
+        replayer.record_live(u'xmpp-id8', u'Carol', u'!SHOW_POD', self.clock.seconds())
+        self.assertEqual(parse_message_time(u'2016-10-01T09:11:02+00:00'), replayer.last_message_time,
+                         u"the live message should be dated with the server's clock.")
+        api.items.append(make_item(u'id8', u'2016-10-01T09:11:02+00:00', u'Carol', u'!SHOW_POD'))
+        replayer.replay()
+        self.assertEqual([], self.mucbot.commands.dispatched, u"the next live command should not be replayed.")
@@ -0,0 +1,231 @@
+import datetime
+import time
+import unittest
+
+from twisted.internet import task
+
+from bot.config_events import ConfigEventBus
+from bot.schedule import Schedule
+from bot.status_server import StatusCache
+from bot.util.closure_calendar import ClosureCalendar, ClosureEvent, ClosureIndex
+from bot.util.config import init_config
+from bot.util.daysoff_parser import DaysOffParser
+from bot.util.settings import build_settings
+
+
+class FakeUserDb(object):
+
+    def get_user_data(self, name):
+        return
+
+    def add_user_listener(self, callback):
+        pass
+
+
+class FakeHipChatApi(object):
+
+    def __init__(self):
+        self.topics = []
+        self.notifications = []
+
+    def set_room_topic(self, room_name, topic):
+        self.topics.append(topic)
+
+    def send_room_notification(self, room_name, sender, msg, **kwargs):
+        self.notifications.append(msg)
+
+
+class FakeJob(object):
+
+    def __init__(self, cron_expr):
+        self.cron_expr = cron_expr
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeJobScheduler(object):
+
+    def add_cron_job(self, name, cron_expr, func):
+        return FakeJob(cron_expr)
+
+
+class FakeTeam(object):
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.section = u'team'
+        self.room_name = u'room'
+        self.members = [u'alice', u'bob', u'carol']
+        self.days_off_parser = DaysOffParser()
+        self.state = {u'schedule': {}, u'history': {}}
+        self.save_count = 0
+
+    @property
+    def settings(self):
+        return self.bot.settings.get_team(self.section)
+
+    def save_state(self):
+        self.save_count += 1
+
+
+class FakeBot(object):
+
+    def __init__(self):
+        self.config = init_config(u'non-existing-config.ini')
+        self.config.set(u'team', u'members', u'alice, bob, carol')
+        self.config.set(u'team', u'topic_update_time', u'0 9 * * MON-FRI')
+        self.config.set(u'team', u'topic_template', u'On duty: <name>')
+        self.settings = build_settings(self.config)
+        self.hipchat_db = FakeUserDb()
+        self.hipchat_api = FakeHipChatApi()
+        self.config_events = ConfigEventBus()
+        self.status_cache = StatusCache()
+        self.job_scheduler = FakeJobScheduler()
+        self.is_leader = True
+
+
+class ScheduleTest(unittest.TestCase):
+    """
+    Tests for Schedule.
+    """
+
+    def setUp(self):
+        self.bot = FakeBot()
+        self.team = FakeTeam(self.bot)
+        # Wednesday noon, local time like the rotation time
+        self.today = datetime.date(2016, 10, 5)
+        self.clock = task.Clock()
+        self.clock.advance(time.mktime(self.today.timetuple()) + 12 * 3600)
+
+    def test_first_start(self):
+        """
+        Tests that nothing is caught up on the first start.
+        """
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self.assertEqual(0, schedule.catch_up(), u"nothing should be caught up on the first start.")
+        self.assertIsNotNone(self.team.state[u'schedule'][u'last_rotation'],
+                             u"the last rotation time should be saved.")
+
+    def test_catch_up(self):
+        """
+        Tests applying the missed rotations in one batch.
+        """
+        self.team.state[u'schedule'] = {u'current_person': u'alice',
+                                        u'last_rotation': self.clock.seconds() - 7 * 24 * 3600}
+        # carol is never available on the missed dates
+        self.team.days_off_parser.add(u'carol', [u'MON', u'TUE', u'WED', u'THU', u'FRI'])
+
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self.assertEqual(5, schedule.catch_up(), u"the rotations of 5 workdays should be caught up.")
+        self.assertEqual((u'bob', 1), schedule.get_current_person(),
+                         u"alice and bob should take turns while carol is skipped.")
+        self.assertEqual([u'On duty: bob'], self.bot.hipchat_api.topics, u"the topic should be set once.")
+        self.assertEqual(1, len(self.bot.hipchat_api.notifications), u"only one notification should be sent.")
+        self.assertEqual(0, schedule.catch_up(), u"the rotations should only be caught up once.")
+
+    def test_catch_up_closures(self):
+        """
+        Tests that the missed rotations on closure days are skipped.
+        """
+        self.team.state[u'schedule'] = {u'current_person': u'alice',
+                                        u'last_rotation': self.clock.seconds() - 7 * 24 * 3600}
+        calendar = ClosureCalendar()
+        calendar.add_event(ClosureEvent(u'Holiday', self.today - datetime.timedelta(days=7), 8))
+
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        schedule.set_closure_index(ClosureIndex(calendar))
+        self.assertEqual(0, schedule.catch_up(), u"no rotations should be applied on closure days.")
+        self.assertEqual((u'alice', 0), schedule.get_current_person(), u"the current person should not change.")
+        self.assertEqual([], self.bot.hipchat_api.topics, u"the topic should not be changed.")
+
+    def test_forecast(self):
+        """
+        Tests forecasting the coming rotations.
+        """
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        calendar = ClosureCalendar()
+        calendar.add_event(ClosureEvent(u'Holiday', self.today + datetime.timedelta(days=1), 7))
+        schedule.set_closure_index(ClosureIndex(calendar))
+
+        forecast = schedule.get_forecast(days=14)
+        people = [person for _, person, closure in forecast if closure is None]
+        self.assertTrue(all(person is None for _, person, closure in forecast if closure is not None),
+                        u"nobody should be on duty on the closure days.")
+        self.assertEqual([u'bob', u'carol', u'alice'], people[:3], u"the members should take turns.")
+        self.assertEqual((u'alice', 0), schedule.get_current_person(), u"the forecast should not switch.")
+
+    def test_position_by_name(self):
+        """
+        Tests that the rotation position is kept by name when the members change.
+        """
+        self.team.state[u'schedule'] = {u'current_person': u'bob', u'current_idx': 1}
+        self.team.members = [u'dave', u'carol', u'bob', u'alice']
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self.assertEqual((u'bob', 2), schedule.get_current_person(),
+                         u"the current person should not change when the members are reordered.")
+
+        self.team.members = [u'alice', u'carol', u'dave']
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self.assertEqual((u'carol', 1), schedule.get_current_person(),
+                         u"the position should be kept when the current person is removed.")
+
+    def test_members_changed(self):
+        """
+        Tests changing the team members through the config events.
+        """
+        self.team.state[u'schedule'] = {u'current_person': u'bob'}
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self.team.members = [u'carol', u'bob', u'dave']
+        self.bot.config_events.publish([(u'team', u'members', u'carol, bob, dave')])
+
+        self.assertEqual((u'bob', 1), schedule.get_current_person(),
+                         u"the current person should be kept.")
+        self.assertEqual([u'dave'], schedule.member_index.find(u'da'), u"the new member should be indexed.")
+        self.assertEqual(u'bob', self.team.state[u'schedule'][u'current_person'], u"the state should be saved.")
+
+    def test_standby(self):
+        """
+        Tests that only the leader rotates.
+        """
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self.bot.is_leader = False
+        schedule._regular_task()
+        self.assertEqual((u'alice', 0), schedule.get_current_person(), u"a standby should not rotate.")
+        self.assertEqual([], self.bot.hipchat_api.topics, u"a standby should not update the topic.")
+
+    def _get_build_count(self, name):
+        built = []
+        self.bot.status_cache.get(name, lambda: built.append(name))
+        return len(built)
+
+    def test_members_changed_status(self):
+        """
+        Tests that the status resources are built again when the members change.
+        """
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        self._get_build_count(u'teams')
+        self._get_build_count(u'days_off')
+        self.team.members = [u'alice', u'bob']
+        schedule.set_members(self.team.members)
+        self.assertEqual(1, self._get_build_count(u'teams'), u"the teams should be built again.")
+        self.assertEqual(1, self._get_build_count(u'days_off'), u"the days off should be built again.")
+
+    def test_reschedule(self):
+        """
+        Tests that the rotation job is replaced when the rotation time changes.
+        """
+        schedule = Schedule(self.bot, self.team, clock=self.clock)
+        schedule.reschedule()
+        self.assertIsNone(schedule.job, u"the job should not be added before the schedule is started.")
+
+        schedule.start()
+        old_job = schedule.job
+        self._get_build_count(u'teams')
+        self.bot.config.set(u'team', u'topic_update_time', u'0 10 * * MON-FRI')
+        self.bot.settings = build_settings(self.bot.config)
+        schedule.reschedule()
+        self.assertTrue(old_job.cancelled, u"the old job should be cancelled.")
+        self.assertEqual(u'0 10 * * MON-FRI', schedule.job.cron_expr, u"the new job should use the new time.")
+        self.assertEqual(1, self._get_build_count(u'teams'), u"the next rotation time should be updated.")
@@ -0,0 +1,65 @@
+import unittest
+
+from bot.util.config import init_config
+from bot.util.settings import TopicTemplate, build_settings
+
+
+class SettingsTest(unittest.TestCase):
+    """
+    Tests for building the settings.
+    """
+
+    def setUp(self):
+        self.config = init_config(u'non-existing-config.ini')
+        self.config.set(u'team', u'members', u'alice, bob')
+
+    def test_build_settings(self):
+        """
+        Tests building the settings from a valid config.
+        """
+        self.config.set(u'team', u'cmd_burst_per_user', u'5')
+        settings = build_settings(self.config)
+        team_settings = settings.get_team(u'team')
+        self.assertEqual((u'alice', u'bob'), team_settings.members, u"the members should be kept in order.")
+        self.assertEqual(5, team_settings.cmd_burst_per_user, u"the numbers should be converted.")
+        self.assertEqual(120.0, settings.hipchat.db_resync_hours, u"the defaults should be used.")
+        self.assertEqual(settings.hipchat.room_jid, team_settings.room_jid,
+                         u"the team should use the room JID in [hipchat] by default.")
+        self.assertIsNone(settings.get_team(u'other'), u"an unknown team should give None.")
+
+    def test_invalid_config(self):
+        """
+        Tests that all errors of an invalid config are reported at once.
+        """
+        self.config.set(u'team', u'members', u'')
+        self.config.set(u'team', u'topic_update_time', u'every morning')
+        self.config.set(u'hipchat', u'send_interval', u'fast')
+        self.config.set(u'hipchat', u'db', u'')
+        self.config.set(u'hipchat', u'db_resync_hours', u'-1')
+        with self.assertRaises(RuntimeError) as context:
+            build_settings(self.config)
+        message = unicode(context.exception)
+        for option in (u'members', u'topic_update_time', u'send_interval', u'db', u'db_resync_hours'):
+            self.assertIn(u'] %s:' % option, message, u"the error of %s should be reported." % option)
+
+    def test_ha_settings(self):
+        """
+        Tests that the heartbeat interval must be shorter than the lease.
+        """
+        self.assertFalse(build_settings(self.config).ha.enabled, u"HA should be disabled by default.")
+        self.config.set(u'ha', u'enabled', u'true')
+        self.config.set(u'ha', u'heartbeat_interval', u'20')
+        with self.assertRaises(RuntimeError) as context:
+            build_settings(self.config)
+        self.assertIn(u'heartbeat_interval', unicode(context.exception),
+                      u"a heartbeat interval longer than the lease should be rejected.")
+
+    def test_topic_template(self):
+        """
+        Tests rendering a topic template.
+        """
+        template = TopicTemplate(u'<name> is on duty, ask <name>')
+        self.assertTrue(template.has_name, u"the template should contain the name.")
+        self.assertEqual(u'alice is on duty, ask alice', template.render(u'alice'),
+                         u"all placeholders should be replaced.")
+        self.assertFalse(TopicTemplate(u'no name').has_name, u"the template should not contain the name.")
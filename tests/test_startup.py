@@ -0,0 +1,53 @@
+import unittest
+
+from twisted.internet import defer, task
+
+from bot.startup import StartupTracker
+
+
+class StartupTrackerTest(unittest.TestCase):
+    """
+    Tests for StartupTracker.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.tracker = StartupTracker(clock=self.clock)
+
+    def test_when_ready(self):
+        """
+        Tests waiting for only the phases a feature needs.
+        """
+        self.tracker.begin(u'config')
+        self.tracker.begin(u'days_off')
+        self.tracker.begin(u'user_db')
+        ready = []
+        self.tracker.when_ready(u'config', u'days_off').addCallback(ready.append)
+
+        self.tracker.finish(u'config')
+        self.assertEqual([], ready, u"the feature should wait for all its phases.")
+        self.tracker.finish(u'days_off')
+        self.assertEqual([None], ready, u"the feature should be ready without waiting for the user database.")
+        self.assertTrue(self.tracker.is_ready(u'config', u'days_off'), u"the phases should be ready.")
+        self.assertFalse(self.tracker.is_ready(u'user_db'), u"the user database should not be ready.")
+
+        self.tracker.when_ready(u'config').addCallback(ready.append)
+        self.assertEqual(2, len(ready), u"waiting for a ready phase should fire right away.")
+
+    def test_run(self):
+        """
+        Tests timing the phases.
+        """
+        self.tracker.begin(u'slow')
+        d = defer.Deferred()
+        self.tracker.run(u'slow', lambda: d)
+        self.tracker.run(u'broken', lambda: 1 / 0).addErrback(lambda _: None)
+        self.clock.advance(2.5)
+        d.callback(None)
+
+        stats = self.tracker.get_stats()
+        self.assertEqual(2.5, stats[u'slow'][u'duration'], u"the duration of the phase should be measured.")
+        self.assertTrue(stats[u'slow'][u'ready'], u"the phase should be ready.")
+        self.assertFalse(stats[u'broken'][u'ready'], u"a failed phase should not be ready.")
+        self.assertEqual(u"slow 2.50s, broken failed (0.00s)", self.tracker.format_report(),
+                         u"the report should list all phases.")
@@ -0,0 +1,75 @@
+import codecs
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bot.state_store import SCHEMA_VERSION, StateStore, load_legacy_cache, migrate_state
+from bot.storage import write_file_utf8
+
+
+class StateStoreTest(unittest.TestCase):
+    """
+    Tests for StateStore.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_migrate_state(self):
+        """
+        Tests migrating the state to the current version.
+        """
+        data = migrate_state({})
+        self.assertEqual(SCHEMA_VERSION, data[u'version'], u"the state should be migrated to the current version.")
+        self.assertEqual({}, data[u'teams'], u"the teams should be empty.")
+        self.assertRaises(RuntimeError, migrate_state, {u'version': SCHEMA_VERSION + 1})
+
+    def test_load_legacy_cache(self):
+        """
+        Tests converting an old cache file.
+        """
+        cache_file = os.path.join(self.temp_dir, u'cache.txt')
+        self.assertIsNone(load_legacy_cache(cache_file, [u'alice', u'bob']), u"a missing file should give None.")
+
+        with codecs.open(cache_file, 'w', 'utf-8') as f:
+            f.write(u"[schedule]\nlast_idx = 3\n")
+        team_state = load_legacy_cache(cache_file, [u'alice', u'bob'])
+        self.assertEqual({u'current_person': u'bob', u'current_idx': 1}, team_state[u'schedule'],
+                         u"the index should be converted to the person's name.")
+
+    def test_save_and_load(self):
+        """
+        Tests writing the state file and loading it again.
+        """
+        file_path = os.path.join(self.temp_dir, u'state.json')
+        store = StateStore(None, file_path)
+        self.assertFalse(store.load(), u"the state file should not exist.")
+
+        store.get_team_state(u'team')[u'schedule'][u'current_person'] = u'alice'
+        store.get_user_db_state()[u'sync_cursor'] = {u'completed': True}
+        write_file_utf8(file_path, store.dumps())
+        self.assertFalse(os.path.exists(file_path + u'.tmp'), u"the temporary file should be renamed.")
+        with codecs.open(file_path, 'r', 'utf-8') as f:
+            self.assertEqual(SCHEMA_VERSION, json.load(f)[u'version'], u"the schema version should be saved.")
+
+        store = StateStore(None, file_path)
+        self.assertTrue(store.load(), u"the state file should be loaded.")
+        self.assertEqual(u'alice', store.get_team_state(u'team')[u'schedule'][u'current_person'],
+                         u"the team state should be loaded.")
+        self.assertEqual({u'completed': True}, store.get_user_db_state()[u'sync_cursor'],
+                         u"the sync cursor should be loaded.")
+
+    def test_read_only(self):
+        """
+        Tests that a read-only state store doesn't write the state file.
+        """
+        file_path = os.path.join(self.temp_dir, u'state.json')
+        store = StateStore(None, file_path)
+        store.read_only = True
+        store.save()
+        self.assertFalse(os.path.exists(file_path), u"the state file should not be written.")
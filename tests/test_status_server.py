@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from twisted.internet import task
+from twisted.web.test.requesthelper import DummyRequest
+
+from bot.status_server import JsonResource, StatusCache
+
+
+class StatusServerTest(unittest.TestCase):
+    """
+    Tests for the cached JSON resources of the status server.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1475312400)
+        self.cache = StatusCache(clock=self.clock)
+        self.data = {u'current_person': u'alice'}
+        self.resource = JsonResource(self.cache, u'teams', lambda: self.data)
+
+    def _get(self, etag=None):
+        request = DummyRequest([])
+        if etag is not None:
+            request.requestHeaders.setRawHeaders(b'if-none-match', [etag])
+        body = self.resource.render_GET(request)
+        return request, body
+
+    def test_cache(self):
+        """
+        Tests that a resource is only built again after it's invalidated.
+        """
+        request, body = self._get()
+        self.assertEqual(self.data, json.loads(body), u"the data should be serialized as JSON.")
+        self._get()
+        self.assertEqual((1, 1), (self.cache.build_count, self.cache.hit_count),
+                         u"the second request should be served from the cache.")
+
+        self.data = {u'current_person': u'bob'}
+        self.cache.invalidate(u'teams')
+        request, body = self._get()
+        self.assertEqual(u'bob', json.loads(body)[u'current_person'], u"the resource should be built again.")
+
+    def test_etag(self):
+        """
+        Tests conditional requests with If-None-Match.
+        """
+        request, _ = self._get()
+        etag = request.responseHeaders.getRawHeaders(b'etag')[0]
+
+        request, body = self._get(etag)
+        self.assertEqual(304, request.responseCode, u"an unchanged resource should give 304.")
+        self.assertEqual(b'', body, u"a 304 response should have no body.")
+
+        self.cache.invalidate(u'teams')
+        self.data = {u'current_person': u'bob'}
+        request, body = self._get(etag)
+        self.assertNotEqual(304, request.responseCode, u"a changed resource should be sent again.")
+
+    def test_max_age(self):
+        """
+        Tests that a resource with a maximum age is built again when it's too old.
+        """
+        resource = JsonResource(self.cache, u'health', lambda: {u'time': self.clock.seconds()}, max_age=5.0)
+        resource.render_GET(DummyRequest([]))
+        self.clock.advance(6.0)
+        resource.render_GET(DummyRequest([]))
+        self.assertEqual(2, self.cache.build_count, u"the resource should be built again after 5 seconds.")
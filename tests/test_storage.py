@@ -0,0 +1,98 @@
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.python.failure import Failure
+
+from bot.storage import FileStorage, write_file_utf8
+
+
+class FakeThreadPool(object):
+    """
+    Runs the queued functions when run_next() is called, in the calling thread.
+    """
+
+    def __init__(self):
+        self.queue = []
+
+    def callInThreadWithCallback(self, on_result, func, *args, **kwargs):
+        self.queue.append((on_result, func, args, kwargs))
+
+    def run_next(self):
+        on_result, func, args, kwargs = self.queue.pop(0)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            on_result(False, Failure(e))
+        else:
+            on_result(True, result)
+
+
+class FakeReactor(object):
+
+    def callFromThread(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+def read_file(file_path):
+    with codecs.open(file_path, 'r', 'utf-8') as f:
+        return f.read()
+
+
+class FileStorageTest(unittest.TestCase):
+    """
+    Tests for FileStorage.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, u'state.json')
+        self.thread_pool = FakeThreadPool()
+        self.storage = FileStorage(thread_pool=self.thread_pool, reactor=FakeReactor())
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_order(self):
+        """
+        Tests that the writes to the same file are done one at a time in the order they are requested.
+        """
+        other_file_path = os.path.join(self.temp_dir, u'other.txt')
+        done = []
+        self.storage.write(self.file_path, u'first').addCallback(lambda _: done.append(u'first'))
+        self.storage.write(self.file_path, u'second').addCallback(lambda _: done.append(u'second'))
+        self.storage.write(other_file_path, u'other').addCallback(lambda _: done.append(u'other'))
+        self.assertEqual(2, len(self.thread_pool.queue),
+                         u"the second write should wait for the first one, other files should not wait.")
+        self.assertEqual([], done, u"the writes should only be reported when they're done.")
+
+        self.thread_pool.run_next()
+        self.assertEqual([u'first'], done, u"only the first write should be done.")
+        self.assertEqual(u'first', read_file(self.file_path), u"the first data should be written.")
+
+        self.thread_pool.run_next()
+        self.assertEqual([u'first', u'other'], done, u"the write to the other file should be done.")
+        self.thread_pool.run_next()
+        self.assertEqual([u'first', u'other', u'second'], done, u"the second write should be done.")
+        self.assertEqual(u'second', read_file(self.file_path), u"the last data should be written last.")
+
+    def test_failed_write(self):
+        """
+        Tests that a failed write leaves the old file intact and doesn't block the next writes.
+        """
+        write_file_utf8(self.file_path, u'old')
+        d = self.storage.write(self.file_path, object())
+        self.thread_pool.run_next()
+        failures = []
+        d.addErrback(failures.append)
+        self.assertEqual(1, len(failures), u"the failure should be reported.")
+        self.assertEqual(u'old', read_file(self.file_path), u"the old file should be intact.")
+
+        done = []
+        self.storage.write(self.file_path, u'new \xe9').addCallback(done.append)
+        self.thread_pool.run_next()
+        self.assertEqual([self.file_path], done, u"the next write should be done.")
+        self.assertEqual(u'new \xe9', read_file(self.file_path), u"the new data should be written as utf-8.")
+        self.assertFalse(os.path.exists(self.file_path + u'.tmp'), u"the temporary file should be renamed.")
@@ -73,3 +73,18 @@ class TeamRoundRobinSchedulerTest(unittest.TestCase):
         parser.remove(u'alice', [u'MON'])
         self.assertEqual((u'alice', 0), scheduler.switch_to_next_person(monday),
                          u"The current person should be alice.")
+
+    def test_set_current_person_by_name(self):
+        """
+        Tests setting the current person by a name prefix.
+        """
+        team_list = [u'alice', u'alan', u'bob']
+        parser = DaysOffParser()
+        scheduler = TeamRoundRobinScheduler(team_list, parser)
+
+        self.assertEqual(u'bob', scheduler.set_current_person(u'B'),
+                         u"The current person should be bob.")
+        self.assertIsNone(scheduler.set_current_person(u'al'),
+                          u"'al' matches more than one person.")
+        self.assertEqual((u'bob', 2), scheduler.get_current_person(),
+                         u"The current person should still be bob.")